@@ -0,0 +1,125 @@
+"""
+Бенчмарк разбора дат: быстрый путь services.date_parsing против чистого dateparser.
+
+    python benchmarks/bench_date_parsing.py [iterations] [--db path/to/bot_v2.db]
+
+Корпус — benchmarks/date_corpus.txt: сохраненные значения events.time (отображение в списках и
+напоминаниях) и ответы пользователей (ввод даты мероприятия и срока). С --db сохраненные значения
+берутся из events рабочей базы — читается только колонка time.
+Если dateparser не установлен, меряется только быстрый путь.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import date_parsing  # noqa: E402
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'date_corpus.txt')
+NOW = datetime(2025, 10, 19, 12, 0)
+
+
+def load_corpus(path=CORPUS_PATH):
+    sections = {}
+    current = None
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+            if line.startswith('[') and line.endswith(']'):
+                current = sections.setdefault(line[1:-1], [])
+            elif current is not None:
+                current.append(line)
+    return sections.get('stored', []), sections.get('input', [])
+
+
+def load_stored_from_db(db_path):
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        return [row[0] for row in conn.execute("SELECT time FROM events WHERE time IS NOT NULL")]
+    finally:
+        conn.close()
+
+
+def bench(label, fn, samples, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for s in samples:
+            fn(s)
+    elapsed = time.perf_counter() - start
+    per_call = elapsed / (iterations * len(samples)) * 1e6
+    print(f"{label:<28} {elapsed * 1000:9.1f} ms total, {per_call:8.2f} us/call")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк разбора дат')
+    parser.add_argument('iterations', type=int, nargs='?', default=200)
+    parser.add_argument('--db', help='брать сохраненные значения events.time из этой базы')
+    args = parser.parse_args()
+    iterations = args.iterations
+
+    stored, inputs = load_corpus()
+    if args.db:
+        stored = load_stored_from_db(args.db)
+    print(f"corpus: {len(stored)} stored ({len(set(stored))} distinct), {len(inputs)} inputs")
+
+    # Отображение сохраненного времени: кэш _parse_stored холодный и прогретый.
+    # Значения вне _STORED_FORMATS уходят в dateparser — их только перечисляем
+    unparsed = sorted({s for s in stored if date_parsing._parse_stored(s) is None})
+    if unparsed:
+        print(f"  {len(unparsed)} stored values outside _STORED_FORMATS, e.g. {unparsed[:5]}")
+    stored = [s for s in stored if date_parsing._parse_stored(s) is not None]
+
+    def display_uncached(s):
+        date_parsing._parse_stored.cache_clear()
+        return date_parsing.format_event_time_display(s)
+
+    bench("display (no cache)", display_uncached, stored, iterations)
+    bench("display (cached)", date_parsing.format_event_time_display, stored, iterations)
+
+    # Ввод пользователя
+    def fast_uncached(s):
+        date_parsing._parse_cached.cache_clear()
+        return date_parsing.parse_ru_datetime(s, NOW)
+
+    fast_inputs = [s for s in inputs if date_parsing._fast_parse(date_parsing._normalize(s), NOW) is not None]
+    print(f"fast path covers {len(fast_inputs)}/{len(inputs)} inputs")
+    bench("fast path (no cache)", lambda s: date_parsing._fast_parse(date_parsing._normalize(s), NOW),
+          inputs, iterations)
+
+    try:
+        import dateparser
+    except ImportError:
+        print("dateparser не установлен — сравнение пропущено")
+        return
+
+    bench("input (no cache)", fast_uncached, inputs, max(1, iterations // 10))
+    bench("input (cached)", lambda s: date_parsing.parse_ru_datetime(s, NOW), inputs, iterations)
+
+    settings = {
+        'PREFER_DATES_FROM': 'future',
+        'DATE_ORDER': 'DMY',
+        'TIMEZONE': 'Europe/Moscow',
+        'RETURN_AS_TIMEZONE_AWARE': False,
+        'RELATIVE_BASE': NOW,
+    }
+    bench("dateparser", lambda s: dateparser.parse(s, languages=["ru"], settings=settings),
+          inputs, max(1, iterations // 10))
+
+    mismatches = 0
+    for s in fast_inputs:
+        ours = date_parsing._fast_parse(date_parsing._normalize(s), NOW)
+        theirs = dateparser.parse(s, languages=["ru"], settings=settings)
+        if theirs is not None and ours != theirs:
+            mismatches += 1
+            print(f"  mismatch: {s!r}: fast={ours} dateparser={theirs}")
+    print(f"mismatches: {mismatches}/{len(fast_inputs)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Бенчмарк services.recurrence против dateutil.rrule на длинных горизонтах.
+
+    python benchmarks/bench_recurrence.py [years]
+
+Проверяет совпадение дат и меряет время полного перебора и окна в конце горизонта.
+Если python-dateutil не установлен, меряется только services.recurrence.
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.recurrence import occurrences  # noqa: E402
+
+BASE = '2024-01-01 10:00'
+
+# (label, freq, interval, byweekday, bymonthday, bysetpos, dateutil kwargs builder)
+CASES = [
+    ('daily', 'daily', 1, None, None, None),
+    ('every 2 weeks MO,WE,FR', 'weekly', 2, 'MO,WE,FR', None, None),
+    ('monthly 1,15,-1', 'monthly', 1, None, '1,15,-1', None),
+    ('monthly last friday', 'monthly', 1, 'FR', None, -1),
+    ('monthly 2nd tuesday', 'monthly', 1, '2TU', None, None),
+    ('yearly', 'yearly', 1, None, None, None),
+    # Номер дня недели считается по всему месяцу/году, BYMONTHDAY только пересекается с ним
+    ('monthly 1SA & 8..14', 'monthly', 1, '1SA', '8,9,10,11,12,13,14', None),
+    ('yearly 2MO,2FR & 15', 'yearly', 1, '2MO,2FR', '15', None),
+    ('monthly 1SA,2FR & -1', 'monthly', 1, '1SA,2FR', '-1', None),
+]
+
+
+def template_row(freq, interval, byweekday, bymonthday, bysetpos, exceptions_json=None):
+    return (0, 1, 'bench', None, 'recurring', BASE, 'Europe/Moscow', 60, 0,
+            freq, interval, byweekday, bymonthday, bysetpos, None, None, exceptions_json)
+
+
+def dateutil_rule(freq, interval, byweekday, bymonthday, bysetpos):
+    from dateutil import rrule
+    freqs = {'daily': rrule.DAILY, 'weekly': rrule.WEEKLY, 'monthly': rrule.MONTHLY, 'yearly': rrule.YEARLY}
+    wd = {'MO': rrule.MO, 'TU': rrule.TU, 'WE': rrule.WE, 'TH': rrule.TH, 'FR': rrule.FR, 'SA': rrule.SA, 'SU': rrule.SU}
+    kwargs = {'interval': interval, 'dtstart': datetime.strptime(BASE, '%Y-%m-%d %H:%M')}
+    if byweekday:
+        days = []
+        for token in byweekday.split(','):
+            n, code = token[:-2], token[-2:]
+            days.append(wd[code](int(n)) if n else wd[code])
+        kwargs['byweekday'] = days
+    if bymonthday:
+        kwargs['bymonthday'] = [int(x) for x in bymonthday.split(',')]
+    if bysetpos:
+        kwargs['bysetpos'] = bysetpos
+    return rrule.rrule(freqs[freq], **kwargs)
+
+
+def timed(fn, repeat=3):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best * 1000
+
+
+def main():
+    years = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    start = datetime.strptime(BASE, '%Y-%m-%d %H:%M')
+    end = start + timedelta(days=365 * years)
+    window_start = end - timedelta(days=30)
+
+    try:
+        import dateutil  # noqa: F401
+        have_dateutil = True
+    except ImportError:
+        have_dateutil = False
+        print("python-dateutil не установлен — сравнение пропущено")
+
+    print(f"horizon: {years} years")
+    for label, *fields in CASES:
+        tpl = template_row(*fields)
+        ours, ours_ms = timed(lambda: list(occurrences(tpl, start, end)))
+        _, ours_win_ms = timed(lambda: list(occurrences(tpl, window_start, end)))
+        line = f"{label:<26} n={len(ours):<6} full {ours_ms:8.2f} ms  last-30d {ours_win_ms:7.3f} ms"
+        if have_dateutil:
+            rule = dateutil_rule(*fields)
+            theirs, theirs_ms = timed(lambda: rule.between(start, end, inc=True))
+            _, theirs_win_ms = timed(lambda: rule.between(window_start, end, inc=True))
+            status = 'ok' if ours == theirs else f'MISMATCH ({len(theirs)})'
+            line += f" | dateutil full {theirs_ms:8.2f} ms  last-30d {theirs_win_ms:7.3f} ms  {status}"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,19 @@
 import asyncio
+import functools
+import hashlib
 import logging
+from collections import OrderedDict
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import CommandStart
 from aiogram.types import ChatMemberUpdated
 from aiogram.enums import ChatMemberStatus
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
-import dateparser
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
 
-from services.repositories import UserRepo, GroupRepo, RoleRepo, NotificationRepo, EventRepo, EventNotificationRepo, PersonalEventNotificationRepo, DispatchLogRepo
+from services.repositories import UserRepo, GroupRepo, RoleRepo, NotificationRepo, EventRepo, EventNotificationRepo, PersonalEventNotificationRepo, DispatchLogRepo, TemplateGenerator
+from services.task_queue import ChatTaskQueue
+from services.date_parsing import parse_ru_datetime, parse_event_time, format_event_time_display
 from config import BOT_TOKEN, SUPERADMIN_ID, BOT_NAME
 
 
@@ -27,6 +31,37 @@ logging.basicConfig(level=logging.INFO)
 bot = Bot(token=BOT_TOKEN)
 dp = Dispatcher()
 
+# Тяжелые callback-обработчики: ответ на callback сразу, работа — в очереди своего чата
+# (последовательно внутри чата, параллельно между чатами, не более max_concurrency одновременно)
+CALLBACK_QUEUE = ChatTaskQueue(max_concurrency=8)
+
+
+def ack_first(ack_text: str | None = None):
+    """Decorator for callback handlers: answer the callback immediately, then run the handler on CALLBACK_QUEUE.
+
+    The wrapped handler must not call callback.answer() itself; use notify_after_ack for late messages.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(callback: types.CallbackQuery, **_kwargs):
+            try:
+                await callback.answer(ack_text)
+            except Exception:
+                # Ignore expired/invalid query id errors
+                pass
+            chat_id = callback.message.chat.id if callback.message else callback.from_user.id
+            CALLBACK_QUEUE.submit(chat_id, lambda: handler(callback), label=handler.__name__)
+        return wrapper
+    return decorator
+
+
+async def notify_after_ack(callback: types.CallbackQuery, text: str) -> None:
+    """The callback is already answered, so an alert is no longer possible: tell the user in a private message."""
+    try:
+        await bot.send_message(callback.from_user.id, text)
+    except Exception as e:
+        logging.debug(f"notify_after_ack failed for user {callback.from_user.id}: {e}")
+
 def is_user_blocked_bot(telegram_id: int) -> bool:
     """Check if user is blocked in the system by looking at the blocked field in database."""
     try:
@@ -49,7 +84,7 @@ async def handle_blocked_user_interaction(user_id: int, telegram_id: int, intera
 
 async def send_missed_notifications():
     """Send notifications that were missed due to bot downtime (within last 30 minutes)."""
-    from services.repositories import get_conn
+    from services.repositories import get_conn, shard_ids
     msk = ZoneInfo("Europe/Moscow")
     now = datetime.now(msk)
     cutoff_time = now - timedelta(minutes=30)
@@ -57,178 +92,180 @@ async def send_missed_notifications():
     print(f"[MISSED_NOTIFICATIONS] Checking for missed notifications since {cutoff_time}")
     
     # Check for missed group notifications
-    with get_conn() as conn:
-        cur = conn.cursor()
-        # Get all group notifications that should have been sent in the last 30 minutes
-        cur.execute("""
-            SELECT en.event_id, en.time_before, en.time_unit, en.message_text, 
-                   e.name, e.time, e.group_id
-            FROM event_notifications en
-            JOIN events e ON en.event_id = e.id
-            WHERE NOT EXISTS (
-                SELECT 1 FROM notification_dispatch_log ndl 
-                WHERE ndl.kind = 'event' 
-                AND ndl.event_id = en.event_id 
-                AND ndl.time_before = en.time_before 
-                AND ndl.time_unit = en.time_unit
-            )
-        """)
-        missed_group_notifications = cur.fetchall()
+    # С шардами пропущенные оповещения ищем в каждом файле шарда
+    for shard in shard_ids():
+        with get_conn(shard=shard) as conn:
+            cur = conn.cursor()
+            # Get all group notifications that should have been sent in the last 30 minutes
+            cur.execute("""
+                SELECT en.event_id, en.time_before, en.time_unit, en.message_text, 
+                       e.name, e.time, e.group_id
+                FROM event_notifications en
+                JOIN events e ON en.event_id = e.id
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM notification_dispatch_log ndl 
+                    WHERE ndl.kind = 'event' 
+                    AND ndl.event_id = en.event_id 
+                    AND ndl.time_before = en.time_before 
+                    AND ndl.time_unit = en.time_unit
+                )
+            """)
+            missed_group_notifications = cur.fetchall()
         
-        for event_id, time_before, time_unit, message_text, event_name, event_time, group_id in missed_group_notifications:
-            try:
-                # Parse event time
-                evt_dt = None
-                for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M'):
-                    try:
-                        evt_dt = datetime.strptime(event_time, fmt).replace(tzinfo=msk)
-                        break
-                    except Exception:
-                        pass
+            for event_id, time_before, time_unit, message_text, event_name, event_time, group_id in missed_group_notifications:
+                try:
+                    # Parse event time
+                    evt_dt = None
+                    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M'):
+                        try:
+                            evt_dt = datetime.strptime(event_time, fmt).replace(tzinfo=msk)
+                            break
+                        except Exception:
+                            pass
                 
-                if evt_dt is None:
-                    continue
+                    if evt_dt is None:
+                        continue
                 
-                # Calculate when notification should have been sent
-                delta_minutes = 0
-                if time_unit == 'minutes':
-                    delta_minutes = time_before
-                elif time_unit == 'hours':
-                    delta_minutes = time_before * 60
-                elif time_unit == 'days':
-                    delta_minutes = time_before * 1440
-                elif time_unit == 'weeks':
-                    delta_minutes = time_before * 10080
-                elif time_unit == 'months':
-                    delta_minutes = time_before * 43200
+                    # Calculate when notification should have been sent
+                    delta_minutes = 0
+                    if time_unit == 'minutes':
+                        delta_minutes = time_before
+                    elif time_unit == 'hours':
+                        delta_minutes = time_before * 60
+                    elif time_unit == 'days':
+                        delta_minutes = time_before * 1440
+                    elif time_unit == 'weeks':
+                        delta_minutes = time_before * 10080
+                    elif time_unit == 'months':
+                        delta_minutes = time_before * 43200
                 
-                notify_dt = evt_dt - timedelta(minutes=delta_minutes)
+                    notify_dt = evt_dt - timedelta(minutes=delta_minutes)
                 
-                # Check if notification was supposed to be sent in the last 30 minutes
-                if cutoff_time <= notify_dt <= now:
-                    print(f"[MISSED_NOTIFICATIONS] Sending missed group notification for event {event_id}")
+                    # Check if notification was supposed to be sent in the last 30 minutes
+                    if cutoff_time <= notify_dt <= now:
+                        print(f"[MISSED_NOTIFICATIONS] Sending missed group notification for event {event_id}")
                     
-                    # Send group notification
-                    group_row = GroupRepo.get_by_id(group_id)
-                    if group_row:
-                        chat_id = group_row[1]
-                        text = f"🔔 Напоминание о мероприятии\n📅 {event_name}\n🕒 {format_event_time_display(event_time)}"
-                        if message_text:
-                            text += f"\n\n{message_text}"
+                        # Send group notification
+                        group_row = GroupRepo.get_by_id(group_id)
+                        if group_row:
+                            chat_id = group_row[1]
+                            text = f"🔔 Напоминание о мероприятии\n📅 {event_name}\n🕒 {format_event_time_display(event_time)}"
+                            if message_text:
+                                text += f"\n\n{message_text}"
                         
-                        try:
-                            await bot.send_message(chat_id, text)
-                            DispatchLogRepo.mark_sent('event', user_id=None, group_id=group_id, event_id=event_id, time_before=time_before, time_unit=time_unit)
-                            print(f"[MISSED_NOTIFICATIONS] Sent missed group notification for event {event_id}")
-                        except Exception as e:
-                            print(f"[MISSED_NOTIFICATIONS] Failed to send missed group notification for event {event_id}: {e}")
+                            try:
+                                await bot.send_message(chat_id, text)
+                                DispatchLogRepo.mark_sent('event', user_id=None, group_id=group_id, event_id=event_id, time_before=time_before, time_unit=time_unit)
+                                print(f"[MISSED_NOTIFICATIONS] Sent missed group notification for event {event_id}")
+                            except Exception as e:
+                                print(f"[MISSED_NOTIFICATIONS] Failed to send missed group notification for event {event_id}: {e}")
                             
-            except Exception as e:
-                print(f"[MISSED_NOTIFICATIONS] Error processing missed group notification for event {event_id}: {e}")
+                except Exception as e:
+                    print(f"[MISSED_NOTIFICATIONS] Error processing missed group notification for event {event_id}: {e}")
         
-        # Check for missed personal notifications
-        cur.execute("""
-            SELECT pen.user_id, pen.event_id, pen.time_before, pen.time_unit, pen.message_text,
-                   e.name, e.time, e.group_id
-            FROM personal_event_notifications pen
-            JOIN events e ON pen.event_id = e.id
-            WHERE NOT EXISTS (
-                SELECT 1 FROM notification_dispatch_log ndl 
-                WHERE ndl.kind = 'personal' 
-                AND ndl.user_id = pen.user_id
-                AND ndl.event_id = pen.event_id 
-                AND ndl.time_before = pen.time_before 
-                AND ndl.time_unit = pen.time_unit
-            )
-        """)
-        missed_personal_notifications = cur.fetchall()
+            # Check for missed personal notifications
+            cur.execute("""
+                SELECT pen.user_id, pen.event_id, pen.time_before, pen.time_unit, pen.message_text,
+                       e.name, e.time, e.group_id
+                FROM personal_event_notifications pen
+                JOIN events e ON pen.event_id = e.id
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM notification_dispatch_log ndl 
+                    WHERE ndl.kind = 'personal' 
+                    AND ndl.user_id = pen.user_id
+                    AND ndl.event_id = pen.event_id 
+                    AND ndl.time_before = pen.time_before 
+                    AND ndl.time_unit = pen.time_unit
+                )
+            """)
+            missed_personal_notifications = cur.fetchall()
         
-        for user_id, event_id, time_before, time_unit, message_text, event_name, event_time, group_id in missed_personal_notifications:
-            try:
-                # Parse event time
-                evt_dt = None
-                for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M'):
-                    try:
-                        evt_dt = datetime.strptime(event_time, fmt).replace(tzinfo=msk)
-                        break
-                    except Exception:
-                        pass
+            for user_id, event_id, time_before, time_unit, message_text, event_name, event_time, group_id in missed_personal_notifications:
+                try:
+                    # Parse event time
+                    evt_dt = None
+                    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M'):
+                        try:
+                            evt_dt = datetime.strptime(event_time, fmt).replace(tzinfo=msk)
+                            break
+                        except Exception:
+                            pass
                 
-                if evt_dt is None:
-                    continue
+                    if evt_dt is None:
+                        continue
                 
-                # Calculate when notification should have been sent
-                delta_minutes = 0
-                if time_unit == 'minutes':
-                    delta_minutes = time_before
-                elif time_unit == 'hours':
-                    delta_minutes = time_before * 60
-                elif time_unit == 'days':
-                    delta_minutes = time_before * 1440
-                elif time_unit == 'weeks':
-                    delta_minutes = time_before * 10080
-                elif time_unit == 'months':
-                    delta_minutes = time_before * 43200
+                    # Calculate when notification should have been sent
+                    delta_minutes = 0
+                    if time_unit == 'minutes':
+                        delta_minutes = time_before
+                    elif time_unit == 'hours':
+                        delta_minutes = time_before * 60
+                    elif time_unit == 'days':
+                        delta_minutes = time_before * 1440
+                    elif time_unit == 'weeks':
+                        delta_minutes = time_before * 10080
+                    elif time_unit == 'months':
+                        delta_minutes = time_before * 43200
                 
-                notify_dt = evt_dt - timedelta(minutes=delta_minutes)
+                    notify_dt = evt_dt - timedelta(minutes=delta_minutes)
                 
-                # Check if notification was supposed to be sent in the last 30 minutes
-                if cutoff_time <= notify_dt <= now:
-                    print(f"[MISSED_NOTIFICATIONS] Sending missed personal notification for event {event_id} to user {user_id}")
+                    # Check if notification was supposed to be sent in the last 30 minutes
+                    if cutoff_time <= notify_dt <= now:
+                        print(f"[MISSED_NOTIFICATIONS] Sending missed personal notification for event {event_id} to user {user_id}")
                     
-                    # Get user info
-                    u = UserRepo.get_by_id(user_id)
-                    if u:
-                        _iid, _tid, _uname, _phone, _first, _last, _blocked = u
+                        # Get user info
+                        u = UserRepo.get_by_id(user_id)
+                        if u:
+                            _iid, _tid, _uname, _phone, _first, _last, _blocked = u
                         
-                        # Build personal message
-                        grp_row = GroupRepo.get_by_id(group_id)
-                        group_title = grp_row[2] if grp_row else f"Группа {group_id}"
+                            # Build personal message
+                            grp_row = GroupRepo.get_by_id(group_id)
+                            group_title = grp_row[2] if grp_row else f"Группа {group_id}"
                         
-                        # Find user's roles for this event
-                        try:
-                            from services.repositories import EventRoleAssignmentRepo
-                            user_roles = [r for r, uid in EventRoleAssignmentRepo.list_for_event(event_id) if uid == user_id]
-                        except Exception:
-                            user_roles = []
+                            # Find user's roles for this event
+                            try:
+                                from services.repositories import EventRoleAssignmentRepo
+                                user_roles = [r for r, uid in EventRoleAssignmentRepo.list_for_event(event_id) if uid == user_id]
+                            except Exception:
+                                user_roles = []
                         
-                        lines = [
-                            f"🔔 Личное напоминание в группе \"{group_title}\"",
-                            f"📅 Мероприятие: \"{event_name}\"",
-                            f"🕒 {format_event_time_display(event_time)}",
-                        ]
-                        if user_roles:
-                            lines.append(f"Роли: {', '.join(user_roles)}")
-                        if message_text:
-                            lines.append("")
-                            lines.append(str(message_text))
-                        text = "\n".join(lines)
+                            lines = [
+                                f"🔔 Личное напоминание в группе \"{group_title}\"",
+                                f"📅 Мероприятие: \"{event_name}\"",
+                                f"🕒 {format_event_time_display(event_time)}",
+                            ]
+                            if user_roles:
+                                lines.append(f"Роли: {', '.join(user_roles)}")
+                            if message_text:
+                                lines.append("")
+                                lines.append(str(message_text))
+                            text = "\n".join(lines)
                         
-                        try:
-                            await bot.send_message(_tid, text)
-                            DispatchLogRepo.mark_sent('personal', user_id=user_id, group_id=None, event_id=event_id, time_before=time_before, time_unit=time_unit)
-                            print(f"[MISSED_NOTIFICATIONS] Sent missed personal notification for event {event_id} to user {user_id}")
-                        except Exception as e:
-                            # Check if user blocked the bot
-                            if "bot was blocked by the user" in str(e).lower() or "chat not found" in str(e).lower():
-                                print(f"[MISSED_NOTIFICATIONS] User {user_id} (telegram_id: {_tid}) blocked the bot. Marking as sent.")
+                            try:
+                                await bot.send_message(_tid, text)
                                 DispatchLogRepo.mark_sent('personal', user_id=user_id, group_id=None, event_id=event_id, time_before=time_before, time_unit=time_unit)
-                            else:
-                                print(f"[MISSED_NOTIFICATIONS] Failed to send missed personal notification for event {event_id} to user {user_id}: {e}")
+                                print(f"[MISSED_NOTIFICATIONS] Sent missed personal notification for event {event_id} to user {user_id}")
+                            except Exception as e:
+                                # Check if user blocked the bot
+                                if "bot was blocked by the user" in str(e).lower() or "chat not found" in str(e).lower():
+                                    print(f"[MISSED_NOTIFICATIONS] User {user_id} (telegram_id: {_tid}) blocked the bot. Marking as sent.")
+                                    DispatchLogRepo.mark_sent('personal', user_id=user_id, group_id=None, event_id=event_id, time_before=time_before, time_unit=time_unit)
+                                else:
+                                    print(f"[MISSED_NOTIFICATIONS] Failed to send missed personal notification for event {event_id} to user {user_id}: {e}")
                                 
-            except Exception as e:
-                print(f"[MISSED_NOTIFICATIONS] Error processing missed personal notification for event {event_id} to user {user_id}: {e}")
+                except Exception as e:
+                    print(f"[MISSED_NOTIFICATIONS] Error processing missed personal notification for event {event_id} to user {user_id}: {e}")
     
     print(f"[MISSED_NOTIFICATIONS] Finished checking for missed notifications")
 
 @dp.callback_query(lambda c: c.data and c.data.startswith('roles_refresh:'))
+@ack_first("Обновлено")
 async def cb_roles_refresh(callback: types.CallbackQuery):
     try:
         _, eid, gid = callback.data.split(':', 2)
         eid_i = int(eid); gid_i = int(gid)
     except Exception as e:
-        return await callback.answer(f"Ошибка: {e}")
-    await callback.answer("Обновлено")
+        return await notify_after_ack(callback, f"Ошибка: {e}")
     try:
         await refresh_role_keyboard(callback.message, gid_i, eid_i, callback.from_user.id)
     except Exception:
@@ -250,21 +287,113 @@ AWAITING_ADMIN_INPUT: dict[int, dict] = {}  # user_id -> {gid, mode: 'add'|'remo
 AWAITING_EVENT_NOTIF: dict[int, dict] = {}  # user_id -> {eid, gid, edit_chat_id, edit_message_id, prompt_message_id}
 AWAITING_PERSONAL_NOTIF: dict[int, dict] = {}  # user_id -> {eid, gid, edit_chat_id, edit_message_id, prompt_message_id}
 
+# Чаты зарегистрированных групп (telegram_chat_id). Заполняется при старте и обновляется
+# при создании групп ботом; периодически перечитывается, т.к. веб может удалять группы.
+KNOWN_GROUP_CHAT_IDS: set[str] = set()
+
+
+def load_known_groups() -> None:
+    try:
+        chat_ids = set(GroupRepo.list_chat_ids())
+    except Exception as e:
+        logging.exception(f"Failed to load known groups: {e}")
+        return
+    KNOWN_GROUP_CHAT_IDS.clear()
+    KNOWN_GROUP_CHAT_IDS.update(chat_ids)
+    logging.info(f"Known groups loaded: {len(chat_ids)}")
+
 # Единое сообщение-меню на пользователя
 MENU_STATE: dict[int, dict] = {}  # user_id -> {chat_id, message_id}
 
+# Кэш последнего отрисованного содержимого: (chat_id, message_id) -> {'text': hash|None, 'markup': hash|None}
+# Позволяет не дергать Telegram API, если текст и клавиатура не изменились.
+RENDER_CACHE: "OrderedDict[tuple[int, int], dict]" = OrderedDict()
+RENDER_CACHE_MAX = 5000
+RENDER_STATS = {'edits': 0, 'skipped': 0}
+
+
+def _content_hash(payload: str | None) -> str | None:
+    if payload is None:
+        return None
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _markup_hash(markup) -> str | None:
+    if markup is None:
+        return None
+    try:
+        payload = markup.model_dump_json(exclude_none=True)
+    except Exception:
+        payload = repr(markup)
+    return _content_hash(payload)
+
+
+def _remember_render(chat_id: int, message_id: int, text_h: str | None, markup_h: str | None) -> None:
+    key = (int(chat_id), int(message_id))
+    RENDER_CACHE[key] = {'text': text_h, 'markup': markup_h}
+    RENDER_CACHE.move_to_end(key)
+    while len(RENDER_CACHE) > RENDER_CACHE_MAX:
+        RENDER_CACHE.popitem(last=False)
+
+
+def _is_not_modified_error(e: Exception) -> bool:
+    return 'message is not modified' in str(e).lower()
+
+
+async def edit_message_cached(chat_id: int, message_id: int, text: str, markup=None) -> None:
+    """edit_message_text, пропускающий вызов, если содержимое совпадает с последним отрисованным."""
+    key = (int(chat_id), int(message_id))
+    text_h = _content_hash(text)
+    markup_h = _markup_hash(markup)
+    cached = RENDER_CACHE.get(key)
+    if cached is not None and cached['text'] == text_h and cached['markup'] == markup_h:
+        RENDER_STATS['skipped'] += 1
+        RENDER_CACHE.move_to_end(key)
+        logging.debug(f"[RENDER_CACHE] skip edit chat={chat_id} msg={message_id} (saved={RENDER_STATS['skipped']})")
+        return
+    try:
+        await bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, reply_markup=markup)
+    except Exception as e:
+        if not _is_not_modified_error(e):
+            RENDER_CACHE.pop(key, None)
+            raise
+    RENDER_STATS['edits'] += 1
+    _remember_render(chat_id, message_id, text_h, markup_h)
+
+
+async def edit_markup_cached(chat_id: int, message_id: int, markup) -> None:
+    """edit_message_reply_markup с тем же кэшем; текст сообщения при этом не сравнивается."""
+    key = (int(chat_id), int(message_id))
+    markup_h = _markup_hash(markup)
+    cached = RENDER_CACHE.get(key)
+    if cached is not None and cached['markup'] == markup_h:
+        RENDER_STATS['skipped'] += 1
+        RENDER_CACHE.move_to_end(key)
+        logging.debug(f"[RENDER_CACHE] skip markup edit chat={chat_id} msg={message_id} (saved={RENDER_STATS['skipped']})")
+        return
+    try:
+        await bot.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=markup)
+    except Exception as e:
+        if not _is_not_modified_error(e):
+            RENDER_CACHE.pop(key, None)
+            raise
+    RENDER_STATS['edits'] += 1
+    _remember_render(chat_id, message_id, cached['text'] if cached else None, markup_h)
+
+
 async def set_menu_message(user_id: int, chat_id: int, text: str, markup: types.InlineKeyboardMarkup | None):
     state = MENU_STATE.get(user_id)
     if state and state.get('chat_id') == chat_id:
         # Пытаемся редактировать текущее меню
         try:
-            await bot.edit_message_text(text, chat_id=chat_id, message_id=state['message_id'], reply_markup=markup)
+            await edit_message_cached(chat_id, state['message_id'], text, markup)
             return
         except Exception:
             pass
     # Если не получилось — отправляем новое и запоминаем
     msg = await bot.send_message(chat_id, text, reply_markup=markup)
     MENU_STATE[user_id] = {'chat_id': chat_id, 'message_id': msg.message_id}
+    _remember_render(chat_id, msg.message_id, _content_hash(text), _markup_hash(markup))
 
 async def safe_answer(callback: types.CallbackQuery) -> None:
     try:
@@ -322,7 +451,7 @@ async def refresh_personal_notifications_view(message: types.Message, event_id:
     kb.row(types.InlineKeyboardButton(text="⬅️ Назад", callback_data=f"evt_open:{event_id}:{group_id}"))
     
     text = "\n".join(lines)
-    await bot.edit_message_text(text, chat_id=message.chat.id, message_id=message.message_id, reply_markup=kb.as_markup())
+    await edit_message_cached(message.chat.id, message.message_id, text, kb.as_markup())
 
 async def refresh_event_notifications_view(message: types.Message, event_id: int, group_id: int, user_id: int):
     """Refresh the event notifications view."""
@@ -378,7 +507,7 @@ async def refresh_event_notifications_view(message: types.Message, event_id: int
     kb.row(types.InlineKeyboardButton(text="⬅️ Назад", callback_data=f"evt_open:{event_id}:{group_id}"))
     
     text = "\n".join(lines)
-    await bot.edit_message_text(text, chat_id=message.chat.id, message_id=message.message_id, reply_markup=kb.as_markup())
+    await edit_message_cached(message.chat.id, message.message_id, text, kb.as_markup())
 
 # Variants that refresh by explicit chat/message ids to avoid constructing Message objects
 async def refresh_personal_notifications_view_ids(edit_chat_id: int, edit_message_id: int, event_id: int, group_id: int, user_id: int):
@@ -417,7 +546,7 @@ async def refresh_personal_notifications_view_ids(edit_chat_id: int, edit_messag
     kb.row(types.InlineKeyboardButton(text="Произвольное", callback_data=f"evt_personal_notif_add_free:{event_id}:{group_id}"))
     kb.row(types.InlineKeyboardButton(text="⬅️ Назад", callback_data=f"evt_open:{event_id}:{group_id}"))
     text = "\n".join(lines)
-    await bot.edit_message_text(text, chat_id=edit_chat_id, message_id=edit_message_id, reply_markup=kb.as_markup())
+    await edit_message_cached(edit_chat_id, edit_message_id, text, kb.as_markup())
 
 async def refresh_event_notifications_view_ids(edit_chat_id: int, edit_message_id: int, event_id: int, group_id: int, user_id: int):
     from aiogram.utils.keyboard import InlineKeyboardBuilder
@@ -457,7 +586,7 @@ async def refresh_event_notifications_view_ids(edit_chat_id: int, edit_message_i
         kb.row(types.InlineKeyboardButton(text="Произвольное", callback_data=f"evt_notif_add_free:{event_id}:{group_id}"))
     kb.row(types.InlineKeyboardButton(text="⬅️ Назад", callback_data=f"evt_open:{event_id}:{group_id}"))
     text = "\n".join(lines)
-    await bot.edit_message_text(text, chat_id=edit_chat_id, message_id=edit_message_id, reply_markup=kb.as_markup())
+    await edit_message_cached(edit_chat_id, edit_message_id, text, kb.as_markup())
 
 # Утилиты форматирования и парсинга сроков
 def calculate_notification_time(event_time_str: str, time_before: int, time_unit: str) -> str:
@@ -583,36 +712,6 @@ def parse_duration_ru(text: str) -> int:
     return total
 
 
-def parse_ru_datetime(text: str) -> datetime | None:
-    """Парсит русскоязычное описание даты/времени в datetime (локальное время)."""
-    dt = dateparser.parse(
-        text,
-        languages=["ru"],
-        settings={
-            'PREFER_DATES_FROM': 'future',
-            'DATE_ORDER': 'DMY',
-            'TIMEZONE': 'Europe/Moscow',
-            'RETURN_AS_TIMEZONE_AWARE': False,
-        },
-    )
-    return dt
-
-def format_event_time_display(time_str: str) -> str:
-    """Пытается привести время к виду ДД.ММ.ГГГГ ЧЧ:ММ:СС для отображения."""
-    # Попытка распарсить ISO "YYYY-MM-DD HH:MM:SS" или другие
-    try_formats = ["%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%d.%m.%Y %H:%M:%S", "%d.%m.%Y %H:%M"]
-    for fmt in try_formats:
-        try:
-            dt = datetime.strptime(time_str, fmt)
-            return dt.strftime("%d.%m.%Y %H:%M:%S")
-        except Exception:
-            pass
-    # Как fallback попробуем dateparser
-    dt2 = dateparser.parse(time_str, languages=["ru"], settings={'DATE_ORDER': 'DMY'})
-    if dt2:
-        return dt2.strftime("%d.%m.%Y %H:%M:%S")
-    return time_str
-
 def can_edit_event_notifications(user_id: int, event_id: int) -> bool:
     """Owner/admin/superadmin only (responsible no longer allowed)."""
     if is_superadmin(user_id):
@@ -653,6 +752,7 @@ async def on_chat_member_update(event: ChatMemberUpdated):
         existing = GroupRepo.get_by_chat_id(chat_id)
         if not existing:
             group_id = GroupRepo.create(chat_id, title, owner_user_id)
+            KNOWN_GROUP_CHAT_IDS.add(chat_id)
             # Create default role template "Ответственный"
             try:
                 from services.repositories import GroupRoleTemplateRepo
@@ -671,6 +771,7 @@ async def on_chat_member_update(event: ChatMemberUpdated):
                 "Добавляйте мероприятия — напомню вовремя и покажу актуальные брони."
             )
         else:
+            KNOWN_GROUP_CHAT_IDS.add(chat_id)
             logging.info("Group already registered, skipping")
 
 
@@ -764,63 +865,130 @@ async def start(message: types.Message):
         logging.exception(f"Failed to confirm pending admin: {e}")
 
 
-# Обработчики кнопок
-@dp.callback_query(lambda c: c.data and c.data.startswith('grp_events:'))
-async def cb_group_events(callback: types.CallbackQuery):
-    print(f"DEBUG: cb_group_events called with data: {callback.data}")
-    
-    # Check if user is blocked in the system
-    if is_user_blocked_bot(callback.from_user.id):
-        await handle_blocked_user_interaction(None, callback.from_user.id, "group events callback")
-        return
-    
-    gid = int(callback.data.split(':', 1)[1])
-    await safe_answer(callback)
+# Список мероприятий группы: постраничный, с курсором (time, id) в callback_data
+EVENTS_PAGE_SIZE = 8
+
+
+def _encode_time_cursor(time_str: str) -> str:
+    """'2025-09-18 22:30:00' -> '20250918223000' (укладываемся в 64 байта callback_data)."""
+    return ''.join(ch for ch in time_str if ch.isdigit())
+
+
+def _decode_time_cursor(digits: str) -> str:
+    if len(digits) == 14:
+        return f"{digits[0:4]}-{digits[4:6]}-{digits[6:8]} {digits[8:10]}:{digits[10:12]}:{digits[12:14]}"
+    if len(digits) == 12:
+        return f"{digits[0:4]}-{digits[4:6]}-{digits[6:8]} {digits[8:10]}:{digits[10:12]}"
+    raise ValueError(f"bad cursor: {digits}")
+
+
+def build_group_events_page(gid: int, telegram_id: int, direction: str | None = None, cursor: tuple[str, int] | None = None):
+    """Render one page of upcoming events. direction: None (first page) | 'n' (after cursor) | 'p' (before cursor)."""
     from aiogram.utils.keyboard import InlineKeyboardBuilder
-    # Resolve current internal user
-    urow = UserRepo.get_by_telegram_id(callback.from_user.id)
-    internal_user_id = urow[0] if urow else None
-    # Only future events
-    from datetime import datetime as _dt
-    events_all = EventRepo.list_by_group(gid)
-    events = []
-    for eid, name, time_str, resp_uid in events_all:
-        try:
-            # support with and without seconds
-            dt = None
-            for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M'):
-                try:
-                    dt = _dt.strptime(time_str, fmt)
-                    break
-                except Exception:
-                    continue
-            if dt is None:
-                dt = _dt.fromisoformat(time_str)
-            if dt >= _dt.utcnow():
-                events.append((eid, name, time_str, resp_uid))
-        except Exception:
-            # if parse fails, show anyway
-            events.append((eid, name, time_str, resp_uid))
+    # Время мероприятий хранится как локальное (МСК) время без таймзоны
+    from_iso = datetime.now(ZoneInfo("Europe/Moscow")).strftime('%Y-%m-%d %H:%M')
+    limit = EVENTS_PAGE_SIZE
+    # Виртуальные повторения ленивых шаблонов идут в общем порядке (time, id) с id = -template_id
+    if direction == 'p' and cursor is not None:
+        rows = EventRepo.list_upcoming_page(gid, from_iso, before=cursor, limit=limit)
+        rows = sorted(rows + TemplateGenerator.virtual_occurrences(gid, from_iso, until=cursor),
+                      key=lambda r: (r[2], r[0]))[-(limit + 1):]
+        has_prev = len(rows) > limit
+        events = rows[-limit:]
+        has_next = True
+    else:
+        after = cursor if direction == 'n' else None
+        rows = EventRepo.list_upcoming_page(gid, from_iso, after=after, limit=limit)
+        rows = sorted(rows + TemplateGenerator.virtual_occurrences(gid, from_iso, after=after, limit=limit + 1),
+                      key=lambda r: (r[2], r[0]))[:limit + 1]
+        has_next = len(rows) > limit
+        events = rows[:limit]
+        has_prev = after is not None
     kb = InlineKeyboardBuilder()
     lines = [f"Мероприятия (ID группы {gid})"]
     if events:
+        total = EventRepo.count_upcoming(gid, from_iso) + TemplateGenerator.count_virtual_occurrences(gid, from_iso)
+        if total > limit:
+            lines[0] += f" — всего {total}"
         for eid, name, time_str, _resp_uid in events:
             time_disp = format_event_time_display(time_str)
             lines.append(f"• {name}\n{time_disp}")
             # Only an Open button in the list; booking is managed inside the event card
-            kb.button(text=f"Открыть: {name}", callback_data=f"evt_open:{eid}:{gid}")
+            if eid < 0:
+                # Повторение ленивого шаблона: событие создается при открытии
+                kb.button(text=f"Открыть: {name}", callback_data=f"vocc_open:{-eid}:{_encode_time_cursor(time_str)}:{gid}")
+            else:
+                kb.button(text=f"Открыть: {name}", callback_data=f"evt_open:{eid}:{gid}")
         kb.adjust(1)
+        nav = []
+        if has_prev:
+            first = events[0]
+            nav.append(types.InlineKeyboardButton(text="◀️ Ранее", callback_data=f"grp_events:{gid}:p:{_encode_time_cursor(first[2])}:{first[0]}"))
+        if has_next:
+            last = events[-1]
+            nav.append(types.InlineKeyboardButton(text="Далее ▶️", callback_data=f"grp_events:{gid}:n:{_encode_time_cursor(last[2])}:{last[0]}"))
+        if nav:
+            kb.row(*nav)
     else:
         lines.append("Пока нет мероприятий")
     # Кнопки действий (создание) и назад
     # Hide "+ Создать" for plain members
+    urow = UserRepo.get_by_telegram_id(telegram_id)
+    internal_user_id = urow[0] if urow else None
     role = RoleRepo.get_user_role(internal_user_id, gid) if internal_user_id is not None else None
-    if role in ("owner", "admin") or is_superadmin(callback.from_user.id):
+    if role in ("owner", "admin") or is_superadmin(telegram_id):
         kb.row(types.InlineKeyboardButton(text="+ Создать", callback_data=f"evt_create:{gid}"))
     kb.row(types.InlineKeyboardButton(text="⬅️ Назад", callback_data=f"grp_menu:{gid}"))
-    await set_menu_message(callback.from_user.id, callback.message.chat.id, "\n".join(lines), kb.as_markup())
+    return "\n".join(lines), kb.as_markup()
+
+
+# Обработчики кнопок
+@dp.callback_query(lambda c: c.data and c.data.startswith('grp_events:'))
+@ack_first()
+async def cb_group_events(callback: types.CallbackQuery):
+    # Check if user is blocked in the system
+    if is_user_blocked_bot(callback.from_user.id):
+        await handle_blocked_user_interaction(None, callback.from_user.id, "group events callback")
+        return
+    
+    # grp_events:{gid} или grp_events:{gid}:{n|p}:{time_digits}:{eid}
+    parts = callback.data.split(':')
+    gid = int(parts[1])
+    direction = None
+    cursor = None
+    if len(parts) == 5 and parts[2] in ('n', 'p'):
+        try:
+            cursor = (_decode_time_cursor(parts[3]), int(parts[4]))
+            direction = parts[2]
+        except ValueError:
+            cursor = None
+    text, markup = build_group_events_page(gid, callback.from_user.id, direction, cursor)
+    await set_menu_message(callback.from_user.id, callback.message.chat.id, text, markup)
+
+@dp.callback_query(lambda c: c.data and c.data.startswith('vocc_open:'))
+@ack_first()
+async def cb_virtual_occurrence_open(callback: types.CallbackQuery):
+    """Открытие виртуального повторения ленивого шаблона: создаем событие и показываем его карточку."""
+    if is_user_blocked_bot(callback.from_user.id):
+        await handle_blocked_user_interaction(None, callback.from_user.id, "virtual occurrence open callback")
+        return
+    try:
+        _, tid, digits, gid = callback.data.split(':')
+        key = _decode_time_cursor(digits)
+        tid_i, gid_i = int(tid), int(gid)
+    except ValueError:
+        return
+    urow = UserRepo.get_by_telegram_id(callback.from_user.id)
+    eid = await asyncio.to_thread(TemplateGenerator.materialize, tid_i, key, urow[0] if urow else None)
+    if not eid:
+        await callback.message.answer("Мероприятие не найдено")
+        return
+    # Дальше — обычная карточка мероприятия (без повторного ответа на callback)
+    await cb_event_open.__wrapped__(callback.model_copy(update={'data': f"evt_open:{eid}:{gid_i}"}))
+
 
 @dp.callback_query(lambda c: c.data and c.data.startswith('evt_open:'))
+@ack_first()
 async def cb_event_open(callback: types.CallbackQuery):
     print(f"DEBUG: cb_event_open called with data: {callback.data}")
     
@@ -834,8 +1002,6 @@ async def cb_event_open(callback: types.CallbackQuery):
         eid_i = int(eid)
         gid_i = int(gid)
         print(f"DEBUG: Parsed eid_i={eid_i}, gid_i={gid_i}")
-        await callback.answer()
-        print(f"DEBUG: After callback.answer()")
         from aiogram.utils.keyboard import InlineKeyboardBuilder
         print(f"DEBUG: Before EventRepo.get_by_id")
         ev = EventRepo.get_by_id(eid_i)
@@ -913,39 +1079,8 @@ async def cb_event_delete(callback: types.CallbackQuery):
         print(f"DELETE ERROR: {e}")
         await callback.answer(f"Ошибка: {e}")
     # refresh list: only future events, compact, without responsibles
-    from aiogram.utils.keyboard import InlineKeyboardBuilder
-    gid_i = int(gid)
-    events_all = EventRepo.list_by_group(gid_i)
-    from datetime import datetime as _dt
-    events = []
-    if events_all:
-        for eid2, name2, time_str2, resp_uid2 in events_all:
-            try:
-                dt2 = None
-                for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M'):
-                    try:
-                        dt2 = _dt.strptime(time_str2, fmt)
-                        break
-                    except Exception:
-                        continue
-                if dt2 is None:
-                    dt2 = _dt.fromisoformat(time_str2)
-                if dt2 >= _dt.utcnow():
-                    events.append((eid2, name2, time_str2))
-            except Exception:
-                events.append((eid2, name2, time_str2))
-    kb = InlineKeyboardBuilder()
-    lines = [f"Мероприятия (ID группы {gid_i})"]
-    if events:
-        for eid2, name2, time_str2 in events:
-            lines.append(f"• {name2}\n{format_event_time_display(time_str2)}")
-            kb.button(text=f"Открыть: {name2}", callback_data=f"evt_open:{eid2}:{gid_i}")
-        kb.adjust(1)
-    else:
-        lines.append("Пока нет мероприятий")
-    kb.row(types.InlineKeyboardButton(text="+ Создать", callback_data=f"evt_create:{gid_i}"))
-    kb.row(types.InlineKeyboardButton(text="⬅️ Назад", callback_data=f"grp_menu:{gid_i}"))
-    await set_menu_message(callback.from_user.id, callback.message.chat.id, "\n".join(lines), kb.as_markup())
+    text, markup = build_group_events_page(int(gid), callback.from_user.id)
+    await set_menu_message(callback.from_user.id, callback.message.chat.id, text, markup)
 
 @dp.callback_query(lambda c: c.data and c.data.startswith('evt_assign:'))
 async def cb_event_assign(callback: types.CallbackQuery):
@@ -1362,13 +1497,13 @@ async def cb_group_remind_period(callback: types.CallbackQuery):
         await bot.send_message(target_chat_id, text, reply_markup=kb_ev.as_markup())
 
 @dp.callback_query(lambda c: c.data and c.data.startswith('role_book:'))
+@ack_first()
 async def cb_role_book(callback: types.CallbackQuery):
     try:
         _, eid, gid, role_name = callback.data.split(':', 3)
         eid_i = int(eid); gid_i = int(gid)
-        await callback.answer()
     except Exception as e:
-        return await callback.answer(f"Ошибка: {e}", show_alert=True)
+        return await notify_after_ack(callback, f"Ошибка: {e}")
     # Ensure user exists in our DB
     urow = UserRepo.get_by_telegram_id(callback.from_user.id)
     if not urow:
@@ -1390,7 +1525,7 @@ async def cb_role_book(callback: types.CallbackQuery):
         if not allow_multi:
             existing = [uid for _r, uid in EventRoleAssignmentRepo.list_for_event(eid_i) if uid == user_id]
             if existing:
-                return await callback.answer("Допустима только 1 бронь в этом мероприятии", show_alert=True)
+                return await notify_after_ack(callback, "Допустима только 1 бронь в этом мероприятии")
     except Exception:
         pass
     if EventRoleAssignmentRepo.assign(eid_i, role_name, user_id):
@@ -1414,20 +1549,20 @@ async def cb_role_book(callback: types.CallbackQuery):
             pass
         await refresh_role_keyboard(callback.message, gid_i, eid_i, callback.from_user.id)
     else:
-        await callback.answer("Роль уже занята или бронь недоступна", show_alert=True)
+        await notify_after_ack(callback, "Роль уже занята или бронь недоступна")
 
 @dp.callback_query(lambda c: c.data and c.data.startswith('role_unbook:'))
+@ack_first()
 async def cb_role_unbook(callback: types.CallbackQuery):
     try:
         _, eid, gid, role_name = callback.data.split(':', 3)
         eid_i = int(eid); gid_i = int(gid)
-        await callback.answer()
     except Exception as e:
-        return await callback.answer(f"Ошибка: {e}")
+        return await notify_after_ack(callback, f"Ошибка: {e}")
     urow = UserRepo.get_by_telegram_id(callback.from_user.id)
     user_id = urow[0] if urow else None
     if not user_id:
-        return await callback.answer("Нет пользователя", show_alert=True)
+        return await notify_after_ack(callback, "Нет пользователя")
     from services.repositories import EventRoleAssignmentRepo, RoleRepo, PersonalEventNotificationRepo
     # Admins/owners can unassign any user; find current assignee for this role
     try:
@@ -1460,7 +1595,7 @@ async def cb_role_unbook(callback: types.CallbackQuery):
                 leftovers = []
                 try:
                     from services.repositories import get_conn
-                    with get_conn() as conn:
+                    with get_conn(event_id=eid_i) as conn:
                         cur = conn.cursor()
                         cur.execute("SELECT 1 FROM personal_event_notifications WHERE user_id=? AND event_id=? LIMIT 1", (target_uid, eid_i))
                         leftovers = cur.fetchall()
@@ -1472,7 +1607,7 @@ async def cb_role_unbook(callback: types.CallbackQuery):
             pass
         await refresh_role_keyboard(callback.message, gid_i, eid_i, callback.from_user.id)
     else:
-        await callback.answer("Нельзя снять чужую бронь", show_alert=True)
+        await notify_after_ack(callback, "Нельзя снять чужую бронь")
 
 @dp.callback_query(lambda c: c.data and c.data.startswith('evt_book_toggle:'))
 async def cb_evt_book_toggle(callback: types.CallbackQuery):
@@ -1560,7 +1695,7 @@ async def refresh_role_keyboard(message: types.Message, gid: int, eid: int, invo
     if is_private:
         kb.row(types.InlineKeyboardButton(text="⬅️ Назад", callback_data=f"grp_events:{gid}"))
     try:
-        await bot.edit_message_reply_markup(chat_id=message.chat.id, message_id=message.message_id, reply_markup=kb.as_markup())
+        await edit_markup_cached(message.chat.id, message.message_id, kb.as_markup())
     except Exception:
         pass
 
@@ -1626,9 +1761,9 @@ async def cb_evt_notify_now(callback: types.CallbackQuery):
     await callback.answer("Оповещение отправлено")
 
 @dp.callback_query(lambda c: c.data and c.data.startswith('grp_menu:'))
+@ack_first()
 async def cb_group_menu(callback: types.CallbackQuery):
     gid = int(callback.data.split(':', 1)[1])
-    await callback.answer()
     # callback.from_user.id — это Telegram ID, нужно получить внутренний user_id
     urow = UserRepo.get_by_telegram_id(callback.from_user.id)
     internal_user_id = urow[0] if urow else None
@@ -1792,7 +1927,7 @@ async def on_freeform_input(message: types.Message):
         # Обновляем исходное сообщение с меню
         header, markup = build_notifies_ui(gid)
         try:
-            await bot.edit_message_text(header, chat_id=ctx['edit_chat_id'], message_id=ctx['edit_message_id'], reply_markup=markup)
+            await edit_message_cached(ctx['edit_chat_id'], ctx['edit_message_id'], header, markup)
         except Exception:
             pass
         # Удаляем подсказку и ввод пользователя
@@ -1819,7 +1954,7 @@ async def on_freeform_input(message: types.Message):
                 ectx['step'] = 'time'
                 # rewrite prompt to next step and delete user's message
                 try:
-                    await bot.edit_message_text("Введите дату/время мероприятия (свободный формат)", chat_id=ectx['edit_chat_id'], message_id=ectx['prompt_message_id'])
+                    await edit_message_cached(ectx['edit_chat_id'], ectx['prompt_message_id'], "Введите дату/время мероприятия (свободный формат)")
                 except Exception:
                     pass
                 try:
@@ -1835,7 +1970,7 @@ async def on_freeform_input(message: types.Message):
                 if not dt:
                     # keep prompt, ask again
                     try:
-                        await bot.edit_message_text("Не понял дату/время. Примеры: '22 сентября 8 утра', '22/09/2025 11 часов'", chat_id=ectx['edit_chat_id'], message_id=ectx['prompt_message_id'])
+                        await edit_message_cached(ectx['edit_chat_id'], ectx['prompt_message_id'], "Не понял дату/время. Примеры: '22 сентября 8 утра', '22/09/2025 11 часов'")
                     except Exception:
                         pass
                     try:
@@ -1864,39 +1999,9 @@ async def on_freeform_input(message: types.Message):
                 except Exception:
                     pass
                 # refresh events list (only future, no responsibles in text)
-                from aiogram.utils.keyboard import InlineKeyboardBuilder
-                events_all = EventRepo.list_by_group(gid)
-                from datetime import datetime as _dt
-                events = []
-                for eid, name, time_str, resp_uid in events_all:
-                    try:
-                        dt = None
-                        for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M'):
-                            try:
-                                dt = _dt.strptime(time_str, fmt)
-                                break
-                            except Exception:
-                                continue
-                        if dt is None:
-                            dt = _dt.fromisoformat(time_str)
-                        if dt >= _dt.utcnow():
-                            events.append((eid, name, time_str, resp_uid))
-                    except Exception:
-                        events.append((eid, name, time_str, resp_uid))
-                kb = InlineKeyboardBuilder()
-                lines = [f"Мероприятия (ID группы {gid})"]
-                if events:
-                    for eid, name, time_str, _resp_uid in events:
-                        time_disp = format_event_time_display(time_str)
-                        lines.append(f"• {name}\n{time_disp}")
-                        kb.button(text=f"Открыть: {name}", callback_data=f"evt_open:{eid}:{gid}")
-                    kb.adjust(1)
-                else:
-                    lines.append("Пока нет мероприятий")
-                kb.row(types.InlineKeyboardButton(text="+ Создать", callback_data=f"evt_create:{gid}"))
-                kb.row(types.InlineKeyboardButton(text="⬅️ Назад", callback_data=f"grp_menu:{gid}"))
+                list_text, list_markup = build_group_events_page(gid, message.from_user.id)
                 try:
-                    await bot.edit_message_text("\n".join(lines), chat_id=ectx['edit_chat_id'], message_id=ectx['edit_message_id'], reply_markup=kb.as_markup())
+                    await edit_message_cached(ectx['edit_chat_id'], ectx['edit_message_id'], list_text, list_markup)
                 except Exception:
                     pass
                 # Cleanup prompt and user input
@@ -1929,7 +2034,7 @@ async def on_freeform_input(message: types.Message):
                 except Exception:
                     pass
                 try:
-                    await bot.edit_message_text("Пользователь не найден. Введите @username или ID Telegram ещё раз", chat_id=ectx['edit_chat_id'], message_id=ectx['prompt_message_id'])
+                    await edit_message_cached(ectx['edit_chat_id'], ectx['prompt_message_id'], "Пользователь не найден. Введите @username или ID Telegram ещё раз")
                 except Exception:
                     pass
                 return
@@ -1981,7 +2086,7 @@ async def on_freeform_input(message: types.Message):
                     resp_text2 = 'не назначен'
                 text = f"{name}\nВремя: {format_event_time_display(time_str)}"
                 try:
-                    await bot.edit_message_text(text, chat_id=ectx['edit_chat_id'], message_id=ectx['edit_message_id'], reply_markup=kb.as_markup())
+                    await edit_message_cached(ectx['edit_chat_id'], ectx['edit_message_id'], text, kb.as_markup())
                 except Exception:
                     pass
             # Cleanup prompt and user input
@@ -2037,7 +2142,7 @@ async def on_freeform_input(message: types.Message):
             # show updated admins without constructing fake Message/CallbackQuery
             header, markup = build_admins_ui(gid)
             try:
-                await bot.edit_message_text(header, chat_id=actx['edit_chat_id'], message_id=actx['edit_message_id'], reply_markup=markup)
+                await edit_message_cached(actx['edit_chat_id'], actx['edit_message_id'], header, markup)
             except Exception:
                 pass
             AWAITING_ADMIN_INPUT.pop(uid, None)
@@ -2078,7 +2183,7 @@ async def on_freeform_input(message: types.Message):
             new_name = (message.text or '').strip()
             if not new_name:
                 try:
-                    await bot.edit_message_text("Название не может быть пустым. Введите новое название.", chat_id=eedit['edit_chat_id'], message_id=eedit['prompt_message_id'])
+                    await edit_message_cached(eedit['edit_chat_id'], eedit['prompt_message_id'], "Название не может быть пустым. Введите новое название.")
                 except Exception:
                     pass
                 try:
@@ -2140,7 +2245,7 @@ async def on_freeform_input(message: types.Message):
                 # Compact display without responsible section
                 text = f"{name}\nВремя: {format_event_time_display(time_str)}"
                 try:
-                    await bot.edit_message_text(text, chat_id=eedit['edit_chat_id'], message_id=eedit['edit_message_id'], reply_markup=kb.as_markup())
+                    await edit_message_cached(eedit['edit_chat_id'], eedit['edit_message_id'], text, kb.as_markup())
                 except Exception:
                     pass
             # cleanup
@@ -2168,7 +2273,7 @@ async def on_freeform_input(message: types.Message):
                 dt = parse_ru_datetime(raw)
             if not dt:
                 try:
-                    await bot.edit_message_text("Не понял дату/время. Примеры: '22 сентября 8 утра', '15.09.2025 00:00'", chat_id=eedit['edit_chat_id'], message_id=eedit['prompt_message_id'])
+                    await edit_message_cached(eedit['edit_chat_id'], eedit['prompt_message_id'], "Не понял дату/время. Примеры: '22 сентября 8 утра', '15.09.2025 00:00'")
                 except Exception:
                     pass
                 try:
@@ -2229,7 +2334,7 @@ async def on_freeform_input(message: types.Message):
                 # Compact display without responsible section
                 text = f"{name}\nВремя: {format_event_time_display(time_str)}"
                 try:
-                    await bot.edit_message_text(text, chat_id=eedit['edit_chat_id'], message_id=eedit['edit_message_id'], reply_markup=kb.as_markup())
+                    await edit_message_cached(eedit['edit_chat_id'], eedit['edit_message_id'], text, kb.as_markup())
                 except Exception:
                     pass
             # cleanup
@@ -2259,28 +2364,12 @@ async def on_freeform_input(message: types.Message):
                 await message.answer("Мероприятие не найдено")
                 return
             _id, _name, time_str, _group_id, _resp = ev
-            nt = None
-            for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%d.%m.%Y %H:%M:%S", "%d.%m.%Y %H:%M"):
-                try:
-                    nt = datetime.strptime(text, fmt)
-                    break
-                except Exception:
-                    pass
-            if nt is None:
-                nt = dateparser.parse(text, languages=["ru"], settings={'DATE_ORDER': 'DMY'})
+            nt = parse_ru_datetime(text)
             if nt is None:
                 await message.answer("Не удалось распознать срок. Укажите, например: '2 дня' или '18.09.2025 22:30'")
                 return
             # parse event time to compute minutes before
-            evt_dt = None
-            for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%d.%m.%Y %H:%M:%S", "%d.%m.%Y %H:%M"):
-                try:
-                    evt_dt = datetime.strptime(time_str, fmt)
-                    break
-                except Exception:
-                    pass
-            if evt_dt is None:
-                evt_dt = dateparser.parse(time_str, languages=["ru"], settings={'DATE_ORDER': 'DMY'})
+            evt_dt = parse_event_time(time_str)
             if evt_dt is None:
                 await message.answer("Не удалось распознать время мероприятия")
                 return
@@ -2347,9 +2436,13 @@ def _register_group_if_needed_from_message(message: types.Message) -> None:
     if message.chat.type not in ("group", "supergroup"):
         return
     chat_id = str(message.chat.id)
+    # Горячий путь: уже известная группа — только проверка по множеству, без запроса в БД
+    if chat_id in KNOWN_GROUP_CHAT_IDS:
+        return
     title = message.chat.title or 'Без названия'
     existing = GroupRepo.get_by_chat_id(chat_id)
     if existing:
+        KNOWN_GROUP_CHAT_IDS.add(chat_id)
         return
     user = message.from_user
     owner_user_id = UserRepo.upsert_user(
@@ -2360,6 +2453,7 @@ def _register_group_if_needed_from_message(message: types.Message) -> None:
         last_name=user.last_name,
     )
     group_id = GroupRepo.create(chat_id, title, owner_user_id)
+    KNOWN_GROUP_CHAT_IDS.add(chat_id)
     # Create default role template "Ответственный"
     try:
         from services.repositories import GroupRoleTemplateRepo
@@ -2374,10 +2468,12 @@ def _register_group_if_needed_from_message(message: types.Message) -> None:
 # --- Generic logging handlers + auto-register on first message ---
 @dp.message()
 async def log_any_message(message: types.Message):
-    logging.info(
-        f"message: chat_type={message.chat.type}, chat_id={message.chat.id}, user_id={message.from_user.id}, "
-        f"username={message.from_user.username}, text={message.text!r}"
-    )
+    # Per-message logging is DEBUG only: busy groups would otherwise flood the log
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(
+            f"message: chat_type={message.chat.type}, chat_id={message.chat.id}, user_id={message.from_user.id}, "
+            f"username={message.from_user.username}, text={message.text!r}"
+        )
     try:
         _register_group_if_needed_from_message(message)
     except Exception as e:
@@ -2400,6 +2496,7 @@ async def log_callback(callback: types.CallbackQuery):
 async def main():
     from database.init_db import init_db
     init_db()
+    load_known_groups()
     
     # Check for missed notifications on startup
     print("[STARTUP] Checking for missed notifications...")
@@ -2518,7 +2615,7 @@ async def main():
                             DispatchLogRepo.mark_sent('event', user_id=None, group_id=gid, event_id=eid, time_before=time_before, time_unit=time_unit)
                 # Personal notifications (DM to users)
                 from services.repositories import get_conn
-                with get_conn() as conn:
+                with get_conn(event_id=eid) as conn:
                     cur = conn.cursor()
                     cur.execute("SELECT user_id, time_before, time_unit, message_text FROM personal_event_notifications WHERE event_id = ?", (eid,))
                     personals = cur.fetchall()
@@ -2575,6 +2672,111 @@ async def main():
                                         print(f"[TICK] Failed to send personal notification to user {user_id} (telegram_id: {_tid}): {e}")
 
     scheduler.add_job(tick_send_due, 'interval', minutes=1, id='notify_tick')
+    # Группы могут удаляться из веб-интерфейса — перечитываем множество известных чатов
+    scheduler.add_job(load_known_groups, 'interval', minutes=10, id='known_groups_reload')
+
+    async def extend_template_horizons():
+        # Повторяющиеся шаблоны: досоздаем события до now + planning_horizon_days
+        created = await asyncio.to_thread(TemplateGenerator.extend_recurring)
+        if created:
+            logging.info(f"[TEMPLATE_GEN] rolling horizon: created {created} events")
+
+    scheduler.add_job(extend_template_horizons, 'interval', hours=1, id='template_horizon',
+                      next_run_time=datetime.now(ZoneInfo("Europe/Moscow")))
+
+    async def log_runtime_stats():
+        q = CALLBACK_QUEUE.stats()
+        logging.info(
+            f"[STATS] callbacks processed={q['processed']} failed={q['failed']} dropped={q['dropped']} "
+            f"pending={q['pending']} chats={q['active_chats']} queue_latency avg={q['latency_avg_ms']:.1f}ms "
+            f"p95={q['latency_p95_ms']:.1f}ms max={q['latency_max_ms']:.1f}ms; "
+            f"edits sent={RENDER_STATS['edits']} skipped={RENDER_STATS['skipped']}"
+        )
+
+    scheduler.add_job(log_runtime_stats, 'interval', minutes=15, id='runtime_stats')
+
+    async def archive_audit_log():
+        # Старые строки аудита уезжают в помесячные файлы data/audit_archive, горячая таблица остается маленькой
+        from services.audit_archive import archive_old
+        try:
+            await asyncio.to_thread(archive_old)
+        except Exception as e:
+            logging.error(f"[AUDIT_ARCHIVE] failed: {e}")
+
+    scheduler.add_job(archive_audit_log, 'cron', hour=4, minute=20, id='audit_archive')
+
+    async def archive_past_events():
+        # Давно прошедшие мероприятия с ролями, записями и оповещениями — в *_archive, тик и списки видят только живые
+        from services.event_archive import archive_past_events as _archive_events
+        try:
+            await asyncio.to_thread(_archive_events)
+        except Exception as e:
+            logging.error(f"[EVENT_ARCHIVE] failed: {e}")
+
+    scheduler.add_job(archive_past_events, 'cron', hour=4, minute=40, id='event_archive')
+
+    async def prune_change_log():
+        # Журнал изменений (services/change_log.py) растет на каждую запись — держим только последние часы
+        from services.change_log import prune
+        try:
+            await asyncio.to_thread(prune)
+        except Exception as e:
+            logging.error(f"[CHANGE_LOG] prune failed: {e}")
+
+    scheduler.add_job(prune_change_log, 'interval', hours=1, id='change_log_prune')
+
+    async def db_backup():
+        from database.backup import BACKUP_DIR, backup
+        from database.init_db import DB_PATH
+        from services.sharding import database_files
+        # Шарды — в свои подкаталоги со своей ротацией; копии файлов снимаются по очереди, не в одну точку времени
+        for shard, path in database_files(DB_PATH):
+            try:
+                await asyncio.to_thread(backup, path, backup_dir=BACKUP_DIR if shard is None else BACKUP_DIR / f"shard_{shard}")
+            except Exception as e:
+                logging.error(f"[DB_BACKUP] {path.name} failed: {e}")
+
+    # Копия пишется порциями с паузами — бот продолжает работать; до архивации и обслуживания
+    scheduler.add_job(db_backup, 'cron', hour=3, minute=50, id='db_backup')
+
+    from database.backup import SNAPSHOT_REFRESH_SECONDS
+
+    async def refresh_snapshot():
+        # Снимок для аналитики и старых страниц аудита в вебе (services.repositories.get_read_conn)
+        from database.backup import refresh_snapshot as _refresh
+        from database.init_db import DB_PATH
+        from services.repositories import snapshot_path
+        try:
+            seconds = await asyncio.to_thread(_refresh, DB_PATH, snapshot_path())
+            logging.debug(f"[SNAPSHOT] refreshed in {seconds:.2f}s")
+        except Exception as e:
+            logging.error(f"[SNAPSHOT] refresh failed: {e}")
+
+    if SNAPSHOT_REFRESH_SECONDS > 0:
+        scheduler.add_job(refresh_snapshot, 'interval', seconds=SNAPSHOT_REFRESH_SECONDS, id='db_snapshot',
+                          next_run_time=datetime.now(ZoneInfo("Europe/Moscow")), max_instances=1, coalesce=True)
+
+    async def db_maintenance():
+        # Ночное обслуживание базы; если рядом с запуском есть напоминания — повторяем проверку позже
+        from database.init_db import DB_PATH
+        from database.maintenance import is_quiet, run_maintenance
+        from services.sharding import database_files
+        paths = [path for _shard, path in database_files(DB_PATH)]
+        for _attempt in range(6):
+            try:
+                # С шардами напоминания лежат в файлах шардов — тихо должно быть во всех
+                if all([await asyncio.to_thread(is_quiet, path) for path in paths]):
+                    for path in paths:
+                        await asyncio.to_thread(run_maintenance, path)
+                    return
+            except Exception as e:
+                logging.error(f"[DB_MAINT] failed: {e}")
+                return
+            await asyncio.sleep(300)
+        logging.info("[DB_MAINT] skipped: reminders due around every attempt")
+
+    # После архивации (меньше мертвых строк) и не в :00/:30, когда напоминаний больше всего
+    scheduler.add_job(db_maintenance, 'cron', hour=5, minute=7, id='db_maintenance')
     scheduler.start()
     await dp.start_polling(bot)
 
@@ -0,0 +1,142 @@
+"""
+Онлайн-резервные копии базы через SQLite backup API.
+
+Копирование идет порциями по BACKUP_STEP_PAGES страниц с паузой между порциями: блокировка чтения
+на исходной базе держится только на время одной порции, поэтому бот и веб продолжают писать.
+Если во время копирования базу изменили, SQLite начинает копию заново; после BACKUP_MAX_RESTARTS перезапусков
+(база пишется непрерывно) копия снимается за один проход — одна короткая блокировка чтения вместо бесконечных повторов.
+Копия пишется во временный файл, проверяется PRAGMA integrity_check и только потом переименовывается.
+
+Тем же способом собирается снимок для тяжелых чтений (refresh_snapshot).
+
+Ротация: последние BACKUP_KEEP копий + самая новая копия каждой из BACKUP_KEEP_WEEKLY предыдущих недель.
+Шарды (services/sharding.py) копируются в свои подкаталоги BACKUP_DIR/shard_N с той же ротацией.
+
+CLI: python -m database.init_db backup [--list]
+"""
+import os
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import List
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+BACKUP_DIR = Path(os.getenv('BACKUP_DIR') or (BASE_DIR / 'data' / 'backups'))
+BACKUP_KEEP = int(os.getenv('BACKUP_KEEP', '7'))
+BACKUP_KEEP_WEEKLY = int(os.getenv('BACKUP_KEEP_WEEKLY', '4'))
+BACKUP_STEP_PAGES = 256
+BACKUP_STEP_SLEEP = 0.05
+BACKUP_MAX_RESTARTS = 3
+# Период обновления снимка для чтения (задание бота); 0 — не обновлять. Допустимый возраст — SNAPSHOT_MAX_AGE в repositories
+SNAPSHOT_REFRESH_SECONDS = int(os.getenv('SNAPSHOT_REFRESH_SECONDS', '300'))
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def list_backups(backup_dir: Path = BACKUP_DIR) -> List[Path]:
+    """Completed backups, newest first."""
+    if not backup_dir.exists():
+        return []
+    return sorted(backup_dir.glob('bot_v2_????????_??????.db'), reverse=True)
+
+
+def _backup_time(path: Path) -> datetime:
+    return datetime.strptime(path.stem[len('bot_v2_'):], '%Y%m%d_%H%M%S')
+
+
+def rotate(keep: int = BACKUP_KEEP, keep_weekly: int = BACKUP_KEEP_WEEKLY, backup_dir: Path = BACKUP_DIR) -> List[Path]:
+    """Deletes backups outside the rotation policy. Returns removed files."""
+    backups = list_backups(backup_dir)
+    kept = set(backups[:keep])
+    weeks = []
+    for path in backups[keep:]:
+        week = _backup_time(path).isocalendar()[:2]
+        if week not in weeks and len(weeks) < keep_weekly:
+            weeks.append(week)
+            kept.add(path)
+    removed = [p for p in backups if p not in kept]
+    for path in removed:
+        path.unlink(missing_ok=True)
+    return removed
+
+
+def _copy(db_path: Path, dst_path: Path, step_pages: int, step_sleep: float) -> dict:
+    """Stepped Connection.backup into dst_path (falls back to one pass after BACKUP_MAX_RESTARTS). Returns progress."""
+    progress = {'steps': 0, 'restarts': 0, 'remaining': None, 'pages': 0, 'single_pass': False}
+
+    def on_progress(status, remaining, total):
+        # remaining вырос — исходную базу изменили и копирование началось заново
+        if progress['remaining'] is not None and remaining > progress['remaining']:
+            progress['restarts'] += 1
+        progress['remaining'] = remaining
+        progress['pages'] = total
+        progress['steps'] += 1
+        if progress['restarts'] > BACKUP_MAX_RESTARTS:
+            raise _TooManyRestarts
+        if remaining and status == sqlite3.SQLITE_OK:  # при BUSY/LOCKED паузу делает сам backup()
+            time.sleep(step_sleep)
+
+    src = sqlite3.connect(db_path.as_posix(), timeout=30)
+    dst = sqlite3.connect(dst_path.as_posix())
+    try:
+        try:
+            src.backup(dst, pages=step_pages, progress=on_progress, sleep=step_sleep)
+        except _TooManyRestarts:
+            progress['single_pass'] = True
+            src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+    return progress
+
+
+def backup(db_path: Path, step_pages: int = BACKUP_STEP_PAGES, step_sleep: float = BACKUP_STEP_SLEEP,
+           rotate_after: bool = True, backup_dir: Path = BACKUP_DIR) -> dict:
+    """Copies db_path into backup_dir page by page, verifies the copy and rotates old backups."""
+    backup_dir.mkdir(parents=True, exist_ok=True)
+    target = backup_dir / f"bot_v2_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
+    tmp = target.with_suffix('.db.tmp')
+    tmp.unlink(missing_ok=True)
+
+    t0 = time.perf_counter()
+    progress = _copy(db_path, tmp, step_pages, step_sleep)
+    copy_seconds = time.perf_counter() - t0
+    check_conn = sqlite3.connect(tmp.as_posix())
+    try:
+        check = check_conn.execute("PRAGMA integrity_check").fetchall()
+    finally:
+        check_conn.close()
+    if check != [('ok',)]:
+        tmp.unlink(missing_ok=True)
+        raise RuntimeError(f"backup integrity_check failed: {check[:5]}")
+    tmp.replace(target)
+
+    duration = time.perf_counter() - t0
+    size = target.stat().st_size
+    removed = rotate(backup_dir=backup_dir) if rotate_after else []
+    result = {
+        'path': target.as_posix(), 'bytes': size, 'pages': progress['pages'], 'steps': progress['steps'],
+        'restarts': progress['restarts'], 'single_pass': progress['single_pass'], 'copy_seconds': round(copy_seconds, 3), 'duration_seconds': round(duration, 3),
+        'mb_per_second': round(size / 1048576 / copy_seconds, 2) if copy_seconds else None,
+        'removed': [p.name for p in removed],
+    }
+    print(f"[DB_BACKUP] {target.name}: {size} bytes, {result['pages']} pages in {result['steps']} steps, "
+          f"{result['restarts']} restarts{' + single pass' if progress['single_pass'] else ''}, copy {result['copy_seconds']}s ({result['mb_per_second']} MB/s), "
+          f"total {result['duration_seconds']}s with integrity_check; rotated out {len(removed)}")
+    return result
+
+
+def refresh_snapshot(db_path: Path, snapshot_path: Path) -> float:
+    """
+    Rebuilds the read-only snapshot (services.repositories.get_read_conn) and swaps it in by rename:
+    readers keep their open file until they return to the pool. Returns seconds spent.
+    """
+    t0 = time.perf_counter()
+    tmp = snapshot_path.with_name(snapshot_path.name + '.tmp')
+    tmp.unlink(missing_ok=True)
+    _copy(db_path, tmp, BACKUP_STEP_PAGES, BACKUP_STEP_SLEEP)
+    tmp.replace(snapshot_path)
+    return time.perf_counter() - t0
@@ -1,5 +1,7 @@
 import sqlite3
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Callable, Optional
 import os
 
 BASE_DIR = Path(__file__).resolve().parents[1]
@@ -30,153 +32,256 @@ def get_missing_columns(conn, table_name, expected_columns):
     return [col for col in expected_columns if col not in existing_columns]
 
 
-def apply_migrations(conn):
-    """Применяет миграции к существующей базе данных"""
-    print("Проверяем и применяем миграции...")
-    
-    # Включаем foreign keys
-    print("  - Включаем foreign keys...")
-    conn.execute("PRAGMA foreign_keys = ON")
+def rebuild_daily_stats(conn, group_ids=None):
+    """Пересчитывает group_daily_stats с нуля по живым и архивным мероприятиям (дальше таблицу ведут триггеры).
+    group_ids — пересчитать только эти группы (порционный пересчет в миграции)."""
+    cursor = conn.cursor()
+    where, params = "", ()
+    if group_ids is not None:
+        where = f"WHERE group_id IN ({', '.join('?' * len(group_ids))})"
+        params = tuple(group_ids)
+    cursor.execute(f"DELETE FROM group_daily_stats {where}", params)
+    cursor.execute(f"""
+        INSERT INTO group_daily_stats (group_id, day, events_count, bookings_count, required_slots, free_slots)
+        SELECT group_id, substr(time, 1, 10), COUNT(*), SUM(bk), SUM(rq), SUM(fr)
+        FROM (
+            SELECT e.group_id, e.time,
+                   (SELECT COUNT(*) FROM event_role_assignments_all a WHERE a.event_id = e.id) AS bk,
+                   (SELECT COALESCE(SUM(required), 0) FROM event_role_requirements_all r WHERE r.event_id = e.id) AS rq,
+                   (SELECT COALESCE(SUM(MAX(0, r.required - (SELECT COUNT(*) FROM event_role_assignments_all a
+                                                               WHERE a.event_id = r.event_id AND a.role_name = r.role_name))), 0)
+                    FROM event_role_requirements_all r WHERE r.event_id = e.id) AS fr
+            FROM events_all e
+        )
+        {where}
+        GROUP BY group_id, substr(time, 1, 10)
+    """, params)
+    return cursor.rowcount
 
-    # Базовая миграция: убедиться, что колонка 'type' есть в notification_settings
-    if check_table_exists(conn, 'notification_settings') and not check_column_exists(conn, 'notification_settings', 'type'):
-        print("  - Добавляем колонку 'type' в таблицу notification_settings...")
-        cursor = conn.cursor()
-        cursor.execute("""
-            ALTER TABLE notification_settings 
-            ADD COLUMN type TEXT NOT NULL DEFAULT 'group'
-        """)
-        cursor.execute("""
-            UPDATE notification_settings 
-            SET type = 'group' 
-            WHERE type IS NULL OR type = ''
-        """)
-        print("  - Колонка 'type' добавлена успешно")
-    
-    # Применяем схему для создания недостающих таблиц и индексов
-    print("  - Создаем недостающие таблицы и индексы по schema.sql...")
+
+# ---------------------------------------------------------------------------
+# Версионные миграции: номер последней примененной хранится в PRAGMA user_version.
+# Новое изменение схемы = правка schema.sql + новая запись в конце MIGRATIONS
+# (для новых таблиц/индексов/триггеров достаточно _sync_schema). Миграции должны быть
+# идемпотентными: шаг, прерванный до записи user_version, выполнится повторно.
+# Долгие заполнения данных — chunk-миграции: каждая порция в своей короткой транзакции,
+# позиция сохраняется в schema_migrations.cursor, после перезапуска продолжение с нее.
+# ---------------------------------------------------------------------------
+
+MIGRATION_CHUNK_SIZE = 200
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    apply: Optional[Callable] = None   # apply(conn)
+    chunk: Optional[Callable] = None   # chunk(conn, cursor, size) -> новый cursor или None, когда готово
+
+
+def _add_column(conn, table, column, ddl):
+    if check_table_exists(conn, table) and not check_column_exists(conn, table, column):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+
+def _sync_schema(conn):
+    """Создает недостающие таблицы, индексы, представления и триггеры по schema.sql (все IF NOT EXISTS)"""
     with open(SCHEMA_PATH, 'r', encoding='utf-8') as f:
-        sql_script = f.read()
-        conn.executescript(sql_script)
-    print("  - Схема синхронизирована")
+        conn.executescript(f.read())
 
-    # Добавляем колонку allow_multi_roles_per_user в events, если отсутствует
-    if check_table_exists(conn, 'events') and not check_column_exists(conn, 'events', 'allow_multi_roles_per_user'):
-        print("  - Добавляем колонку 'allow_multi_roles_per_user' в таблицу events...")
-        cursor = conn.cursor()
-        cursor.execute("ALTER TABLE events ADD COLUMN allow_multi_roles_per_user INTEGER NOT NULL DEFAULT 0")
-        print("  - Колонка добавлена")
 
-    # Добавляем аудиторские поля для событий, если отсутствуют
-    # Шаблоны ролей на уровне группы
-    try:
-        if check_table_exists(conn, 'groups'):
-            if not check_table_exists(conn, 'group_role_templates'):
-                print("  - Создаем таблицу group_role_templates...")
-                cursor = conn.cursor()
-                cursor.execute(
-                    """
-                    CREATE TABLE IF NOT EXISTS group_role_templates (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        group_id INTEGER NOT NULL,
-                        role_name TEXT NOT NULL,
-                        required INTEGER NOT NULL DEFAULT 1,
-                        created_at TEXT DEFAULT (datetime('now')),
-                        UNIQUE(group_id, role_name),
-                        FOREIGN KEY(group_id) REFERENCES groups(id) ON DELETE CASCADE
-                    )
-                    """
-                )
-                cursor.execute("CREATE INDEX IF NOT EXISTS idx_group_role_templates_group ON group_role_templates(group_id)")
-                print("  - Таблица group_role_templates создана")
-    except Exception as e:
-        print("  - Ошибка при создании group_role_templates:", e)
-
-    # Audit log table
-    try:
-        if check_table_exists(conn, 'users') and check_table_exists(conn, 'groups'):
-            if not check_table_exists(conn, 'audit_log'):
-                print("  - Создаем таблицу audit_log...")
-                cursor = conn.cursor()
-                cursor.execute(
-                    """
-                    CREATE TABLE IF NOT EXISTS audit_log (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        created_at TEXT DEFAULT (datetime('now')),
-                        user_id INTEGER,
-                        action TEXT NOT NULL,
-                        group_id INTEGER,
-                        event_id INTEGER,
-                        old_value TEXT,
-                        new_value TEXT,
-                        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE SET NULL,
-                        FOREIGN KEY(group_id) REFERENCES groups(id) ON DELETE CASCADE
-                    )
-                    """
-                )
-                cursor.execute("CREATE INDEX IF NOT EXISTS idx_audit_created ON audit_log(created_at)")
-                cursor.execute("CREATE INDEX IF NOT EXISTS idx_audit_group ON audit_log(group_id)")
-                cursor.execute("CREATE INDEX IF NOT EXISTS idx_audit_event ON audit_log(event_id)")
-                print("  - Таблица audit_log создана")
-    except Exception as e:
-        print("  - Ошибка при создании audit_log:", e)
-
-    if check_table_exists(conn, 'events'):
-        cursor = conn.cursor()
-        if not check_column_exists(conn, 'events', 'created_by_user_id'):
-            print("  - Добавляем колонку 'created_by_user_id' в таблицу events...")
-            cursor.execute("ALTER TABLE events ADD COLUMN created_by_user_id INTEGER")
-        if not check_column_exists(conn, 'events', 'updated_by_user_id'):
-            print("  - Добавляем колонку 'updated_by_user_id' в таблицу events...")
-            cursor.execute("ALTER TABLE events ADD COLUMN updated_by_user_id INTEGER")
-        if not check_column_exists(conn, 'events', 'updated_at'):
-            print("  - Добавляем колонку 'updated_at' в таблицу events...")
-            cursor.execute("ALTER TABLE events ADD COLUMN updated_at TEXT")
-
-    # Блокировка пользователей
-    if check_table_exists(conn, 'users') and not check_column_exists(conn, 'users', 'blocked'):
-        print("  - Добавляем колонку 'blocked' в таблицу users...")
-        cursor = conn.cursor()
-        cursor.execute("ALTER TABLE users ADD COLUMN blocked INTEGER NOT NULL DEFAULT 0")
+def _m_notification_settings_type(conn):
+    if check_table_exists(conn, 'notification_settings') and not check_column_exists(conn, 'notification_settings', 'type'):
+        conn.execute("ALTER TABLE notification_settings ADD COLUMN type TEXT NOT NULL DEFAULT 'group'")
+        conn.execute("UPDATE notification_settings SET type = 'group' WHERE type IS NULL OR type = ''")
+
+
+def _m_group_role_templates(conn):
+    if check_table_exists(conn, 'groups'):
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS group_role_templates (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                group_id INTEGER NOT NULL,
+                role_name TEXT NOT NULL,
+                required INTEGER NOT NULL DEFAULT 1,
+                created_at TEXT DEFAULT (datetime('now')),
+                UNIQUE(group_id, role_name),
+                FOREIGN KEY(group_id) REFERENCES groups(id) ON DELETE CASCADE
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_group_role_templates_group ON group_role_templates(group_id)")
+
+
+def _m_events_audit_columns(conn):
+    _add_column(conn, 'events', 'created_by_user_id', 'INTEGER')
+    _add_column(conn, 'events', 'updated_by_user_id', 'INTEGER')
+    _add_column(conn, 'events', 'updated_at', 'TEXT')
+
+
+def _m_drop_replaced(conn):
+    # (group_id, time) покрыт idx_events_group_time_name; индексы аудита (group_id), (event_id) заменены на (..., id)
+    for old_index in ('idx_events_group_time', 'idx_audit_group', 'idx_audit_event'):
+        conn.execute(f"DROP INDEX IF EXISTS {old_index}")
+    # Триггеры версий заменены на trg_*_sync_* (версия группы + event_versions в одном триггере)
+    for old_trigger in ('trg_events_version_ins', 'trg_events_version_upd', 'trg_events_version_del',
+                        'trg_role_assign_version_ins', 'trg_role_assign_version_del',
+                        'trg_display_names_version_ins', 'trg_display_names_version_upd'):
+        conn.execute(f"DROP TRIGGER IF EXISTS {old_trigger}")
+
+
+def _m_daily_stats_chunk(conn, cursor, size):
+    # Триггеры ведут агрегаты только с момента создания таблицы — пересчитываем порциями по группам
+    last_id = int(cursor or 0)
+    group_ids = [row[0] for row in conn.execute(
+        "SELECT id FROM groups WHERE id > ? ORDER BY id LIMIT ?", (last_id, size)).fetchall()]
+    if not group_ids:
+        return None
+    rebuild_daily_stats(conn, group_ids)
+    return str(group_ids[-1])
 
-    # Очистка номинальных членств суперадмина (если когда-то добавлялись автоматически)
+
+def _m_superadmin_cleanup(conn):
+    # Номинальные членства суперадмина (когда-то добавлялись автоматически)
     try:
         from config import SUPERADMIN_ID as CFG_SA
     except Exception:
         CFG_SA = None
     if CFG_SA:
-        with sqlite3.connect(DB_PATH.as_posix()) as c2:
-            cur2 = c2.cursor()
-            cur2.execute("SELECT id FROM users WHERE telegram_id = ?", (CFG_SA,))
-            sa = cur2.fetchone()
-            if sa:
-                sa_uid = sa[0]
-                print("  - Удаляем автодобавленные записи суперадмина из user_group_roles (если есть)...")
-                cur2.execute("DELETE FROM user_group_roles WHERE user_id = ? AND role = 'superadmin'", (sa_uid,))
-                c2.commit()
-    
-    print("Миграции применены успешно!")
+        conn.execute(
+            "DELETE FROM user_group_roles WHERE role = 'superadmin' "
+            "AND user_id IN (SELECT id FROM users WHERE telegram_id = ?)",
+            (CFG_SA,),
+        )
 
 
-def init_db() -> None:
-    """Инициализирует базу данных или обновляет существующую"""
-    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    
-    db_exists = DB_PATH.exists()
-    
-    with sqlite3.connect(DB_PATH.as_posix()) as conn:
+MIGRATIONS = [
+    Migration(1, "notification_settings.type", _m_notification_settings_type),
+    # Триггеры в schema.sql ссылаются на members_version — колонка нужна до синхронизации схемы
+    Migration(2, "group_data_versions.members_version",
+              lambda conn: _add_column(conn, 'group_data_versions', 'members_version', 'INTEGER NOT NULL DEFAULT 0')),
+    Migration(3, "schema.sql", _sync_schema),
+    Migration(4, "events.allow_multi_roles_per_user",
+              lambda conn: _add_column(conn, 'events', 'allow_multi_roles_per_user', 'INTEGER NOT NULL DEFAULT 0')),
+    Migration(5, "group_role_templates", _m_group_role_templates),
+    Migration(6, "events audit columns", _m_events_audit_columns),
+    Migration(7, "users.blocked", lambda conn: _add_column(conn, 'users', 'blocked', 'INTEGER NOT NULL DEFAULT 0')),
+    Migration(8, "event_templates.materialize_mode",
+              lambda conn: _add_column(conn, 'event_templates', 'materialize_mode', "TEXT NOT NULL DEFAULT 'eager'")),
+    Migration(9, "drop replaced indexes and triggers", _m_drop_replaced),
+    Migration(10, "group_daily_stats backfill", chunk=_m_daily_stats_chunk),
+    Migration(11, "superadmin memberships cleanup", _m_superadmin_cleanup),
+    Migration(12, "group_shards, shard_legacy_ids", _sync_schema),
+    Migration(13, "change_log and its triggers", _sync_schema),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1].version
+
+
+def _run_chunked(conn, m):
+    row = conn.execute("SELECT cursor FROM schema_migrations WHERE version = ?", (m.version,)).fetchone()
+    cursor = row[0] if row else None
+    if row is None:
+        conn.execute("INSERT INTO schema_migrations (version, name, started_at) VALUES (?, ?, datetime('now'))",
+                     (m.version, m.name))
+    elif cursor:
+        print(f"  - Продолжаем с позиции {cursor}")
+    chunks = 0
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = m.chunk(conn, cursor, MIGRATION_CHUNK_SIZE)
+            conn.execute("UPDATE schema_migrations SET cursor = ? WHERE version = ?", (cursor, m.version))
+            if cursor is None:
+                _mark_applied(conn, m)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        chunks += 1
+        if cursor is None:
+            return chunks
+
+
+def _mark_applied(conn, m):
+    conn.execute(
+        """
+        INSERT INTO schema_migrations (version, name, started_at, finished_at)
+        VALUES (?, ?, datetime('now'), datetime('now'))
+        ON CONFLICT(version) DO UPDATE SET finished_at = excluded.finished_at
+        """,
+        (m.version, m.name),
+    )
+    conn.execute(f"PRAGMA user_version = {m.version}")
+
+
+def apply_migrations(conn):
+    """Применяет миграции новее PRAGMA user_version. Актуальная база — одно чтение user_version. Возвращает число примененных."""
+    conn.execute("PRAGMA foreign_keys = ON")
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+    if current >= SCHEMA_VERSION:
+        return 0
+
+    print(f"Применяем миграции: версия схемы {current} -> {SCHEMA_VERSION}")
+    isolation_level = conn.isolation_level
+    conn.commit()
+    conn.isolation_level = None  # транзакции ведем сами
+    try:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version      INTEGER PRIMARY KEY,
+                name         TEXT NOT NULL,
+                cursor       TEXT,
+                started_at   TEXT,
+                finished_at  TEXT
+            )
+            """
+        )
+        applied = 0
+        for m in MIGRATIONS:
+            if m.version <= current:
+                continue
+            print(f"  - {m.version}: {m.name}")
+            if m.chunk is not None:
+                _run_chunked(conn, m)
+            else:
+                m.apply(conn)
+                conn.execute("BEGIN IMMEDIATE")
+                _mark_applied(conn, m)
+                conn.execute("COMMIT")
+            applied += 1
+    finally:
+        conn.isolation_level = isolation_level
+    print(f"Миграции применены, версия схемы {SCHEMA_VERSION}")
+    return applied
+
+
+def init_db_file(db_path: Path) -> bool:
+    """Создает файл базы по schema.sql или обновляет существующий. Возвращает True, если файл создан."""
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+
+    db_exists = db_path.exists()
+
+    with sqlite3.connect(db_path.as_posix()) as conn:
         if not db_exists:
             print("Создаем новую базу данных...")
-            with open(SCHEMA_PATH, 'r', encoding='utf-8') as f:
-                conn.executescript(f.read())
-            print(f"База данных создана: {DB_PATH}")
-        else:
-            print(f"База данных уже существует: {DB_PATH}")
-            print("Проверяем необходимость миграций...")
-            apply_migrations(conn)
-        
+            _sync_schema(conn)
+            print(f"База данных создана: {db_path}")
+        # Новая база тоже проходит миграции: часть колонок есть только в них
+        apply_migrations(conn)
+
         # Включаем foreign keys для всех операций
         conn.execute("PRAGMA foreign_keys = ON")
+    return not db_exists
+
+
+def init_db() -> None:
+    """Инициализирует базу данных или обновляет существующую (и шарды, если включено шардирование)"""
+    init_db_file(DB_PATH)
+    from services.sharding import ensure_shards
+    ensure_shards(DB_PATH)
 
 
 def check_db_status():
@@ -193,6 +298,8 @@ def check_db_status():
         tables = cursor.fetchall()
         
         print(f"База данных: {DB_PATH}")
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        print(f"Версия схемы: {version} (актуальная {SCHEMA_VERSION})")
         print(f"Таблицы ({len(tables)}):")
         for table in tables:
             print(f"  - {table[0]}")
@@ -222,6 +329,25 @@ if __name__ == '__main__':
     
     if len(sys.argv) > 1 and sys.argv[1] == 'check':
         check_db_status()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'maintenance':
+        # python -m database.init_db maintenance [--enable-incremental-vacuum]
+        from database.maintenance import enable_incremental_vacuum, run_maintenance
+        from services.sharding import database_files
+        for _shard, path in database_files(DB_PATH):
+            if '--enable-incremental-vacuum' in sys.argv:
+                enable_incremental_vacuum(path)
+            run_maintenance(path, reason='manual')
+    elif len(sys.argv) > 1 and sys.argv[1] == 'backup':
+        # python -m database.init_db backup [--list]
+        from database.backup import BACKUP_DIR, backup, list_backups
+        from services.sharding import database_files
+        for shard, path in database_files(DB_PATH):
+            backup_dir = BACKUP_DIR if shard is None else BACKUP_DIR / f"shard_{shard}"
+            if '--list' in sys.argv:
+                for backup_path in list_backups(backup_dir):
+                    print(f"{backup_dir.name}/{backup_path.name}  {backup_path.stat().st_size} bytes")
+            else:
+                backup(path, backup_dir=backup_dir)
     else:
         init_db()
         print(f'База данных инициализирована/обновлена: {DB_PATH}')
@@ -0,0 +1,142 @@
+"""
+Обслуживание базы: PRAGMA optimize / ANALYZE, контрольная точка WAL и инкрементальный VACUUM.
+
+Каждый шаг укладывается в свой бюджет времени (ANALYZE — через analysis_limit, VACUUM — порциями страниц),
+итоги (размер файла, страницы, свободные страницы, длительность шагов) пишутся в db_maintenance_runs.
+Перед запуском проверяется, что в ближайшие минуты не ожидаются напоминания (is_quiet) — задание в боте
+в противном случае откладывает обслуживание.
+
+Ручной запуск: python -m database.init_db maintenance [--enable-incremental-vacuum]
+"""
+import json
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+ANALYZE_BUDGET_SECONDS = 10.0
+VACUUM_BUDGET_SECONDS = 20.0
+VACUUM_STEP_PAGES = 500
+ANALYSIS_LIMIT = 1000
+QUIET_MINUTES = 10
+
+_LEAD_MINUTES_SQL = """
+    time_before * CASE time_unit WHEN 'minutes' THEN 1 WHEN 'hours' THEN 60 WHEN 'days' THEN 1440
+                                 WHEN 'weeks' THEN 10080 WHEN 'months' THEN 43200 ELSE 0 END
+"""
+
+
+def _file_stats(conn: sqlite3.Connection, db_path: Path) -> dict:
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    return {
+        'size': db_path.stat().st_size if db_path.exists() else 0,
+        'wal_size': Path(db_path.as_posix() + '-wal').stat().st_size if Path(db_path.as_posix() + '-wal').exists() else 0,
+        'pages': conn.execute("PRAGMA page_count").fetchone()[0],
+        'freelist': conn.execute("PRAGMA freelist_count").fetchone()[0],
+        'page_size': page_size,
+    }
+
+
+def reminders_due(conn: sqlite3.Connection, start: datetime, end: datetime) -> int:
+    """Number of event/personal reminders whose send time (MSK) falls into [start, end)."""
+    lo, hi = start.strftime('%Y-%m-%d %H:%M:%S'), end.strftime('%Y-%m-%d %H:%M:%S')
+    row = conn.execute(
+        f"""
+        SELECT COUNT(*) FROM (
+            SELECT datetime(e.time, printf('-%d minutes', {_LEAD_MINUTES_SQL})) AS at
+            FROM event_notifications n JOIN events e ON e.id = n.event_id
+            WHERE e.time >= ?
+            UNION ALL
+            SELECT datetime(e.time, printf('-%d minutes', {_LEAD_MINUTES_SQL})) AS at
+            FROM personal_event_notifications p JOIN events e ON e.id = p.event_id
+            WHERE e.time >= ?
+        )
+        WHERE at >= ? AND at < ?
+        """,
+        (lo[:16], lo[:16], lo, hi),
+    ).fetchone()
+    return row[0]
+
+
+def is_quiet(db_path: Path, minutes: int = QUIET_MINUTES, now: Optional[datetime] = None) -> bool:
+    """True when no reminders are due within the next `minutes` (and none were due in the previous 5)."""
+    now = now or datetime.now(ZoneInfo("Europe/Moscow")).replace(tzinfo=None)
+    with sqlite3.connect(db_path.as_posix()) as conn:
+        return reminders_due(conn, now - timedelta(minutes=5), now + timedelta(minutes=minutes)) == 0
+
+
+def enable_incremental_vacuum(db_path: Path) -> None:
+    """One-off switch to auto_vacuum=INCREMENTAL. Rewrites the whole file (VACUUM) — run with the bot stopped."""
+    with sqlite3.connect(db_path.as_posix(), isolation_level=None) as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            print("auto_vacuum уже INCREMENTAL")
+            return
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        print("auto_vacuum = INCREMENTAL, файл пересобран")
+
+
+def run_maintenance(db_path: Path, analyze_budget: float = ANALYZE_BUDGET_SECONDS,
+                    vacuum_budget: float = VACUUM_BUDGET_SECONDS, reason: str = 'scheduled') -> dict:
+    """Runs optimize/ANALYZE, WAL checkpoint and incremental vacuum; returns and stores the run metrics."""
+    started_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+    t0 = time.perf_counter()
+    steps = {}
+    conn = sqlite3.connect(db_path.as_posix(), isolation_level=None, timeout=30)
+    try:
+        before = _file_stats(conn, db_path)
+
+        # 1. Статистика планировщика: optimize решает сам, какие таблицы пересчитать; analysis_limit ограничивает время
+        t = time.perf_counter()
+        conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+        conn.execute("PRAGMA optimize = 0x10002")
+        if time.perf_counter() - t < analyze_budget:
+            has_stats = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()
+            if not has_stats:
+                conn.execute("ANALYZE")
+        steps['optimize'] = {'ms': round((time.perf_counter() - t) * 1000, 1)}
+
+        # 2. Контрольная точка WAL (в режиме delete журнала нет — шаг пропускается)
+        t = time.perf_counter()
+        journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        if journal_mode == 'wal':
+            busy, log_frames, checkpointed = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+            steps['wal_checkpoint'] = {'ms': round((time.perf_counter() - t) * 1000, 1), 'busy': busy,
+                                       'log_frames': log_frames, 'checkpointed': checkpointed}
+        else:
+            steps['wal_checkpoint'] = {'skipped': f'journal_mode={journal_mode}'}
+
+        # 3. Инкрементальный VACUUM порциями, пока есть свободные страницы и не исчерпан бюджет
+        t = time.perf_counter()
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            freed = 0
+            while time.perf_counter() - t < vacuum_budget:
+                free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                if not free:
+                    break
+                conn.execute(f"PRAGMA incremental_vacuum({VACUUM_STEP_PAGES})").fetchall()
+                freed += min(free, VACUUM_STEP_PAGES)
+            steps['incremental_vacuum'] = {'ms': round((time.perf_counter() - t) * 1000, 1), 'pages_freed': freed}
+        else:
+            steps['incremental_vacuum'] = {'skipped': 'auto_vacuum is not INCREMENTAL'}
+
+        after = _file_stats(conn, db_path)
+        duration_ms = round((time.perf_counter() - t0) * 1000, 1)
+        conn.execute(
+            """
+            INSERT INTO db_maintenance_runs (started_at, reason, duration_ms, size_before, size_after,
+                                             pages_before, pages_after, freelist_before, freelist_after, steps_json)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (started_at, reason, duration_ms, before['size'], after['size'], before['pages'], after['pages'],
+             before['freelist'], after['freelist'], json.dumps(steps)),
+        )
+    finally:
+        conn.close()
+    result = {'duration_ms': duration_ms, 'before': before, 'after': after, 'steps': steps}
+    print(f"[DB_MAINT] {duration_ms}ms size {before['size']} -> {after['size']} bytes, "
+          f"pages {before['pages']} -> {after['pages']}, free {before['freelist']} -> {after['freelist']}; "
+          + ', '.join(f"{k}={v}" for k, v in steps.items()))
+    return result
@@ -87,7 +87,8 @@ CREATE TABLE IF NOT EXISTS events (
     FOREIGN KEY(responsible_user_id) REFERENCES users(id) ON DELETE SET NULL
 );
 
-CREATE INDEX IF NOT EXISTS idx_events_group_time ON events(group_id, time);
+-- (group_id, time, name): поиск дублей при импорте; префикс (group_id, time) покрывает выборки по времени
+CREATE INDEX IF NOT EXISTS idx_events_group_time_name ON events(group_id, time, name);
 
 -- Event-specific notification settings
 -- time_unit: 'months'|'weeks'|'days'|'hours'|'minutes'
@@ -192,6 +193,7 @@ CREATE TABLE IF NOT EXISTS event_templates (
     count                       INTEGER,              -- ограничение по количеству
     exceptions_json             TEXT,                 -- JSON со списком дат-исключений
     created_at                  TEXT DEFAULT (datetime('now')),
+    materialize_mode            TEXT NOT NULL DEFAULT 'eager', -- 'eager' | 'lazy' (события создаются по требованию)
     FOREIGN KEY(group_id) REFERENCES groups(id) ON DELETE CASCADE
 );
 
@@ -266,3 +268,554 @@ CREATE TABLE IF NOT EXISTS template_generated_events (
     FOREIGN KEY(event_id) REFERENCES events(id) ON DELETE CASCADE
 );
 
+
+CREATE INDEX IF NOT EXISTS idx_event_role_assign_user ON event_role_assignments(user_id);
+
+-- Версия данных группы: растет при любом изменении мероприятий/записей группы (ETag календаря, delta-sync API).
+-- event_versions: версия последнего изменения каждого мероприятия (deleted=1 — удалено), для запросов "изменения после N"
+CREATE TABLE IF NOT EXISTS group_data_versions (
+    group_id    INTEGER PRIMARY KEY,
+    version     INTEGER NOT NULL DEFAULT 0,
+    updated_at  TEXT DEFAULT (datetime('now')),
+    members_version INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS event_versions (
+    event_id  INTEGER PRIMARY KEY,
+    group_id  INTEGER NOT NULL,
+    version   INTEGER NOT NULL,
+    deleted   INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS idx_event_versions_group ON event_versions(group_id, version);
+
+-- Каждое изменение поднимает версию группы и в том же триггере помечает затронутое мероприятие этой версией
+CREATE TRIGGER IF NOT EXISTS trg_events_sync_ins AFTER INSERT ON events
+BEGIN
+    INSERT INTO group_data_versions (group_id, version, updated_at) VALUES (NEW.group_id, 1, datetime('now'))
+    ON CONFLICT(group_id) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at;
+    INSERT INTO event_versions (event_id, group_id, version, deleted)
+    SELECT NEW.id, NEW.group_id, version, 0 FROM group_data_versions WHERE group_id = NEW.group_id
+    ON CONFLICT(event_id) DO UPDATE SET group_id = excluded.group_id, version = excluded.version, deleted = 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_events_sync_upd AFTER UPDATE ON events
+BEGIN
+    INSERT INTO group_data_versions (group_id, version, updated_at) VALUES (NEW.group_id, 1, datetime('now'))
+    ON CONFLICT(group_id) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at;
+    INSERT INTO event_versions (event_id, group_id, version, deleted)
+    SELECT e.id, e.group_id, v.version, 0 FROM events e JOIN group_data_versions v ON v.group_id = e.group_id WHERE e.id = NEW.id
+    ON CONFLICT(event_id) DO UPDATE SET version = excluded.version;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_events_sync_del AFTER DELETE ON events
+BEGIN
+    INSERT INTO group_data_versions (group_id, version, updated_at) VALUES (OLD.group_id, 1, datetime('now'))
+    ON CONFLICT(group_id) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at;
+    INSERT INTO event_versions (event_id, group_id, version, deleted)
+    SELECT OLD.id, OLD.group_id, version, 1 FROM group_data_versions WHERE group_id = OLD.group_id
+    ON CONFLICT(event_id) DO UPDATE SET version = excluded.version, deleted = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_role_assign_sync_ins AFTER INSERT ON event_role_assignments
+BEGIN
+    INSERT INTO group_data_versions (group_id, version, updated_at)
+    SELECT group_id, 1, datetime('now') FROM events WHERE id = NEW.event_id
+    ON CONFLICT(group_id) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at;
+    INSERT INTO event_versions (event_id, group_id, version, deleted)
+    SELECT e.id, e.group_id, v.version, 0 FROM events e JOIN group_data_versions v ON v.group_id = e.group_id WHERE e.id = NEW.event_id
+    ON CONFLICT(event_id) DO UPDATE SET version = excluded.version;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_role_assign_sync_upd AFTER UPDATE ON event_role_assignments
+BEGIN
+    INSERT INTO group_data_versions (group_id, version, updated_at)
+    SELECT group_id, 1, datetime('now') FROM events WHERE id = NEW.event_id
+    ON CONFLICT(group_id) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at;
+    INSERT INTO event_versions (event_id, group_id, version, deleted)
+    SELECT e.id, e.group_id, v.version, 0 FROM events e JOIN group_data_versions v ON v.group_id = e.group_id WHERE e.id = NEW.event_id
+    ON CONFLICT(event_id) DO UPDATE SET version = excluded.version;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_role_assign_sync_del AFTER DELETE ON event_role_assignments
+BEGIN
+    INSERT INTO group_data_versions (group_id, version, updated_at)
+    SELECT group_id, 1, datetime('now') FROM events WHERE id = OLD.event_id
+    ON CONFLICT(group_id) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at;
+    INSERT INTO event_versions (event_id, group_id, version, deleted)
+    SELECT e.id, e.group_id, v.version, 0 FROM events e JOIN group_data_versions v ON v.group_id = e.group_id WHERE e.id = OLD.event_id
+    ON CONFLICT(event_id) DO UPDATE SET version = excluded.version;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_role_reqs_sync_ins AFTER INSERT ON event_role_requirements
+BEGIN
+    INSERT INTO group_data_versions (group_id, version, updated_at)
+    SELECT group_id, 1, datetime('now') FROM events WHERE id = NEW.event_id
+    ON CONFLICT(group_id) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at;
+    INSERT INTO event_versions (event_id, group_id, version, deleted)
+    SELECT e.id, e.group_id, v.version, 0 FROM events e JOIN group_data_versions v ON v.group_id = e.group_id WHERE e.id = NEW.event_id
+    ON CONFLICT(event_id) DO UPDATE SET version = excluded.version;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_role_reqs_sync_upd AFTER UPDATE ON event_role_requirements
+BEGIN
+    INSERT INTO group_data_versions (group_id, version, updated_at)
+    SELECT group_id, 1, datetime('now') FROM events WHERE id = NEW.event_id
+    ON CONFLICT(group_id) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at;
+    INSERT INTO event_versions (event_id, group_id, version, deleted)
+    SELECT e.id, e.group_id, v.version, 0 FROM events e JOIN group_data_versions v ON v.group_id = e.group_id WHERE e.id = NEW.event_id
+    ON CONFLICT(event_id) DO UPDATE SET version = excluded.version;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_role_reqs_sync_del AFTER DELETE ON event_role_requirements
+BEGIN
+    INSERT INTO group_data_versions (group_id, version, updated_at)
+    SELECT group_id, 1, datetime('now') FROM events WHERE id = OLD.event_id
+    ON CONFLICT(group_id) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at;
+    INSERT INTO event_versions (event_id, group_id, version, deleted)
+    SELECT e.id, e.group_id, v.version, 0 FROM events e JOIN group_data_versions v ON v.group_id = e.group_id WHERE e.id = OLD.event_id
+    ON CONFLICT(event_id) DO UPDATE SET version = excluded.version;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_bookings_sync_ins AFTER INSERT ON bookings
+BEGIN
+    INSERT INTO group_data_versions (group_id, version, updated_at)
+    SELECT group_id, 1, datetime('now') FROM events WHERE id = NEW.event_id
+    ON CONFLICT(group_id) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at;
+    INSERT INTO event_versions (event_id, group_id, version, deleted)
+    SELECT e.id, e.group_id, v.version, 0 FROM events e JOIN group_data_versions v ON v.group_id = e.group_id WHERE e.id = NEW.event_id
+    ON CONFLICT(event_id) DO UPDATE SET version = excluded.version;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_bookings_sync_del AFTER DELETE ON bookings
+BEGIN
+    INSERT INTO group_data_versions (group_id, version, updated_at)
+    SELECT group_id, 1, datetime('now') FROM events WHERE id = OLD.event_id
+    ON CONFLICT(group_id) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at;
+    INSERT INTO event_versions (event_id, group_id, version, deleted)
+    SELECT e.id, e.group_id, v.version, 0 FROM events e JOIN group_data_versions v ON v.group_id = e.group_id WHERE e.id = OLD.event_id
+    ON CONFLICT(event_id) DO UPDATE SET version = excluded.version;
+END;
+
+-- Имена и состав участников: версия группы + members_version (клиент перечитывает список участников)
+CREATE TRIGGER IF NOT EXISTS trg_display_names_sync_ins AFTER INSERT ON user_display_names
+BEGIN
+    INSERT INTO group_data_versions (group_id, version, updated_at) VALUES (NEW.group_id, 1, datetime('now'))
+    ON CONFLICT(group_id) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at;
+    UPDATE group_data_versions SET members_version = version WHERE group_id = NEW.group_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_display_names_sync_upd AFTER UPDATE ON user_display_names
+BEGIN
+    INSERT INTO group_data_versions (group_id, version, updated_at) VALUES (NEW.group_id, 1, datetime('now'))
+    ON CONFLICT(group_id) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at;
+    UPDATE group_data_versions SET members_version = version WHERE group_id = NEW.group_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_display_names_sync_del AFTER DELETE ON user_display_names
+BEGIN
+    INSERT INTO group_data_versions (group_id, version, updated_at) VALUES (OLD.group_id, 1, datetime('now'))
+    ON CONFLICT(group_id) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at;
+    UPDATE group_data_versions SET members_version = version WHERE group_id = OLD.group_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_members_sync_ins AFTER INSERT ON user_group_roles
+BEGIN
+    INSERT INTO group_data_versions (group_id, version, updated_at) VALUES (NEW.group_id, 1, datetime('now'))
+    ON CONFLICT(group_id) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at;
+    UPDATE group_data_versions SET members_version = version WHERE group_id = NEW.group_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_members_sync_upd AFTER UPDATE ON user_group_roles
+BEGIN
+    INSERT INTO group_data_versions (group_id, version, updated_at) VALUES (NEW.group_id, 1, datetime('now'))
+    ON CONFLICT(group_id) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at;
+    UPDATE group_data_versions SET members_version = version WHERE group_id = NEW.group_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_members_sync_del AFTER DELETE ON user_group_roles
+BEGIN
+    INSERT INTO group_data_versions (group_id, version, updated_at) VALUES (OLD.group_id, 1, datetime('now'))
+    ON CONFLICT(group_id) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at;
+    UPDATE group_data_versions SET members_version = version WHERE group_id = OLD.group_id;
+END;
+
+-- Журнал изменений для инкрементальных потребителей (services/change_log.py): кэши, планировщик, агрегаты.
+-- Компактные записи (seq, table_name, op, group_id, event_id, row_id) пишут триггеры; op: 'I' | 'U' | 'D'.
+-- group_id дочерней строки берется из events — при каскадном удалении мероприятия он NULL (удаление самого
+-- мероприятия записано с группой). Старые записи удаляет change_log.prune; seq не переиспользуется (AUTOINCREMENT)
+CREATE TABLE IF NOT EXISTS change_log (
+    seq         INTEGER PRIMARY KEY AUTOINCREMENT,
+    table_name  TEXT NOT NULL,
+    op          TEXT NOT NULL,
+    group_id    INTEGER,
+    event_id    INTEGER,
+    row_id      INTEGER,
+    created_at  TEXT DEFAULT (datetime('now'))
+);
+
+CREATE INDEX IF NOT EXISTS idx_change_log_group ON change_log(group_id, seq);
+
+CREATE TRIGGER IF NOT EXISTS trg_events_log_ins AFTER INSERT ON events
+BEGIN
+    INSERT INTO change_log (table_name, op, group_id, event_id, row_id) VALUES ('events', 'I', NEW.group_id, NEW.id, NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_events_log_upd AFTER UPDATE ON events
+BEGIN
+    INSERT INTO change_log (table_name, op, group_id, event_id, row_id) VALUES ('events', 'U', NEW.group_id, NEW.id, NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_events_log_del AFTER DELETE ON events
+BEGIN
+    INSERT INTO change_log (table_name, op, group_id, event_id, row_id) VALUES ('events', 'D', OLD.group_id, OLD.id, OLD.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_role_assign_log_ins AFTER INSERT ON event_role_assignments
+BEGIN
+    INSERT INTO change_log (table_name, op, group_id, event_id, row_id) VALUES ('event_role_assignments', 'I', (SELECT group_id FROM events WHERE id = NEW.event_id), NEW.event_id, NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_role_assign_log_upd AFTER UPDATE ON event_role_assignments
+BEGIN
+    INSERT INTO change_log (table_name, op, group_id, event_id, row_id) VALUES ('event_role_assignments', 'U', (SELECT group_id FROM events WHERE id = NEW.event_id), NEW.event_id, NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_role_assign_log_del AFTER DELETE ON event_role_assignments
+BEGIN
+    INSERT INTO change_log (table_name, op, group_id, event_id, row_id) VALUES ('event_role_assignments', 'D', (SELECT group_id FROM events WHERE id = OLD.event_id), OLD.event_id, OLD.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_event_notif_log_ins AFTER INSERT ON event_notifications
+BEGIN
+    INSERT INTO change_log (table_name, op, group_id, event_id, row_id) VALUES ('event_notifications', 'I', (SELECT group_id FROM events WHERE id = NEW.event_id), NEW.event_id, NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_event_notif_log_upd AFTER UPDATE ON event_notifications
+BEGIN
+    INSERT INTO change_log (table_name, op, group_id, event_id, row_id) VALUES ('event_notifications', 'U', (SELECT group_id FROM events WHERE id = NEW.event_id), NEW.event_id, NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_event_notif_log_del AFTER DELETE ON event_notifications
+BEGIN
+    INSERT INTO change_log (table_name, op, group_id, event_id, row_id) VALUES ('event_notifications', 'D', (SELECT group_id FROM events WHERE id = OLD.event_id), OLD.event_id, OLD.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_personal_notif_log_ins AFTER INSERT ON personal_event_notifications
+BEGIN
+    INSERT INTO change_log (table_name, op, group_id, event_id, row_id) VALUES ('personal_event_notifications', 'I', (SELECT group_id FROM events WHERE id = NEW.event_id), NEW.event_id, NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_personal_notif_log_upd AFTER UPDATE ON personal_event_notifications
+BEGIN
+    INSERT INTO change_log (table_name, op, group_id, event_id, row_id) VALUES ('personal_event_notifications', 'U', (SELECT group_id FROM events WHERE id = NEW.event_id), NEW.event_id, NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_personal_notif_log_del AFTER DELETE ON personal_event_notifications
+BEGIN
+    INSERT INTO change_log (table_name, op, group_id, event_id, row_id) VALUES ('personal_event_notifications', 'D', (SELECT group_id FROM events WHERE id = OLD.event_id), OLD.event_id, OLD.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_members_log_ins AFTER INSERT ON user_group_roles
+BEGIN
+    INSERT INTO change_log (table_name, op, group_id, event_id, row_id) VALUES ('user_group_roles', 'I', NEW.group_id, NULL, NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_members_log_upd AFTER UPDATE ON user_group_roles
+BEGIN
+    INSERT INTO change_log (table_name, op, group_id, event_id, row_id) VALUES ('user_group_roles', 'U', NEW.group_id, NULL, NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_members_log_del AFTER DELETE ON user_group_roles
+BEGIN
+    INSERT INTO change_log (table_name, op, group_id, event_id, row_id) VALUES ('user_group_roles', 'D', OLD.group_id, NULL, OLD.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_display_names_log_ins AFTER INSERT ON user_display_names
+BEGIN
+    INSERT INTO change_log (table_name, op, group_id, event_id, row_id) VALUES ('user_display_names', 'I', NEW.group_id, NULL, NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_display_names_log_upd AFTER UPDATE ON user_display_names
+BEGIN
+    INSERT INTO change_log (table_name, op, group_id, event_id, row_id) VALUES ('user_display_names', 'U', NEW.group_id, NULL, NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_display_names_log_del AFTER DELETE ON user_display_names
+BEGIN
+    INSERT INTO change_log (table_name, op, group_id, event_id, row_id) VALUES ('user_display_names', 'D', OLD.group_id, NULL, OLD.id);
+END;
+
+-- Холодный архив прошедших мероприятий (services/event_archive.py): строки переезжают из events и зависимых таблиц,
+-- горячие запросы и их индексы видят только живые данные. id сохраняются (events — AUTOINCREMENT, повторов нет).
+-- notifications_json — настройки оповещений и журнал отправок на момент переноса
+CREATE TABLE IF NOT EXISTS events_archive (
+    id                          INTEGER PRIMARY KEY,
+    name                        TEXT NOT NULL,
+    time                        TEXT NOT NULL,
+    group_id                    INTEGER NOT NULL,
+    responsible_user_id         INTEGER,
+    created_at                  TEXT,
+    created_by_user_id          INTEGER,
+    updated_by_user_id          INTEGER,
+    updated_at                  TEXT,
+    allow_multi_roles_per_user  INTEGER NOT NULL DEFAULT 0,
+    archived_at                 TEXT DEFAULT (datetime('now')),
+    notifications_json          TEXT,
+    FOREIGN KEY(group_id) REFERENCES groups(id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS idx_events_archive_group_time ON events_archive(group_id, time);
+
+CREATE TABLE IF NOT EXISTS event_role_requirements_archive (
+    event_id   INTEGER NOT NULL,
+    role_name  TEXT NOT NULL,
+    required   INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (event_id, role_name),
+    FOREIGN KEY(event_id) REFERENCES events_archive(id) ON DELETE CASCADE
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS event_role_assignments_archive (
+    event_id   INTEGER NOT NULL,
+    role_name  TEXT NOT NULL,
+    user_id    INTEGER NOT NULL,
+    PRIMARY KEY (event_id, role_name, user_id),
+    FOREIGN KEY(event_id) REFERENCES events_archive(id) ON DELETE CASCADE
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_role_assign_archive_user ON event_role_assignments_archive(user_id);
+
+CREATE TABLE IF NOT EXISTS bookings_archive (
+    event_id    INTEGER NOT NULL,
+    user_id     INTEGER NOT NULL,
+    created_at  TEXT,
+    PRIMARY KEY (event_id, user_id),
+    FOREIGN KEY(event_id) REFERENCES events_archive(id) ON DELETE CASCADE
+) WITHOUT ROWID;
+
+-- Живые + архивные данные для аналитики; условия по group_id/time SQLite проталкивает в обе ветки
+CREATE VIEW IF NOT EXISTS events_all AS
+    SELECT id, name, time, group_id, responsible_user_id FROM events
+    UNION ALL
+    SELECT id, name, time, group_id, responsible_user_id FROM events_archive;
+
+CREATE VIEW IF NOT EXISTS event_role_requirements_all AS
+    SELECT event_id, role_name, required FROM event_role_requirements
+    UNION ALL
+    SELECT event_id, role_name, required FROM event_role_requirements_archive;
+
+CREATE VIEW IF NOT EXISTS event_role_assignments_all AS
+    SELECT event_id, role_name, user_id FROM event_role_assignments
+    UNION ALL
+    SELECT event_id, role_name, user_id FROM event_role_assignments_archive;
+
+CREATE VIEW IF NOT EXISTS bookings_all AS
+    SELECT event_id, user_id FROM bookings
+    UNION ALL
+    SELECT event_id, user_id FROM bookings_archive;
+
+-- Журнал аудита. Страницы читаются по ключу (group_id|event_id, id DESC), поэтому индексы составные
+CREATE TABLE IF NOT EXISTS audit_log (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at  TEXT DEFAULT (datetime('now')),
+    user_id     INTEGER,
+    action      TEXT NOT NULL,
+    group_id    INTEGER,
+    event_id    INTEGER,
+    old_value   TEXT,
+    new_value   TEXT,
+    FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE SET NULL,
+    FOREIGN KEY(group_id) REFERENCES groups(id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS idx_audit_created ON audit_log(created_at);
+CREATE INDEX IF NOT EXISTS idx_audit_group_id ON audit_log(group_id, id);
+CREATE INDEX IF NOT EXISTS idx_audit_event_id ON audit_log(event_id, id);
+
+-- Журнал обслуживания базы (database/maintenance.py): размеры до/после и длительность шагов
+CREATE TABLE IF NOT EXISTS db_maintenance_runs (
+    id               INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at       TEXT NOT NULL,
+    reason           TEXT,
+    duration_ms      REAL,
+    size_before      INTEGER,
+    size_after       INTEGER,
+    pages_before     INTEGER,
+    pages_after      INTEGER,
+    freelist_before  INTEGER,
+    freelist_after   INTEGER,
+    steps_json       TEXT
+);
+
+-- Шардирование (services/sharding.py, DB_SHARDS > 0): карта группа -> шард и шарды id, созданных до разбиения.
+-- Ведутся только в глобальной базе; id, созданные в шарде N, начинаются с (N + 1) * ID_RANGE и в карту не попадают
+CREATE TABLE IF NOT EXISTS group_shards (
+    group_id  INTEGER PRIMARY KEY,
+    shard     INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS shard_legacy_ids (
+    kind   TEXT NOT NULL,
+    id     INTEGER NOT NULL,
+    shard  INTEGER NOT NULL,
+    PRIMARY KEY (kind, id)
+) WITHOUT ROWID;
+
+-- Дневные агрегаты для аналитики: ведутся триггерами, так что отчеты за годы читают сотни строк, а не все мероприятия.
+-- free_slots — сумма max(0, required - записано) по ролям мероприятий дня
+CREATE TABLE IF NOT EXISTS group_daily_stats (
+    group_id        INTEGER NOT NULL,
+    day             TEXT NOT NULL,
+    events_count    INTEGER NOT NULL DEFAULT 0,
+    bookings_count  INTEGER NOT NULL DEFAULT 0,
+    required_slots  INTEGER NOT NULL DEFAULT 0,
+    free_slots      INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (group_id, day)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS trg_daily_stats_event_ins AFTER INSERT ON events
+BEGIN
+    INSERT INTO group_daily_stats (group_id, day, events_count, bookings_count, required_slots, free_slots)
+    VALUES (NEW.group_id, substr(NEW.time, 1, 10), 1, 0, 0, 0)
+    ON CONFLICT(group_id, day) DO UPDATE SET
+        events_count = events_count + excluded.events_count,
+        bookings_count = bookings_count + excluded.bookings_count,
+        required_slots = required_slots + excluded.required_slots,
+        free_slots = free_slots + excluded.free_slots;
+END;
+
+-- BEFORE: дочерние записи еще на месте; их каскадное удаление потом не найдет мероприятие и ничего не вычтет повторно
+CREATE TRIGGER IF NOT EXISTS trg_daily_stats_event_del BEFORE DELETE ON events
+BEGIN
+    INSERT INTO group_daily_stats (group_id, day, events_count, bookings_count, required_slots, free_slots)
+    SELECT OLD.group_id, substr(OLD.time, 1, 10), -1, -(SELECT COUNT(*) FROM event_role_assignments WHERE event_id = OLD.id), -(SELECT COALESCE(SUM(required), 0) FROM event_role_requirements WHERE event_id = OLD.id),
+           -(SELECT COALESCE(SUM(MAX(0, r.required - (SELECT COUNT(*) FROM event_role_assignments a WHERE a.event_id = r.event_id AND a.role_name = r.role_name))), 0)
+            FROM event_role_requirements r WHERE r.event_id = OLD.id)
+    WHERE true
+    ON CONFLICT(group_id, day) DO UPDATE SET
+        events_count = events_count + excluded.events_count,
+        bookings_count = bookings_count + excluded.bookings_count,
+        required_slots = required_slots + excluded.required_slots,
+        free_slots = free_slots + excluded.free_slots;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_daily_stats_event_move AFTER UPDATE OF time, group_id ON events
+    WHEN substr(OLD.time, 1, 10) <> substr(NEW.time, 1, 10) OR OLD.group_id <> NEW.group_id
+BEGIN
+    INSERT INTO group_daily_stats (group_id, day, events_count, bookings_count, required_slots, free_slots)
+    SELECT OLD.group_id, substr(OLD.time, 1, 10), -1, -(SELECT COUNT(*) FROM event_role_assignments WHERE event_id = OLD.id), -(SELECT COALESCE(SUM(required), 0) FROM event_role_requirements WHERE event_id = OLD.id),
+           -(SELECT COALESCE(SUM(MAX(0, r.required - (SELECT COUNT(*) FROM event_role_assignments a WHERE a.event_id = r.event_id AND a.role_name = r.role_name))), 0)
+            FROM event_role_requirements r WHERE r.event_id = OLD.id)
+    WHERE true
+    ON CONFLICT(group_id, day) DO UPDATE SET
+        events_count = events_count + excluded.events_count,
+        bookings_count = bookings_count + excluded.bookings_count,
+        required_slots = required_slots + excluded.required_slots,
+        free_slots = free_slots + excluded.free_slots;
+    INSERT INTO group_daily_stats (group_id, day, events_count, bookings_count, required_slots, free_slots)
+    SELECT NEW.group_id, substr(NEW.time, 1, 10), 1, (SELECT COUNT(*) FROM event_role_assignments WHERE event_id = NEW.id), (SELECT COALESCE(SUM(required), 0) FROM event_role_requirements WHERE event_id = NEW.id),
+           (SELECT COALESCE(SUM(MAX(0, r.required - (SELECT COUNT(*) FROM event_role_assignments a WHERE a.event_id = r.event_id AND a.role_name = r.role_name))), 0)
+            FROM event_role_requirements r WHERE r.event_id = NEW.id)
+    WHERE true
+    ON CONFLICT(group_id, day) DO UPDATE SET
+        events_count = events_count + excluded.events_count,
+        bookings_count = bookings_count + excluded.bookings_count,
+        required_slots = required_slots + excluded.required_slots,
+        free_slots = free_slots + excluded.free_slots;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_daily_stats_assign_ins AFTER INSERT ON event_role_assignments
+BEGIN
+    INSERT INTO group_daily_stats (group_id, day, events_count, bookings_count, required_slots, free_slots)
+    SELECT e.group_id, substr(e.time, 1, 10), 0, 1, 0,
+           MAX(0, COALESCE((SELECT required FROM event_role_requirements WHERE event_id = NEW.event_id AND role_name = NEW.role_name), 0) - (SELECT COUNT(*) FROM event_role_assignments WHERE event_id = NEW.event_id AND role_name = NEW.role_name)) - MAX(0, COALESCE((SELECT required FROM event_role_requirements WHERE event_id = NEW.event_id AND role_name = NEW.role_name), 0) - ((SELECT COUNT(*) FROM event_role_assignments WHERE event_id = NEW.event_id AND role_name = NEW.role_name) - 1))
+    FROM events e WHERE e.id = NEW.event_id
+    ON CONFLICT(group_id, day) DO UPDATE SET
+        events_count = events_count + excluded.events_count,
+        bookings_count = bookings_count + excluded.bookings_count,
+        required_slots = required_slots + excluded.required_slots,
+        free_slots = free_slots + excluded.free_slots;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_daily_stats_assign_del AFTER DELETE ON event_role_assignments
+BEGIN
+    INSERT INTO group_daily_stats (group_id, day, events_count, bookings_count, required_slots, free_slots)
+    SELECT e.group_id, substr(e.time, 1, 10), 0, -1, 0,
+           MAX(0, COALESCE((SELECT required FROM event_role_requirements WHERE event_id = OLD.event_id AND role_name = OLD.role_name), 0) - (SELECT COUNT(*) FROM event_role_assignments WHERE event_id = OLD.event_id AND role_name = OLD.role_name)) - MAX(0, COALESCE((SELECT required FROM event_role_requirements WHERE event_id = OLD.event_id AND role_name = OLD.role_name), 0) - ((SELECT COUNT(*) FROM event_role_assignments WHERE event_id = OLD.event_id AND role_name = OLD.role_name) + 1))
+    FROM events e WHERE e.id = OLD.event_id
+    ON CONFLICT(group_id, day) DO UPDATE SET
+        events_count = events_count + excluded.events_count,
+        bookings_count = bookings_count + excluded.bookings_count,
+        required_slots = required_slots + excluded.required_slots,
+        free_slots = free_slots + excluded.free_slots;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_daily_stats_assign_upd AFTER UPDATE OF event_id, role_name ON event_role_assignments
+BEGIN
+    INSERT INTO group_daily_stats (group_id, day, events_count, bookings_count, required_slots, free_slots)
+    SELECT e.group_id, substr(e.time, 1, 10), 0, -1, 0,
+           MAX(0, COALESCE((SELECT required FROM event_role_requirements WHERE event_id = OLD.event_id AND role_name = OLD.role_name), 0) - (SELECT COUNT(*) FROM event_role_assignments WHERE event_id = OLD.event_id AND role_name = OLD.role_name)) - MAX(0, COALESCE((SELECT required FROM event_role_requirements WHERE event_id = OLD.event_id AND role_name = OLD.role_name), 0) - ((SELECT COUNT(*) FROM event_role_assignments WHERE event_id = OLD.event_id AND role_name = OLD.role_name) + 1))
+    FROM events e WHERE e.id = OLD.event_id
+    ON CONFLICT(group_id, day) DO UPDATE SET
+        events_count = events_count + excluded.events_count,
+        bookings_count = bookings_count + excluded.bookings_count,
+        required_slots = required_slots + excluded.required_slots,
+        free_slots = free_slots + excluded.free_slots;
+    INSERT INTO group_daily_stats (group_id, day, events_count, bookings_count, required_slots, free_slots)
+    SELECT e.group_id, substr(e.time, 1, 10), 0, 1, 0,
+           MAX(0, COALESCE((SELECT required FROM event_role_requirements WHERE event_id = NEW.event_id AND role_name = NEW.role_name), 0) - (SELECT COUNT(*) FROM event_role_assignments WHERE event_id = NEW.event_id AND role_name = NEW.role_name)) - MAX(0, COALESCE((SELECT required FROM event_role_requirements WHERE event_id = NEW.event_id AND role_name = NEW.role_name), 0) - ((SELECT COUNT(*) FROM event_role_assignments WHERE event_id = NEW.event_id AND role_name = NEW.role_name) - 1))
+    FROM events e WHERE e.id = NEW.event_id
+    ON CONFLICT(group_id, day) DO UPDATE SET
+        events_count = events_count + excluded.events_count,
+        bookings_count = bookings_count + excluded.bookings_count,
+        required_slots = required_slots + excluded.required_slots,
+        free_slots = free_slots + excluded.free_slots;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_daily_stats_reqs_ins AFTER INSERT ON event_role_requirements
+BEGIN
+    INSERT INTO group_daily_stats (group_id, day, events_count, bookings_count, required_slots, free_slots)
+    SELECT e.group_id, substr(e.time, 1, 10), 0, 0, NEW.required,
+           MAX(0, NEW.required - (SELECT COUNT(*) FROM event_role_assignments WHERE event_id = NEW.event_id AND role_name = NEW.role_name))
+    FROM events e WHERE e.id = NEW.event_id
+    ON CONFLICT(group_id, day) DO UPDATE SET
+        events_count = events_count + excluded.events_count,
+        bookings_count = bookings_count + excluded.bookings_count,
+        required_slots = required_slots + excluded.required_slots,
+        free_slots = free_slots + excluded.free_slots;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_daily_stats_reqs_del AFTER DELETE ON event_role_requirements
+BEGIN
+    INSERT INTO group_daily_stats (group_id, day, events_count, bookings_count, required_slots, free_slots)
+    SELECT e.group_id, substr(e.time, 1, 10), 0, 0, -OLD.required,
+           -MAX(0, OLD.required - (SELECT COUNT(*) FROM event_role_assignments WHERE event_id = OLD.event_id AND role_name = OLD.role_name))
+    FROM events e WHERE e.id = OLD.event_id
+    ON CONFLICT(group_id, day) DO UPDATE SET
+        events_count = events_count + excluded.events_count,
+        bookings_count = bookings_count + excluded.bookings_count,
+        required_slots = required_slots + excluded.required_slots,
+        free_slots = free_slots + excluded.free_slots;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_daily_stats_reqs_upd AFTER UPDATE ON event_role_requirements
+BEGIN
+    INSERT INTO group_daily_stats (group_id, day, events_count, bookings_count, required_slots, free_slots)
+    SELECT e.group_id, substr(e.time, 1, 10), 0, 0, -OLD.required,
+           -MAX(0, OLD.required - (SELECT COUNT(*) FROM event_role_assignments WHERE event_id = OLD.event_id AND role_name = OLD.role_name))
+    FROM events e WHERE e.id = OLD.event_id
+    ON CONFLICT(group_id, day) DO UPDATE SET
+        events_count = events_count + excluded.events_count,
+        bookings_count = bookings_count + excluded.bookings_count,
+        required_slots = required_slots + excluded.required_slots,
+        free_slots = free_slots + excluded.free_slots;
+    INSERT INTO group_daily_stats (group_id, day, events_count, bookings_count, required_slots, free_slots)
+    SELECT e.group_id, substr(e.time, 1, 10), 0, 0, NEW.required,
+           MAX(0, NEW.required - (SELECT COUNT(*) FROM event_role_assignments WHERE event_id = NEW.event_id AND role_name = NEW.role_name))
+    FROM events e WHERE e.id = NEW.event_id
+    ON CONFLICT(group_id, day) DO UPDATE SET
+        events_count = events_count + excluded.events_count,
+        bookings_count = bookings_count + excluded.bookings_count,
+        required_slots = required_slots + excluded.required_slots,
+        free_slots = free_slots + excluded.free_slots;
+END;
@@ -0,0 +1,221 @@
+"""
+Хранение журнала аудита: горячая таблица audit_log + помесячные архивные SQLite-файлы.
+
+Строки старше AUDIT_RETENTION_DAYS переносятся в data/audit_archive/audit_YYYY-MM.db пачками:
+пачка сначала фиксируется в архиве (INSERT OR IGNORE по id), потом удаляется из основной базы
+короткой транзакцией — прерванный перенос безопасно повторить. Вместе со строкой сохраняются
+подписи пользователя/группы/мероприятия на момент переноса (сами записи к тому времени могут быть удалены).
+
+search() читает архив по требованию: только файлы месяцев из запрошенного диапазона, от новых к старым.
+
+CLI: python -m services.audit_archive archive [--days N] [--chunk N]
+     python -m services.audit_archive search [--group ID] [--event ID] [--action A] [--text T] [--from D] [--to D]
+"""
+import os
+import sqlite3
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from services.repositories import AuditLogRepo, BASE_DIR, get_conn, with_event_names
+
+AUDIT_RETENTION_DAYS = int(os.getenv('AUDIT_RETENTION_DAYS', '180'))
+ARCHIVE_DIR = Path(os.getenv('AUDIT_ARCHIVE_DIR') or (BASE_DIR / 'data' / 'audit_archive'))
+CHUNK_SIZE = 2000
+
+_ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS audit_log (
+    id           INTEGER PRIMARY KEY,
+    created_at   TEXT,
+    user_id      INTEGER,
+    action       TEXT NOT NULL,
+    group_id     INTEGER,
+    event_id     INTEGER,
+    old_value    TEXT,
+    new_value    TEXT,
+    user_label   TEXT,
+    group_title  TEXT,
+    event_name   TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_audit_group_id ON audit_log(group_id, id);
+CREATE INDEX IF NOT EXISTS idx_audit_event_id ON audit_log(event_id, id);
+"""
+
+_COLUMNS = ('id', 'created_at', 'user_id', 'action', 'group_id', 'event_id', 'old_value', 'new_value',
+            'user_label', 'group_title', 'event_name')
+
+
+def _month_path(month: str) -> Path:
+    return ARCHIVE_DIR / f"audit_{month}.db"
+
+
+def _open_month(month: str, create: bool = False) -> Optional[sqlite3.Connection]:
+    path = _month_path(month)
+    if not path.exists():
+        if not create:
+            return None
+        ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path.as_posix())
+    if create:
+        conn.executescript(_ARCHIVE_SCHEMA)
+    return conn
+
+
+def list_months() -> List[str]:
+    """Archived months ('YYYY-MM'), newest first."""
+    if not ARCHIVE_DIR.exists():
+        return []
+    return sorted((p.stem[len('audit_'):] for p in ARCHIVE_DIR.glob('audit_????-??.db')), reverse=True)
+
+
+def _fetch_chunk(cutoff: str, chunk_size: int) -> List[Tuple]:
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT a.id, a.created_at, a.user_id, a.action, a.group_id, a.event_id, a.old_value, a.new_value,
+                   CASE WHEN u.id IS NULL THEN NULL
+                        ELSE COALESCE(NULLIF(TRIM(COALESCE(u.first_name, '') || ' ' || COALESCE(u.last_name, '')), ''),
+                                      '@' || u.username, CAST(u.telegram_id AS TEXT)) || ' (' || u.telegram_id || ')' END,
+                   g.title, e.name
+            FROM audit_log a
+            LEFT JOIN users u ON u.id = a.user_id
+            LEFT JOIN groups g ON g.id = a.group_id
+            LEFT JOIN events e ON e.id = a.event_id
+            WHERE a.created_at < ?
+            ORDER BY a.id
+            LIMIT ?
+            """,
+            (cutoff, chunk_size),
+        )
+        return with_event_names(cur.fetchall(), 5, 10)
+
+
+def archive_old(retention_days: int = AUDIT_RETENTION_DAYS, chunk_size: int = CHUNK_SIZE,
+                max_chunks: Optional[int] = None) -> Dict[str, int]:
+    """Moves rows older than retention_days into monthly archive files. Returns {'YYYY-MM': moved}."""
+    cutoff = (datetime.utcnow() - timedelta(days=retention_days)).strftime('%Y-%m-%d %H:%M:%S')  # created_at — UTC (datetime('now'))
+    moved: Dict[str, int] = {}
+    chunks = 0
+    while max_chunks is None or chunks < max_chunks:
+        rows = _fetch_chunk(cutoff, chunk_size)
+        if not rows:
+            break
+        by_month: Dict[str, List[Tuple]] = {}
+        for row in rows:
+            by_month.setdefault((row[1] or '0000-00')[:7], []).append(row)
+        for month, month_rows in by_month.items():
+            conn = _open_month(month, create=True)
+            try:
+                with conn:
+                    conn.executemany(
+                        f"INSERT OR IGNORE INTO audit_log ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                        month_rows,
+                    )
+            finally:
+                conn.close()
+            moved[month] = moved.get(month, 0) + len(month_rows)
+        with get_conn() as conn:
+            conn.executemany("DELETE FROM audit_log WHERE id = ?", [(row[0],) for row in rows])
+            conn.commit()
+        chunks += 1
+    if moved:
+        AuditLogRepo.invalidate_count()
+        print(f"[AUDIT_ARCHIVE] moved {sum(moved.values())} rows older than {retention_days}d: "
+              + ', '.join(f"{m}={n}" for m, n in sorted(moved.items())))
+    return moved
+
+
+def search(*, group_id: Optional[int] = None, event_id: Optional[int] = None, action: Optional[str] = None,
+           text: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None,
+           before_id: Optional[int] = None, limit: int = 100) -> List[dict]:
+    """
+    Searches archived rows, newest first. date_from/date_to: 'YYYY-MM-DD' (inclusive) — also limit which files are opened.
+    text matches old/new values and the saved labels. before_id continues from the last returned id.
+    """
+    where, params = [], []
+    if group_id:
+        where.append("group_id = ?")
+        params.append(group_id)
+    if event_id:
+        where.append("event_id = ?")
+        params.append(event_id)
+    if action:
+        where.append("action = ?")
+        params.append(action)
+    if text:
+        where.append("(old_value LIKE ? OR new_value LIKE ? OR user_label LIKE ? OR event_name LIKE ?)")
+        params += [f"%{text}%"] * 4
+    if date_from:
+        where.append("created_at >= ?")
+        params.append(date_from)
+    if date_to:
+        where.append("created_at < date(?, '+1 day')")
+        params.append(date_to)
+    if before_id:
+        where.append("id < ?")
+        params.append(before_id)
+    sql = (f"SELECT {', '.join(_COLUMNS)} FROM audit_log" + (" WHERE " + " AND ".join(where) if where else "")
+           + " ORDER BY id DESC LIMIT ?")
+
+    results: List[dict] = []
+    for month in list_months():
+        if date_from and month < date_from[:7]:
+            break
+        if date_to and month > date_to[:7]:
+            continue
+        conn = _open_month(month)
+        if conn is None:
+            continue
+        try:
+            rows = conn.execute(sql, (*params, limit - len(results))).fetchall()
+        finally:
+            conn.close()
+        results.extend(dict(zip(_COLUMNS, row)) for row in rows)
+        if len(results) >= limit:
+            break
+    return results
+
+
+def iter_month(month: str) -> Iterator[dict]:
+    """All rows of one archived month, oldest first (export)."""
+    conn = _open_month(month)
+    if conn is None:
+        return
+    try:
+        for row in conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM audit_log ORDER BY id"):
+            yield dict(zip(_COLUMNS, row))
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description='Архив журнала аудита')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p_archive = sub.add_parser('archive', help='перенести старые строки в помесячные файлы')
+    p_archive.add_argument('--days', type=int, default=AUDIT_RETENTION_DAYS)
+    p_archive.add_argument('--chunk', type=int, default=CHUNK_SIZE)
+    p_search = sub.add_parser('search', help='поиск по архиву')
+    p_search.add_argument('--group', type=int)
+    p_search.add_argument('--event', type=int)
+    p_search.add_argument('--action')
+    p_search.add_argument('--text')
+    p_search.add_argument('--from', dest='date_from')
+    p_search.add_argument('--to', dest='date_to')
+    p_search.add_argument('--limit', type=int, default=100)
+    sub.add_parser('months', help='список архивных месяцев')
+    args = parser.parse_args()
+
+    if args.cmd == 'archive':
+        moved = archive_old(args.days, args.chunk)
+        print(f"Перенесено строк: {sum(moved.values())}")
+    elif args.cmd == 'search':
+        for item in search(group_id=args.group, event_id=args.event, action=args.action, text=args.text,
+                           date_from=args.date_from, date_to=args.date_to, limit=args.limit):
+            print(json.dumps(item, ensure_ascii=False))
+    else:
+        for month in list_months():
+            print(month)
@@ -0,0 +1,173 @@
+"""
+Журнал изменений (таблица change_log) для инкрементальных потребителей: кэшей, планировщика, агрегатов, push.
+
+Записи пишут триггеры schema.sql на events, event_role_assignments, event_notifications,
+personal_event_notifications, user_group_roles и user_display_names — в той же транзакции, что и само
+изменение, поэтому изменения бота, веба и скриптов видны одинаково. Запись: (seq, table_name, op, group_id,
+event_id, row_id, created_at); op: 'I' | 'U' | 'D'. Потребитель хранит позицию (последний seq) и читает
+следующие записи — ChangeLogCursor.poll().
+
+Очистка: prune() удаляет записи старше CHANGE_LOG_RETENTION_HOURS и сверх CHANGE_LOG_MAX_ROWS (задание бота).
+Если позиция потребителя отстала за границу очистки, poll() бросает ChangeLogTruncated — потребитель
+перечитывает состояние целиком и продолжает с reset().
+
+С шардированием у каждого шарда свой журнал и своя последовательность seq: позиция курсора — {шард: seq},
+изменения участников видны через копии user_group_roles в шардах.
+
+CLI: python -m services.change_log tail [--group ID] [--last N] [--follow]
+     python -m services.change_log prune [--hours N] [--max-rows N]
+"""
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from services.repositories import get_conn, shard_ids
+
+CHANGE_LOG_RETENTION_HOURS = int(os.getenv('CHANGE_LOG_RETENTION_HOURS', '72'))
+CHANGE_LOG_MAX_ROWS = int(os.getenv('CHANGE_LOG_MAX_ROWS', '500000'))
+PAGE_SIZE = 500
+CHUNK_SIZE = 5000
+
+
+class ChangeLogTruncated(Exception):
+    """The cursor position is older than the oldest kept entry: changes were pruned before they were read."""
+
+
+def _latest_seq(conn) -> int:
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+    return row[0] if row else 0
+
+
+def latest_seq(shard: Optional[int] = None) -> int:
+    """Last assigned seq (0 for an empty log)."""
+    with get_conn(shard=shard) as conn:
+        return _latest_seq(conn)
+
+
+def oldest_seq(shard: Optional[int] = None) -> int:
+    """Seq of the oldest kept entry (latest + 1 when everything was pruned)."""
+    with get_conn(shard=shard) as conn:
+        oldest = conn.execute("SELECT MIN(seq) FROM change_log").fetchone()[0]
+        return oldest if oldest is not None else _latest_seq(conn) + 1
+
+
+def read_since(after_seq: int, *, limit: int = PAGE_SIZE, group_id: Optional[int] = None,
+               tables: Optional[Iterable[str]] = None, shard: Optional[int] = None) -> List[Tuple]:
+    """
+    Entries with seq > after_seq in seq order: (seq, table_name, op, group_id, event_id, row_id, created_at).
+    Does not check for pruned entries — ChangeLogCursor does.
+    """
+    where, params = ["seq > ?"], [after_seq]
+    if group_id is not None:
+        where.append("group_id = ?")
+        params.append(group_id)
+    tables = list(tables or ())
+    if tables:
+        where.append(f"table_name IN ({', '.join('?' for _ in tables)})")
+        params.extend(tables)
+    with get_conn(shard=shard) as conn:
+        cur = conn.execute(
+            f"SELECT seq, table_name, op, group_id, event_id, row_id, created_at FROM change_log "
+            f"WHERE {' AND '.join(where)} ORDER BY seq LIMIT ?",
+            (*params, limit),
+        )
+        return cur.fetchall()
+
+
+class ChangeLogCursor:
+    """
+    Tails change_log from a position. positions=None starts at the current end of the log;
+    a saved cursor.positions ({shard: seq}, shard None without sharding) resumes where the consumer stopped.
+    """
+
+    def __init__(self, positions: Optional[Dict[Optional[int], int]] = None, *, group_id: Optional[int] = None,
+                 tables: Optional[Iterable[str]] = None):
+        self.group_id = group_id
+        self.tables = list(tables or ())
+        self.positions: Dict[Optional[int], int] = dict(positions or {})
+        for shard in shard_ids():
+            if shard not in self.positions:
+                self.positions[shard] = latest_seq(shard)
+
+    def reset(self) -> None:
+        """Moves to the current end of the log (after a full resync)."""
+        self.positions = {shard: latest_seq(shard) for shard in shard_ids()}
+
+    def _check(self, shard: Optional[int], position: int) -> None:
+        oldest = oldest_seq(shard)
+        if position < oldest - 1:
+            raise ChangeLogTruncated(f"change_log{'' if shard is None else f' shard {shard}'}: position {position}, oldest kept {oldest}")
+
+    def poll(self, limit: int = PAGE_SIZE) -> List[Tuple]:
+        """Next entries (up to `limit` per database) and advances the position. Raises ChangeLogTruncated."""
+        changes: List[Tuple] = []
+        for shard, position in self.positions.items():
+            self._check(shard, position)
+            # Конец журнала берем до чтения: записи после него прочитаем в следующий раз
+            latest = latest_seq(shard)
+            rows = read_since(position, limit=limit, group_id=self.group_id, tables=self.tables, shard=shard)
+            if len(rows) < limit:
+                # Фильтрованный курсор прочитал все подходящее до latest — сдвигаемся к концу,
+                # иначе позиция стоит на месте, пока чужие записи не уйдут в prune
+                self.positions[shard] = max(rows[-1][0] if rows else position, latest)
+            else:
+                self.positions[shard] = rows[-1][0]
+            changes.extend(rows)
+        return changes
+
+
+def prune(retention_hours: int = CHANGE_LOG_RETENTION_HOURS, max_rows: int = CHANGE_LOG_MAX_ROWS,
+          chunk_size: int = CHUNK_SIZE) -> int:
+    """Deletes entries older than retention_hours or beyond the newest max_rows, in short chunks. Returns deleted count."""
+    cutoff = (datetime.utcnow() - timedelta(hours=retention_hours)).strftime('%Y-%m-%d %H:%M:%S')  # created_at — UTC
+    total = 0
+    # С шардированием журнал ведет и глобальная база (user_group_roles) — чистим все файлы
+    shards = shard_ids()
+    for shard in (shards if shards == [None] else [None] + shards):
+        with get_conn(shard=shard) as conn:
+            latest = _latest_seq(conn)
+            # seq и created_at растут вместе: граница — первая запись не старше cutoff
+            row = conn.execute("SELECT seq FROM change_log WHERE created_at >= ? ORDER BY seq LIMIT 1", (cutoff,)).fetchone()
+            keep_from = row[0] if row else latest + 1
+            if max_rows:
+                keep_from = max(keep_from, latest - max_rows + 1)
+            while True:
+                cur = conn.execute(
+                    "DELETE FROM change_log WHERE seq IN (SELECT seq FROM change_log WHERE seq < ? ORDER BY seq LIMIT ?)",
+                    (keep_from, chunk_size),
+                )
+                conn.commit()
+                total += cur.rowcount
+                if cur.rowcount < chunk_size:
+                    break
+    if total:
+        print(f"[CHANGE_LOG] pruned {total} entries (older than {retention_hours}h or beyond {max_rows} rows)")
+    return total
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Журнал изменений')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p_tail = sub.add_parser('tail', help='последние изменения')
+    p_tail.add_argument('--group', type=int)
+    p_tail.add_argument('--last', type=int, default=20, help='сколько записей показать до конца журнала')
+    p_tail.add_argument('--follow', action='store_true')
+    p_prune = sub.add_parser('prune', help='удалить старые записи')
+    p_prune.add_argument('--hours', type=int, default=CHANGE_LOG_RETENTION_HOURS)
+    p_prune.add_argument('--max-rows', type=int, default=CHANGE_LOG_MAX_ROWS)
+    args = parser.parse_args()
+
+    if args.cmd == 'tail':
+        cursor = ChangeLogCursor({shard: max(oldest_seq(shard) - 1, latest_seq(shard) - args.last) for shard in shard_ids()},
+                                 group_id=args.group)
+        while True:
+            for change in cursor.poll():
+                print(*change, sep='\t')
+            if not args.follow:
+                break
+            time.sleep(1)
+    else:
+        print(f"Удалено записей: {prune(args.hours, args.max_rows)}")
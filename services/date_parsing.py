@@ -0,0 +1,222 @@
+"""
+Разбор русскоязычных дат/времени.
+
+Частые формы ввода ("25.12 18:00", "завтра в 19:00", "пн 10:00", "22 сентября 8 утра",
+ISO-строки) разбираются вручную; всё остальное уходит в dateparser, который импортируется
+лениво — только при первом непокрытом вводе. Результаты кэшируются (LRU).
+Все значения — наивное локальное время (Europe/Moscow), как и в базе.
+"""
+import re
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Optional, Tuple
+from zoneinfo import ZoneInfo
+
+MSK = ZoneInfo('Europe/Moscow')
+
+_MONTHS = {
+    'январь': 1, 'января': 1, 'янв': 1,
+    'февраль': 2, 'февраля': 2, 'фев': 2,
+    'март': 3, 'марта': 3, 'мар': 3,
+    'апрель': 4, 'апреля': 4, 'апр': 4,
+    'май': 5, 'мая': 5,
+    'июнь': 6, 'июня': 6, 'июн': 6,
+    'июль': 7, 'июля': 7, 'июл': 7,
+    'август': 8, 'августа': 8, 'авг': 8,
+    'сентябрь': 9, 'сентября': 9, 'сен': 9, 'сент': 9,
+    'октябрь': 10, 'октября': 10, 'окт': 10,
+    'ноябрь': 11, 'ноября': 11, 'ноя': 11,
+    'декабрь': 12, 'декабря': 12, 'дек': 12,
+}
+
+_WEEKDAYS = {
+    'пн': 0, 'пон': 0, 'понедельник': 0,
+    'вт': 1, 'вторник': 1,
+    'ср': 2, 'среда': 2, 'среду': 2,
+    'чт': 3, 'четверг': 3,
+    'пт': 4, 'пятница': 4, 'пятницу': 4,
+    'сб': 5, 'суббота': 5, 'субботу': 5,
+    'вс': 6, 'воскресенье': 6,
+}
+
+_RELATIVE_DAYS = {'сегодня': 0, 'завтра': 1, 'послезавтра': 2}
+
+# Форматы, в которых время хранится в базе и вводится в веб-формах
+_STORED_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%d.%m.%Y %H:%M:%S", "%d.%m.%Y %H:%M")
+
+_ISO_RE = re.compile(r'^(\d{4})-(\d{2})-(\d{2})(?:[ t](\d{1,2}):(\d{2})(?::(\d{2}))?)?$')
+_NUMERIC_DATE_RE = re.compile(r'^(\d{1,2})[./](\d{1,2})(?:[./](\d{2}|\d{4}))?(?:\s+(.+))?$')
+_NAMED_DATE_RE = re.compile(r'^(\d{1,2})\s+([а-я]+)\.?(?:\s+(\d{4})(?:\s*(?:г|года?)\.?)?)?(?:\s+(.+))?$')
+_WORD_DATE_RE = re.compile(r'^(?:(?:в|во)\s+)?([а-я]+)\.?(?:\s+(.+))?$')
+_TIME_RE = re.compile(
+    r'^(?:(?:в|к)\s+)?(\d{1,2})(?:[:.](\d{2})(?::(\d{2}))?)?'
+    r'(?:\s*(ч|час|часа|часов|утра|дня|вечера|ночи))?$'
+)
+
+
+def _now_msk() -> datetime:
+    return datetime.now(MSK).replace(tzinfo=None, second=0, microsecond=0)
+
+
+def _parse_time(text: Optional[str]) -> Optional[Tuple[int, int, int]]:
+    """'18:00', 'в 19:00', '8 утра', '11 часов', '7 вечера' -> (h, m, s). None if not a time."""
+    if not text:
+        return None
+    m = _TIME_RE.match(text.strip())
+    if not m:
+        return None
+    hour = int(m.group(1))
+    minute = int(m.group(2) or 0)
+    second = int(m.group(3) or 0)
+    suffix = m.group(4)
+    # Bare number without ':' and without a unit is not a time ("25 12" etc.)
+    if m.group(2) is None and suffix is None:
+        return None
+    if suffix in ('дня', 'вечера') and hour < 12:
+        hour += 12
+    elif suffix == 'ночи' and hour == 12:
+        hour = 0
+    if hour > 23 or minute > 59 or second > 59:
+        return None
+    return hour, minute, second
+
+
+def _split_date_time(rest: Optional[str]) -> Optional[Tuple[int, int, int]]:
+    """Time part after a date: missing -> 00:00, unparseable -> None (caller falls back)."""
+    if rest is None:
+        return 0, 0, 0
+    return _parse_time(rest)
+
+
+def _fast_parse(text: str, now: datetime) -> Optional[datetime]:
+    m = _ISO_RE.match(text)
+    if m:
+        y, mo, d, hh, mi, ss = m.groups()
+        try:
+            return datetime(int(y), int(mo), int(d), int(hh or 0), int(mi or 0), int(ss or 0))
+        except ValueError:
+            return None
+
+    m = _NUMERIC_DATE_RE.match(text)
+    if m:
+        d, mo, y, rest = m.groups()
+        t = _split_date_time(rest)
+        if t is None:
+            return None
+        return _build_date(int(d), int(mo), y, t, now)
+
+    m = _NAMED_DATE_RE.match(text)
+    if m:
+        d, month_word, y, rest = m.groups()
+        month = _MONTHS.get(month_word)
+        if month is None:
+            return None
+        t = _split_date_time(rest)
+        if t is None:
+            return None
+        return _build_date(int(d), month, y, t, now)
+
+    m = _WORD_DATE_RE.match(text)
+    if m:
+        word, rest = m.groups()
+        t = _parse_time(rest) if rest else None
+        if t is None:
+            # "завтра" без времени у dateparser означает "через сутки от текущего момента" — не угадываем
+            return None
+        if word in _RELATIVE_DAYS:
+            day = now + timedelta(days=_RELATIVE_DAYS[word])
+            return day.replace(hour=t[0], minute=t[1], second=t[2])
+        if word in _WEEKDAYS:
+            ahead = (_WEEKDAYS[word] - now.weekday()) % 7
+            candidate = (now + timedelta(days=ahead)).replace(hour=t[0], minute=t[1], second=t[2])
+            if candidate <= now:
+                candidate += timedelta(days=7)
+            return candidate
+        return None
+
+    return None
+
+
+def _build_date(day: int, month: int, year: Optional[str], t: Tuple[int, int, int], now: datetime) -> Optional[datetime]:
+    try:
+        if year is not None:
+            y = int(year)
+            if y < 100:
+                y += 2000
+            return datetime(y, month, day, *t)
+        candidate = datetime(now.year, month, day, *t)
+        # Как PREFER_DATES_FROM='future': прошедшая дата без года — это следующий год
+        if candidate.date() < now.date():
+            candidate = candidate.replace(year=now.year + 1)
+        return candidate
+    except ValueError:
+        return None
+
+
+def _normalize(text: str) -> str:
+    return ' '.join((text or '').lower().replace(',', ' ').split())
+
+
+def _dateparser_parse(text: str, settings: dict) -> Optional[datetime]:
+    import dateparser  # тяжелый импорт — только когда быстрый путь не справился
+    return dateparser.parse(text, languages=["ru"], settings=settings)
+
+
+@lru_cache(maxsize=1024)
+def _parse_cached(normalized: str, now_key: str) -> Optional[datetime]:
+    now = datetime.strptime(now_key, '%Y-%m-%d %H:%M')
+    dt = _fast_parse(normalized, now)
+    if dt is not None:
+        return dt
+    return _dateparser_parse(normalized, {
+        'PREFER_DATES_FROM': 'future',
+        'DATE_ORDER': 'DMY',
+        'TIMEZONE': 'Europe/Moscow',
+        'RETURN_AS_TIMEZONE_AWARE': False,
+    })
+
+
+def parse_ru_datetime(text: str, now: Optional[datetime] = None) -> Optional[datetime]:
+    """Парсит русскоязычное описание даты/времени в datetime (локальное время)."""
+    normalized = _normalize(text)
+    if not normalized:
+        return None
+    now = now or _now_msk()
+    # Relative inputs depend on the current minute, so it is part of the cache key
+    return _parse_cached(normalized, now.strftime('%Y-%m-%d %H:%M'))
+
+
+@lru_cache(maxsize=4096)
+def _parse_stored(time_str: str) -> Optional[datetime]:
+    # Сохраненные форматы абсолютные — кэш не зависит от текущего времени
+    for fmt in _STORED_FORMATS:
+        try:
+            return datetime.strptime(time_str, fmt)
+        except (ValueError, TypeError):
+            pass
+    try:
+        return datetime.fromisoformat(time_str)
+    except (ValueError, TypeError):
+        return None
+
+
+def parse_event_time(time_str: str) -> Optional[datetime]:
+    """
+    Время мероприятия из базы/формы -> datetime. Кэшируются только сохраненные форматы; прочий текст
+    разбирает dateparser без кэша — он может быть относительным. Ввод пользователя — parse_ru_datetime.
+    """
+    dt = _parse_stored(time_str)
+    if dt is not None or not time_str:
+        return dt
+    return _dateparser_parse(time_str, {'DATE_ORDER': 'DMY'})
+
+
+def format_event_time_display(time_str: str) -> str:
+    """
+    Пытается привести время к виду ДД.ММ.ГГГГ ЧЧ:ММ:СС для отображения. Без своего кэша: сохраненные
+    форматы кэширует _parse_stored, а прочий текст может быть относительным.
+    """
+    dt = parse_event_time(time_str)
+    if dt:
+        return dt.strftime("%d.%m.%Y %H:%M:%S")
+    return time_str
@@ -0,0 +1,161 @@
+"""
+Холодный архив прошедших мероприятий.
+
+Мероприятия, прошедшие больше EVENT_ARCHIVE_DAYS назад, переносятся пачками из events и зависимых таблиц
+(роли, записи, бронирования) в *_archive таблицы той же базы; настройки оповещений и журнал отправок
+сохраняются в events_archive.notifications_json. Каждая пачка — одна транзакция: копия + удаление
+(каскад по FK убирает зависимые строки). Дневные агрегаты group_daily_stats при этом не меняются —
+то, что вычли триггеры удаления, возвращается в той же транзакции.
+
+Архивные мероприятия видны во вкладке «Архив» (только чтение) и в аналитике (представления *_all).
+
+CLI: python -m services.event_archive [--days N] [--chunk N]
+"""
+import json
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional
+from zoneinfo import ZoneInfo
+
+from services.repositories import get_conn, shard_ids
+
+EVENT_ARCHIVE_DAYS = int(os.getenv('EVENT_ARCHIVE_DAYS', '90'))
+CHUNK_SIZE = 200
+
+# Колонки events, которые есть в events_archive (часть колонок events добавляется миграциями)
+_ARCHIVE_EVENT_COLUMNS = ('id', 'name', 'time', 'group_id', 'responsible_user_id', 'created_at',
+                          'created_by_user_id', 'updated_by_user_id', 'updated_at', 'allow_multi_roles_per_user')
+
+_NOTIFICATIONS_JSON = """
+    json_object(
+        'event_notifications',
+        (SELECT json_group_array(json_object('time_before', n.time_before, 'time_unit', n.time_unit,
+                                             'message_text', n.message_text, 'created_at', n.created_at))
+         FROM event_notifications n WHERE n.event_id = e.id),
+        'personal_event_notifications',
+        (SELECT json_group_array(json_object('user_id', p.user_id, 'time_before', p.time_before, 'time_unit', p.time_unit,
+                                             'message_text', p.message_text, 'created_at', p.created_at))
+         FROM personal_event_notifications p WHERE p.event_id = e.id),
+        'dispatch_log',
+        (SELECT json_group_array(json_object('kind', d.kind, 'user_id', d.user_id, 'time_before', d.time_before,
+                                             'time_unit', d.time_unit, 'sent_at', d.sent_at))
+         FROM notification_dispatch_log d WHERE d.event_id = e.id)
+    )
+"""
+
+# Вклад пачки в group_daily_stats (та же формула, что у триггеров и rebuild_daily_stats)
+_BATCH_STATS = """
+    SELECT e.group_id, substr(e.time, 1, 10), COUNT(*),
+           SUM((SELECT COUNT(*) FROM event_role_assignments a WHERE a.event_id = e.id)),
+           SUM((SELECT COALESCE(SUM(required), 0) FROM event_role_requirements r WHERE r.event_id = e.id)),
+           SUM((SELECT COALESCE(SUM(MAX(0, r.required - (SELECT COUNT(*) FROM event_role_assignments a
+                                                           WHERE a.event_id = r.event_id AND a.role_name = r.role_name))), 0)
+                FROM event_role_requirements r WHERE r.event_id = e.id))
+    FROM events e
+    WHERE e.id IN (SELECT value FROM json_each(?))
+    GROUP BY e.group_id, substr(e.time, 1, 10)
+"""
+
+
+def _cutoff(days: int) -> str:
+    now = datetime.now(ZoneInfo("Europe/Moscow")).replace(tzinfo=None)
+    return (now - timedelta(days=days)).strftime('%Y-%m-%d %H:%M')
+
+
+def _event_columns(cur) -> List[str]:
+    cur.execute("PRAGMA table_info(events)")
+    present = {row[1] for row in cur.fetchall()}
+    return [c for c in _ARCHIVE_EVENT_COLUMNS if c in present]
+
+
+def archive_chunk(cutoff: str, chunk_size: int = CHUNK_SIZE, shard: Optional[int] = None) -> int:
+    """Moves up to chunk_size events that started before cutoff ('YYYY-MM-DD HH:MM', MSK). Returns moved count."""
+    with get_conn(shard=shard) as conn:
+        cur = conn.cursor()
+        cols = ', '.join(_event_columns(cur))
+        in_batch = "IN (SELECT value FROM json_each(?))"
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            cur.execute(
+                "SELECT id FROM events "
+                "WHERE time < ? AND time GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9] *' "
+                "ORDER BY time LIMIT ?",
+                (cutoff, chunk_size),
+            )
+            ids = [row[0] for row in cur.fetchall()]
+            if not ids:
+                conn.rollback()
+                return 0
+            ids_json = json.dumps(ids)
+
+            cur.execute(
+                f"INSERT INTO events_archive ({cols}, notifications_json) "
+                f"SELECT {', '.join('e.' + c for c in cols.split(', '))}, {_NOTIFICATIONS_JSON} FROM events e WHERE e.id {in_batch}",
+                (ids_json,),
+            )
+            cur.execute(f"INSERT INTO event_role_requirements_archive (event_id, role_name, required) "
+                        f"SELECT event_id, role_name, required FROM event_role_requirements WHERE event_id {in_batch}", (ids_json,))
+            cur.execute(f"INSERT OR IGNORE INTO event_role_assignments_archive (event_id, role_name, user_id) "
+                        f"SELECT event_id, role_name, user_id FROM event_role_assignments WHERE event_id {in_batch}", (ids_json,))
+            cur.execute(f"INSERT INTO bookings_archive (event_id, user_id, created_at) "
+                        f"SELECT event_id, user_id, created_at FROM bookings WHERE event_id {in_batch}", (ids_json,))
+            cur.execute(_BATCH_STATS, (ids_json,))
+            stats = cur.fetchall()
+
+            cur.execute(f"DELETE FROM events WHERE id {in_batch}", (ids_json,))
+            # У журнала отправок нет FK на events — чистим явно
+            cur.execute(f"DELETE FROM notification_dispatch_log WHERE event_id {in_batch}", (ids_json,))
+
+            # Триггеры удаления вычли мероприятия из дневных агрегатов — для аналитики они по-прежнему существуют
+            cur.executemany(
+                """
+                INSERT INTO group_daily_stats (group_id, day, events_count, bookings_count, required_slots, free_slots)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(group_id, day) DO UPDATE SET
+                    events_count = events_count + excluded.events_count,
+                    bookings_count = bookings_count + excluded.bookings_count,
+                    required_slots = required_slots + excluded.required_slots,
+                    free_slots = free_slots + excluded.free_slots
+                """,
+                stats,
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return len(ids)
+
+
+def archive_past_events(days: int = EVENT_ARCHIVE_DAYS, chunk_size: int = CHUNK_SIZE,
+                        max_chunks: Optional[int] = None) -> int:
+    """
+    Archives events older than `days`, one transaction per chunk. max_chunks limits each shard separately.
+    Returns total moved.
+    """
+    cutoff = _cutoff(days)
+    total = 0
+    chunks = 0
+    # Архивные таблицы лежат рядом с живыми — с шардированием каждый шард архивирует свои мероприятия.
+    # Лимит чанков — на шард: иначе первые шарды выбирают весь лимит, а последние не архивируются
+    for shard in shard_ids():
+        shard_chunks = 0
+        while max_chunks is None or shard_chunks < max_chunks:
+            moved = archive_chunk(cutoff, chunk_size, shard)
+            if not moved:
+                break
+            total += moved
+            shard_chunks += 1
+        chunks += shard_chunks
+    if total:
+        print(f"[EVENT_ARCHIVE] moved {total} events older than {cutoff} in {chunks} chunks")
+    return total
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Перенос прошедших мероприятий в архив')
+    parser.add_argument('--days', type=int, default=EVENT_ARCHIVE_DAYS)
+    parser.add_argument('--chunk', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+    print(f"Перенесено мероприятий: {archive_past_events(args.days, args.chunk)}")
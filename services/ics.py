@@ -0,0 +1,227 @@
+"""
+Генерация и разбор iCalendar (RFC 5545): подписка на мероприятия и импорт .ics.
+
+Время мероприятий хранится как локальное московское без таймзоны; в ICS оно уходит в UTC (суффикс Z),
+так что VTIMEZONE не нужен. Длительность в базе не хранится — берем DEFAULT_DURATION.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+MSK = ZoneInfo('Europe/Moscow')
+DEFAULT_DURATION = timedelta(hours=1)
+PRODID = '-//JEM Reminder//Events//RU'
+
+
+def escape_text(value: Optional[str]) -> str:
+    return (value or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\r\n', '\\n').replace('\n', '\\n')
+
+
+def fold(line: str) -> str:
+    """Folds a content line to 75 octets (continuation lines start with a space)."""
+    raw = line.encode('utf-8')
+    if len(raw) <= 75:
+        return line + '\r\n'
+    parts = []
+    current = ''
+    size = 0
+    limit = 75
+    for ch in line:
+        ch_size = len(ch.encode('utf-8'))
+        if size + ch_size > limit:
+            parts.append(current)
+            current = ''
+            size = 0
+            limit = 74  # the leading space counts too
+        current += ch
+        size += ch_size
+    parts.append(current)
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def utc_stamp(local_time: str) -> Optional[str]:
+    """'YYYY-MM-DD HH:MM[:SS]' (МСК) -> 'YYYYMMDDTHHMMSSZ'."""
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M'):
+        try:
+            dt = datetime.strptime(local_time, fmt)
+            break
+        except ValueError:
+            continue
+    else:
+        return None
+    return dt.replace(tzinfo=MSK).astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def calendar_header(name: str) -> str:
+    return (
+        'BEGIN:VCALENDAR\r\n'
+        'VERSION:2.0\r\n'
+        f'PRODID:{PRODID}\r\n'
+        'CALSCALE:GREGORIAN\r\n'
+        'METHOD:PUBLISH\r\n'
+        + fold(f'X-WR-CALNAME:{escape_text(name)}')
+        + 'X-WR-TIMEZONE:Europe/Moscow\r\n'
+    )
+
+
+def calendar_footer() -> str:
+    return 'END:VCALENDAR\r\n'
+
+
+def vevent(uid: str, start_local: str, summary: str, description: Optional[str] = None,
+           url: Optional[str] = None, dtstamp: Optional[str] = None) -> str:
+    start = utc_stamp(start_local)
+    if start is None:
+        return ''
+    end = (datetime.strptime(start, '%Y%m%dT%H%M%SZ') + DEFAULT_DURATION).strftime('%Y%m%dT%H%M%SZ')
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:{uid}',
+        f'DTSTAMP:{dtstamp or datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")}',
+        f'DTSTART:{start}',
+        f'DTEND:{end}',
+        f'SUMMARY:{escape_text(summary)}',
+    ]
+    if description:
+        lines.append(f'DESCRIPTION:{escape_text(description)}')
+    if url:
+        lines.append(f'URL:{url}')
+    lines.append('END:VEVENT')
+    return ''.join(fold(line) for line in lines)
+
+
+def stream_calendar(name: str, events: Iterable[str]) -> Iterator[bytes]:
+    """Wraps already rendered VEVENT blocks into a calendar, yielding chunks for StreamingResponse."""
+    yield calendar_header(name).encode('utf-8')
+    buf = []
+    size = 0
+    for block in events:
+        buf.append(block)
+        size += len(block)
+        if size >= 16384:
+            yield ''.join(buf).encode('utf-8')
+            buf, size = [], 0
+    if buf:
+        yield ''.join(buf).encode('utf-8')
+    yield calendar_footer().encode('utf-8')
+
+
+# --- Разбор ---
+# Файл читается построчно: в памяти держится только текущий VEVENT, так что размер календаря не важен.
+
+Property = Tuple[Dict[str, str], str]  # (параметры, значение)
+
+
+def unescape_text(value: str) -> str:
+    out = []
+    i = 0
+    while i < len(value):
+        ch = value[i]
+        if ch == '\\' and i + 1 < len(value):
+            nxt = value[i + 1]
+            out.append('\n' if nxt in 'nN' else nxt)
+            i += 2
+            continue
+        out.append(ch)
+        i += 1
+    return ''.join(out)
+
+
+def iter_unfolded_lines(stream: Iterable[bytes]) -> Iterator[str]:
+    """Binary lines -> unfolded content lines. Unfolding is done on bytes, so a multibyte char split by folding survives."""
+    current = None
+    for raw in stream:
+        raw = raw.rstrip(b'\r\n')
+        if raw[:1] in (b' ', b'\t'):
+            if current is not None:
+                current += raw[1:]
+            continue
+        if current is not None:
+            yield current.decode('utf-8', errors='replace')
+        current = raw
+    if current is not None:
+        yield current.decode('utf-8', errors='replace')
+
+
+def parse_content_line(line: str) -> Tuple[str, Dict[str, str], str]:
+    """'DTSTART;TZID=Europe/Moscow:20250101T100000' -> ('DTSTART', {'TZID': 'Europe/Moscow'}, '20250101T100000')."""
+    in_quotes = False
+    colon = -1
+    for i, ch in enumerate(line):
+        if ch == '"':
+            in_quotes = not in_quotes
+        elif ch == ':' and not in_quotes:
+            colon = i
+            break
+    if colon < 0:
+        return line.upper(), {}, ''
+    head, value = line[:colon], line[colon + 1:]
+    parts = head.split(';')
+    params = {}
+    for p in parts[1:]:
+        key, _, val = p.partition('=')
+        params[key.upper()] = val.strip('"')
+    return parts[0].upper(), params, value
+
+
+def iter_components(stream: Iterable[bytes], component: str = 'VEVENT') -> Iterator[Dict[str, List[Property]]]:
+    """Yields properties of each top-level component (nested VALARM etc. are skipped)."""
+    props = None
+    depth = 0
+    for line in iter_unfolded_lines(stream):
+        if not line:
+            continue
+        name, params, value = parse_content_line(line)
+        if name == 'BEGIN':
+            if props is None and value.upper() == component:
+                props = {}
+            elif props is not None:
+                depth += 1
+            continue
+        if name == 'END':
+            if props is not None:
+                if depth:
+                    depth -= 1
+                elif value.upper() == component:
+                    yield props
+                    props = None
+            continue
+        if props is not None and not depth:
+            props.setdefault(name, []).append((params, value))
+
+
+def _zone(tzid: Optional[str]):
+    if not tzid:
+        return None
+    try:
+        return ZoneInfo(tzid)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None  # Windows-имена и самодельные VTIMEZONE считаем московским временем
+
+
+def parse_datetime_value(value: str, params: Optional[Dict[str, str]] = None) -> Optional[datetime]:
+    """DATE / DATE-TIME (UTC 'Z', TZID или плавающее) -> наивное московское время."""
+    params = params or {}
+    value = value.strip()
+    try:
+        if params.get('VALUE') == 'DATE' or len(value) == 8:
+            return datetime.strptime(value[:8], '%Y%m%d')
+        dt = datetime.strptime(value[:15], '%Y%m%dT%H%M%S')
+    except ValueError:
+        return None
+    if value.endswith('Z'):
+        return dt.replace(tzinfo=timezone.utc).astimezone(MSK).replace(tzinfo=None)
+    zone = _zone(params.get('TZID'))
+    if zone is not None and zone != MSK:
+        return dt.replace(tzinfo=zone).astimezone(MSK).replace(tzinfo=None)
+    return dt
+
+
+def parse_rrule(value: str) -> Dict[str, str]:
+    """'FREQ=WEEKLY;BYDAY=MO,WE' -> {'FREQ': 'WEEKLY', 'BYDAY': 'MO,WE'}."""
+    result = {}
+    for part in value.split(';'):
+        key, _, val = part.partition('=')
+        if key:
+            result[key.strip().upper()] = val.strip()
+    return result
@@ -0,0 +1,179 @@
+"""
+Импорт мероприятий из .ics (Google/Apple/Outlook и т.п.).
+
+Файл разбирается потоково (services.ics.iter_components): одиночные VEVENT копятся в пачки
+и пишутся через EventRepo.import_many — одна транзакция на пачку, дубли (group_id, time, name)
+отсекаются по индексу idx_events_group_time_name. VEVENT с RRULE становятся шаблонами
+(event_templates) и разворачиваются генератором в пределах горизонта планирования.
+
+CLI: python -m services.ics_import GROUP_ID FILE.ics [--user-id ID] [--batch-size N]
+"""
+import json
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from services.ics import iter_components, parse_datetime_value, parse_rrule, unescape_text
+from services.repositories import EventRepo, EventTemplateRepo, TemplateGenerator, get_conn
+
+BATCH_SIZE = 500
+PROGRESS_EVERY = 1000
+TEMPLATE_HORIZON_DAYS = 60
+
+_FREQS = {'DAILY': 'daily', 'WEEKLY': 'weekly', 'MONTHLY': 'monthly', 'YEARLY': 'yearly'}
+# Поля RRULE, которые ложатся на колонки event_templates
+_SUPPORTED_RRULE_KEYS = {'FREQ', 'INTERVAL', 'BYDAY', 'BYMONTHDAY', 'BYSETPOS', 'UNTIL', 'COUNT', 'WKST', 'BYMONTH'}
+
+
+def _fmt(dt: datetime) -> str:
+    return dt.strftime('%Y-%m-%d %H:%M')
+
+
+def _first(props: dict, name: str) -> Tuple[dict, Optional[str]]:
+    values = props.get(name)
+    return values[0] if values else ({}, None)
+
+
+def _template_fields(rrule: Dict[str, str], start: datetime) -> Optional[dict]:
+    """RRULE -> поля event_templates. None, если правило не выражается в наших колонках."""
+    freq = _FREQS.get(rrule.get('FREQ', '').upper())
+    if freq is None or set(rrule) - _SUPPORTED_RRULE_KEYS:
+        return None
+    if 'BYMONTH' in rrule:
+        # Отдельной колонки нет; допустим только BYMONTH, совпадающий с умолчанием yearly
+        if freq != 'yearly' or rrule['BYMONTH'] != str(start.month) or 'BYDAY' in rrule:
+            return None
+    bysetpos = rrule.get('BYSETPOS')
+    if bysetpos and ',' in bysetpos:
+        return None
+    until = None
+    if rrule.get('UNTIL'):
+        until_dt = parse_datetime_value(rrule['UNTIL'])
+        if until_dt is None:
+            return None
+        until = _fmt(until_dt)
+    try:
+        return {
+            'freq': freq,
+            'interval': int(rrule.get('INTERVAL') or 1),
+            'byweekday': rrule.get('BYDAY') or None,
+            'bymonthday': rrule.get('BYMONTHDAY') or None,
+            'bysetpos': int(bysetpos) if bysetpos else None,
+            'until': until,
+            'count': int(rrule['COUNT']) if rrule.get('COUNT') else None,
+        }
+    except ValueError:
+        return None
+
+
+def _exdates(props: dict) -> Set[str]:
+    days = set()
+    for params, value in props.get('EXDATE', []):
+        for part in value.split(','):
+            dt = parse_datetime_value(part, params)
+            if dt is not None:
+                days.add(dt.strftime('%Y-%m-%d'))
+    return days
+
+
+def import_ics(group_id: int, stream: Iterable[bytes], created_by_user_id: Optional[int] = None,
+               batch_size: int = BATCH_SIZE, progress: Optional[Callable[[dict], None]] = None,
+               progress_every: int = PROGRESS_EVERY) -> dict:
+    """
+    Imports VEVENTs from a binary line stream (open(..., 'rb'), UploadFile.file) into the group.
+    Only the current batch and recurring masters are kept in memory. Returns counters.
+    """
+    stats = {
+        'parsed': 0, 'created': 0, 'duplicates': 0, 'errors': 0, 'skipped': 0,
+        'templates_created': 0, 'templates_duplicate': 0, 'template_events': 0, 'unsupported_rrule': 0,
+    }
+    batch: List[Tuple[str, str]] = []
+    masters: Dict[str, Tuple[str, datetime, dict, Set[str]]] = {}
+    overridden: Dict[str, Set[str]] = {}
+
+    def flush() -> None:
+        if not batch:
+            return
+        for status, _eid in EventRepo.import_many(group_id, batch, created_by_user_id=created_by_user_id):
+            stats['created' if status == 'created' else 'duplicates'] += 1
+        batch.clear()
+
+    for props in iter_components(stream, 'VEVENT'):
+        stats['parsed'] += 1
+        if progress and stats['parsed'] % progress_every == 0:
+            progress(dict(stats))
+
+        if (_first(props, 'STATUS')[1] or '').upper() == 'CANCELLED':
+            stats['skipped'] += 1
+            continue
+        params, value = _first(props, 'DTSTART')
+        start = parse_datetime_value(value, params) if value else None
+        if start is None:
+            stats['errors'] += 1
+            continue
+        time_str = _fmt(start)
+        name = unescape_text(_first(props, 'SUMMARY')[1] or '').strip() or f"Событие {time_str}"
+        uid = _first(props, 'UID')[1]
+
+        rec_params, rec_value = _first(props, 'RECURRENCE-ID')
+        if rec_value and uid:
+            # Перенесенный экземпляр серии: исходную дату исключаем из шаблона, сам экземпляр — обычное мероприятие
+            rec_dt = parse_datetime_value(rec_value, rec_params)
+            if rec_dt is not None:
+                overridden.setdefault(uid, set()).add(rec_dt.strftime('%Y-%m-%d'))
+
+        rrule_value = _first(props, 'RRULE')[1]
+        if rrule_value and not rec_value:
+            fields = _template_fields(parse_rrule(rrule_value), start)
+            if fields is not None:
+                masters[uid or f"_{stats['parsed']}"] = (name, start, fields, _exdates(props))
+                continue
+            # Правило не выражается шаблоном — берем только первое вхождение
+            stats['unsupported_rrule'] += 1
+
+        batch.append((name, time_str))
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+
+    for uid, (name, start, fields, exdates) in masters.items():
+        base_time = _fmt(start)
+        with get_conn(group_id) as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT id FROM event_templates WHERE group_id = ? AND name = ? AND base_time = ? LIMIT 1",
+                        (group_id, name, base_time))
+            if cur.fetchone():
+                stats['templates_duplicate'] += 1
+                continue
+        exceptions = sorted(exdates | overridden.get(uid, set()))
+        template_id = EventTemplateRepo.create(
+            group_id, name, None, 'recurring', base_time, 'Europe/Moscow', TEMPLATE_HORIZON_DAYS, 0,
+            exceptions_json=json.dumps(exceptions) if exceptions else None, **fields
+        )
+        stats['templates_created'] += 1
+        stats['template_events'] += TemplateGenerator.generate_for_template(template_id, created_by_user_id=created_by_user_id)
+
+    if progress:
+        progress(dict(stats))
+    print(f"[ICS_IMPORT] group={group_id} " + ' '.join(f"{k}={v}" for k, v in stats.items()))
+    return stats
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Импорт мероприятий из .ics в группу')
+    parser.add_argument('group_id', type=int)
+    parser.add_argument('path')
+    parser.add_argument('--user-id', type=int, default=None, help='users.id автора (для аудита)')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+
+    def report(s: dict) -> None:
+        print(f"  ... {s['parsed']} VEVENT, создано {s['created']}, дублей {s['duplicates']}, "
+              f"{time.perf_counter() - started:.1f} c")
+
+    with open(args.path, 'rb') as f:
+        import_ics(args.group_id, f, created_by_user_id=args.user_id, batch_size=args.batch_size, progress=report)
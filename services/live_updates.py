@@ -0,0 +1,141 @@
+"""
+Живые обновления страницы группы (Server-Sent Events).
+
+Источник правды — версии из group_data_versions/event_versions (их ведут триггеры), поэтому
+изменения из бота и из других uvicorn-воркеров тоже доходят: хаб раз в poll_interval опрашивает
+версии групп, на которые есть подписчики. Записи через репозитории в этом процессе публикуются
+в хаб напрямую (add_change_listener) — они будят опрос сразу и уточняют тип изменения
+(booked/unbooked/edited/deleted); без подсказки изменение приходит как 'edited'.
+"""
+import asyncio
+import logging
+import threading
+from typing import Dict, Optional, Set
+
+from services.repositories import GroupDataVersionRepo, SyncRepo
+
+MAX_CONNECTIONS = 500
+MAX_CONNECTIONS_PER_GROUP = 100
+HEARTBEAT_SECONDS = 15
+POLL_INTERVAL = 1.0
+QUEUE_SIZE = 50
+
+
+class Subscription:
+    __slots__ = ('group_id', 'queue', 'overflow')
+
+    def __init__(self, group_id: int):
+        self.group_id = group_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.overflow = False
+
+
+class GroupChangeHub:
+    def __init__(self, poll_interval: float = POLL_INTERVAL, max_connections: int = MAX_CONNECTIONS,
+                 max_per_group: int = MAX_CONNECTIONS_PER_GROUP):
+        self.poll_interval = poll_interval
+        self.max_connections = max_connections
+        self.max_per_group = max_per_group
+        self._subs: Dict[int, Set[Subscription]] = {}
+        self._versions: Dict[int, int] = {}
+        self._hints: Dict[int, Dict[int, str]] = {}
+        self._hints_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._tailer: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.dropped = 0
+
+    @property
+    def connections(self) -> int:
+        return sum(len(s) for s in self._subs.values())
+
+    async def subscribe(self, group_id: int) -> Optional[Subscription]:
+        """None when the connection cap (total or per group) is reached."""
+        if self.connections >= self.max_connections or len(self._subs.get(group_id, ())) >= self.max_per_group:
+            return None
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+            self._wake = asyncio.Event()
+        sub = Subscription(group_id)
+        first = group_id not in self._subs
+        self._subs.setdefault(group_id, set()).add(sub)
+        if first:
+            # Пока версия не загружена, опрос эту группу пропускает
+            self._versions[group_id] = (await asyncio.to_thread(GroupDataVersionRepo.get, group_id))[0]
+        if self._tailer is None or self._tailer.done():
+            self._tailer = asyncio.create_task(self._tail())
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        subs = self._subs.get(sub.group_id)
+        if subs is None:
+            return
+        subs.discard(sub)
+        if not subs:
+            del self._subs[sub.group_id]
+            self._versions.pop(sub.group_id, None)
+            with self._hints_lock:
+                self._hints.pop(sub.group_id, None)
+
+    def publish(self, group_id: int, kind: str, event_id: int) -> None:
+        """Repository change listener. May be called from worker threads."""
+        if self._loop is None or group_id not in self._subs:
+            return
+        with self._hints_lock:
+            self._hints.setdefault(group_id, {})[event_id] = kind
+        try:
+            self._loop.call_soon_threadsafe(self._wake.set)
+        except RuntimeError:
+            pass  # цикл уже остановлен
+
+    async def _tail(self) -> None:
+        while self._subs:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self._poll()
+            except Exception:
+                logging.exception("[LIVE] poll failed")
+        self._tailer = None
+
+    async def _poll(self) -> None:
+        group_ids = list(self._subs)
+        if not group_ids:
+            return
+        versions = await asyncio.to_thread(GroupDataVersionRepo.get_many, group_ids)
+        for gid in group_ids:
+            version = versions.get(gid, 0)
+            last = self._versions.get(gid)
+            if last is None or version <= last:
+                continue
+            # changes_since читает версию еще раз — берем ее, она не старее опрошенной
+            version, members_version, changed, deleted = await asyncio.to_thread(SyncRepo.changes_since, gid, last)
+            with self._hints_lock:
+                hints = self._hints.pop(gid, {})
+            changes = [{'id': eid, 'kind': hints.get(eid, 'edited')} for eid in changed]
+            changes += [{'id': eid, 'kind': 'deleted'} for eid in deleted]
+            message = {'v': version, 'changes': changes}
+            if members_version > last:
+                message['members'] = True
+            self._versions[gid] = version
+            self._broadcast(gid, message)
+
+    def _broadcast(self, group_id: int, message: dict) -> None:
+        for sub in list(self._subs.get(group_id, ())):
+            try:
+                sub.queue.put_nowait(message)
+                self.sent += 1
+            except asyncio.QueueFull:
+                # Медленный клиент: вместо очереди изменений просим перечитать страницу
+                sub.overflow = True
+                self.dropped += 1
+
+    def stats(self) -> dict:
+        return {'connections': self.connections, 'groups': len(self._subs), 'sent': self.sent, 'dropped': self.dropped}
+
+
+HUB = GroupChangeHub()
@@ -0,0 +1,306 @@
+"""
+Повторения шаблонов мероприятий (подмножество RFC 5545 RRULE).
+
+occurrences(template, start, end) лениво перебирает старты мероприятия в окне [start, end].
+Поддерживаются все поля event_templates: freq (daily/weekly/monthly/yearly), interval,
+byweekday ('MO,WE' или с номером: '1MO', '-1FR'), bymonthday ('1,15,-1'), bysetpos,
+until, count и exceptions_json. Умолчания такие же, как в dateutil.rrule:
+weekly без byweekday — день недели старта, monthly — число старта, yearly — месяц и число старта.
+Все даты — наивное локальное время (как base_time в базе).
+"""
+import json
+import re
+from bisect import bisect_left
+from calendar import monthrange
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+FREQS = ('daily', 'weekly', 'monthly', 'yearly')
+
+_WEEKDAY_CODES = {'MO': 0, 'TU': 1, 'WE': 2, 'TH': 3, 'FR': 4, 'SA': 5, 'SU': 6}
+_BYDAY_RE = re.compile(r'^([+-]?\d{1,2})?(MO|TU|WE|TH|FR|SA|SU)$')
+
+# Защита от бесконечного цикла для правил, которые никогда не дают дат (например, 30 февраля)
+_MAX_EMPTY_PERIODS = 1000
+
+
+def parse_datetime(value: Optional[str]) -> Optional[datetime]:
+    """'YYYY-MM-DD HH:MM[:SS]', ISO с 'T'/'Z' или просто дата."""
+    if not value:
+        return None
+    for fmt in ('%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S'):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    try:
+        return datetime.fromisoformat(value.replace('Z', '')).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+class ExceptionDates:
+    """Даты-исключения, один раз отсортированные; проверка принадлежности — бинарным поиском."""
+
+    __slots__ = ('_days',)
+
+    def __init__(self, days: Sequence[date] = ()):
+        self._days: List[date] = sorted(set(days))
+
+    @classmethod
+    def from_json(cls, exceptions_json: Optional[str]) -> 'ExceptionDates':
+        days = []
+        if exceptions_json:
+            try:
+                items = json.loads(exceptions_json)
+            except (ValueError, TypeError):
+                items = []
+            for it in items if isinstance(items, list) else []:
+                if isinstance(it, str):
+                    dt = parse_datetime(it[:10])
+                    if dt:
+                        days.append(dt.date())
+        return cls(days)
+
+    def __contains__(self, day: date) -> bool:
+        i = bisect_left(self._days, day)
+        return i < len(self._days) and self._days[i] == day
+
+    def __len__(self) -> int:
+        return len(self._days)
+
+
+@dataclass
+class Rule:
+    dtstart: datetime
+    freq: Optional[str] = None
+    interval: int = 1
+    byweekday: List[Tuple[Optional[int], int]] = field(default_factory=list)  # (ordinal or None, weekday)
+    bymonthday: List[int] = field(default_factory=list)
+    bymonth: List[int] = field(default_factory=list)
+    bysetpos: Optional[int] = None
+    until: Optional[datetime] = None
+    count: Optional[int] = None
+    exceptions: ExceptionDates = field(default_factory=ExceptionDates)
+
+    @classmethod
+    def from_template(cls, template: Sequence) -> Optional['Rule']:
+        """Строка event_templates (SELECT *) -> Rule. None, если base_time не разобрать или freq неизвестна."""
+        (
+            _id, _group_id, _name, _description, kind, base_time, _timezone,
+            _horizon, _allow_multi, freq, interval, byweekday, bymonthday, bysetpos,
+            until, count, exceptions_json, *_
+        ) = template
+        dtstart = parse_datetime(base_time)
+        if dtstart is None:
+            return None
+        dtstart = dtstart.replace(second=0, microsecond=0)
+        freq = (freq or '').lower() or None
+        if kind == 'one_time' or not freq:
+            # Одноразовый шаблон — ровно одно мероприятие
+            return cls(dtstart=dtstart, count=1)
+        if freq not in FREQS:
+            return None
+
+        rule = cls(
+            dtstart=dtstart,
+            freq=freq,
+            interval=max(1, int(interval or 1)),
+            byweekday=_parse_byweekday(byweekday),
+            bymonthday=_parse_ints(bymonthday),
+            bysetpos=int(bysetpos) if bysetpos not in (None, '', 0) else None,
+            until=_parse_until(until),
+            count=int(count) if count else None,
+            exceptions=ExceptionDates.from_json(exceptions_json),
+        )
+        # Умолчания dateutil: без BYDAY/BYMONTHDAY правило привязано к дате старта
+        if not rule.byweekday and not rule.bymonthday:
+            if freq == 'weekly':
+                rule.byweekday = [(None, dtstart.weekday())]
+            elif freq == 'monthly':
+                rule.bymonthday = [dtstart.day]
+            elif freq == 'yearly':
+                rule.bymonth = [dtstart.month]
+                rule.bymonthday = [dtstart.day]
+        return rule
+
+
+def _parse_ints(s: Optional[str]) -> List[int]:
+    result = []
+    for token in (s or '').split(','):
+        try:
+            value = int(token.strip())
+        except ValueError:
+            continue
+        if value:
+            result.append(value)
+    return result
+
+
+def _parse_byweekday(s: Optional[str]) -> List[Tuple[Optional[int], int]]:
+    result = []
+    for token in (s or '').split(','):
+        m = _BYDAY_RE.match(token.strip().upper())
+        if m:
+            n = int(m.group(1)) if m.group(1) else None
+            result.append((n or None, _WEEKDAY_CODES[m.group(2)]))
+    return result
+
+
+def _parse_until(s: Optional[str]) -> Optional[datetime]:
+    dt = parse_datetime(s)
+    if dt is None:
+        return None
+    if len(s.strip()) <= 10:
+        # Только дата — включаем весь день
+        dt = dt.replace(hour=23, minute=59, second=59)
+    return dt
+
+
+def _period_start(rule: Rule, index: int) -> date:
+    """Первый день периода с номером index (в единицах freq, без учета interval)."""
+    d0 = rule.dtstart.date()
+    if rule.freq == 'daily':
+        return d0 + timedelta(days=index)
+    if rule.freq == 'weekly':
+        return d0 - timedelta(days=d0.weekday()) + timedelta(weeks=index)
+    if rule.freq == 'monthly':
+        months = d0.month - 1 + index
+        return date(d0.year + months // 12, months % 12 + 1, 1)
+    return date(d0.year + index, 1, 1)
+
+
+def _period_index(rule: Rule, day: date) -> int:
+    """Номер периода (в единицах freq), в который попадает day."""
+    d0 = rule.dtstart.date()
+    if rule.freq == 'daily':
+        return (day - d0).days
+    if rule.freq == 'weekly':
+        return ((day - timedelta(days=day.weekday())) - (d0 - timedelta(days=d0.weekday()))).days // 7
+    if rule.freq == 'monthly':
+        return (day.year - d0.year) * 12 + (day.month - d0.month)
+    return day.year - d0.year
+
+
+def _monthday_ok(d: date, bymonthday: List[int]) -> bool:
+    last = monthrange(d.year, d.month)[1]
+    return d.day in bymonthday or (d.day - last - 1) in bymonthday
+
+
+def _nth_weekdays(rule: Rule, first: date, months: Sequence[int],
+                  numbered: List[Tuple[int, int]]) -> set:
+    """
+    '2MO' — второй понедельник месяца (monthly, yearly с BYMONTH) или года (yearly); '-1FR' — последняя пятница.
+    Номер считается по всему месяцу/году — до фильтра BYMONTHDAY, как в dateutil.
+    """
+    if rule.freq == 'monthly' or rule.bymonth:
+        spans = [(date(first.year, m, 1), date(first.year, m, monthrange(first.year, m)[1])) for m in months]
+    else:
+        spans = [(date(first.year, 1, 1), date(first.year, 12, 31))]
+    result = set()
+    for lo, hi in spans:
+        for n, wd in numbered:
+            if n > 0:
+                d = lo + timedelta(days=(wd - lo.weekday()) % 7, weeks=n - 1)
+            else:
+                d = hi - timedelta(days=(hi.weekday() - wd) % 7, weeks=-n - 1)
+            if lo <= d <= hi:
+                result.add(d)
+    return result
+
+
+def _period_days(rule: Rule, first: date) -> List[date]:
+    """Все дни периода, подходящие под BYMONTH/BYMONTHDAY/BYDAY, с примененным BYSETPOS."""
+    months: Sequence[int] = ()
+    monthday_done = False
+    if rule.freq in ('daily', 'weekly'):
+        days = [first] if rule.freq == 'daily' else [first + timedelta(days=i) for i in range(7)]
+        if rule.bymonth:
+            days = [d for d in days if d.month in rule.bymonth]
+    else:
+        if rule.freq == 'monthly':
+            months = [first.month] if not rule.bymonth or first.month in rule.bymonth else []
+        else:
+            months = sorted(rule.bymonth) if rule.bymonth else range(1, 13)
+        days = []
+        monthday_done = bool(rule.bymonthday) and not rule.byweekday
+        for month in months:
+            last = monthrange(first.year, month)[1]
+            if monthday_done:
+                # Частый случай — сразу строим нужные числа, не перебирая весь месяц
+                picked = {d if d > 0 else last + 1 + d for d in rule.bymonthday}
+                days.extend(date(first.year, month, d) for d in sorted(picked) if 1 <= d <= last)
+            else:
+                days.extend(date(first.year, month, d) for d in range(1, last + 1))
+
+    if rule.byweekday:
+        plain = {wd for n, wd in rule.byweekday if n is None or rule.freq in ('daily', 'weekly')}
+        numbered = [(n, wd) for n, wd in rule.byweekday if n is not None and rule.freq in ('monthly', 'yearly')]
+        nth = _nth_weekdays(rule, first, months, numbered) if numbered and months else set()
+        days = [d for d in days if d.weekday() in plain or d in nth]
+    # BYMONTHDAY пересекается с уже выбранными днями недели, а не сужает выбор n-го дня
+    if rule.bymonthday and not monthday_done:
+        days = [d for d in days if _monthday_ok(d, rule.bymonthday)]
+
+    if rule.bysetpos:
+        pos = rule.bysetpos
+        if -len(days) <= pos <= len(days):
+            days = [days[pos - 1 if pos > 0 else pos]]
+        else:
+            days = []
+    return days
+
+
+def iter_rule(rule: Rule, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Iterator[datetime]:
+    """Лениво перебирает старты правила в [start, end] по возрастанию."""
+    t = rule.dtstart.time()
+    if rule.freq is None:
+        if (start is None or rule.dtstart >= start) and (end is None or rule.dtstart <= end) \
+                and rule.dtstart.date() not in rule.exceptions:
+            yield rule.dtstart
+        return
+
+    index = 0
+    if start is not None and rule.count is None and start > rule.dtstart:
+        # Без COUNT можно сразу перейти к периоду, в котором лежит start
+        index = (_period_index(rule, start.date()) // rule.interval) * rule.interval
+
+    produced = 0
+    empty = 0
+    while True:
+        first = _period_start(rule, index)
+        if end is not None and first > end.date():
+            return
+        if rule.until is not None and first > rule.until.date():
+            return
+        days = _period_days(rule, first)
+        empty = 0 if days else empty + 1
+        if empty > _MAX_EMPTY_PERIODS:
+            return
+        for day in days:
+            occ = datetime.combine(day, t)
+            if occ < rule.dtstart:
+                continue
+            if rule.until is not None and occ > rule.until:
+                return
+            # COUNT считается до исключения дат, как EXDATE в RFC 5545
+            produced += 1
+            if rule.count is not None and produced > rule.count:
+                return
+            if end is not None and occ > end:
+                return
+            if start is not None and occ < start:
+                continue
+            if day in rule.exceptions:
+                continue
+            yield occ
+        index += rule.interval
+
+
+def occurrences(template: Sequence, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Iterator[datetime]:
+    """Старты мероприятий шаблона (строка event_templates) в окне [start, end]."""
+    rule = Rule.from_template(template)
+    if rule is None:
+        return iter(())
+    return iter_rule(rule, start, end)
@@ -1,19 +1,192 @@
+import json
+import os
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
 from typing import Optional, List, Tuple
 from datetime import datetime, timedelta
 
+from services import sharding
+
 BASE_DIR = Path(__file__).resolve().parents[1]
 DB_PATH = BASE_DIR / 'data' / 'bot_v2.db'
 
 
-def get_conn():
-    conn = sqlite3.connect(DB_PATH.as_posix())
+def get_conn(group_id: Optional[int] = None, *, event_id: Optional[int] = None, template_id: Optional[int] = None,
+             shard: Optional[int] = None):
+    """
+    Connection to the database holding the data: with sharding (services/sharding.py) — the shard of the group /
+    event / template or the given shard, otherwise (and for users, groups, roles, audit) — the global database.
+    Without sharding the routing keys are ignored.
+    """
+    path = DB_PATH
+    if sharding.DB_SHARDS:
+        if shard is None:
+            if group_id is not None:
+                shard = sharding.shard_for_group(DB_PATH, group_id)
+            elif event_id is not None:
+                shard = sharding.shard_for_id(DB_PATH, 'events', event_id)
+            elif template_id is not None:
+                shard = sharding.shard_for_id(DB_PATH, 'event_templates', template_id)
+        if shard is not None:
+            path = sharding.shard_path(shard)
+    conn = sqlite3.connect(path.as_posix())
     # Enable foreign keys for CASCADE operations
     conn.execute('PRAGMA foreign_keys = ON')
     return conn
 
 
+def shard_ids() -> List[Optional[int]]:
+    """Databases with group data for cross-group reads: every shard, or [None] (the single database)."""
+    return list(range(sharding.DB_SHARDS)) if sharding.DB_SHARDS else [None]
+
+
+def shard_for_group(group_id: int) -> Optional[int]:
+    """Shard of the group; None without sharding."""
+    return sharding.shard_for_group(DB_PATH, group_id) if sharding.DB_SHARDS else None
+
+
+def shard_for_id(table: str, row_id) -> Optional[int]:
+    """Shard of a row known only by id (sharding.ROUTED_ID_TABLES); None without sharding."""
+    return sharding.shard_for_id(DB_PATH, table, row_id) if sharding.DB_SHARDS else None
+
+
+def sync_replicas(table: str, where: str, params: tuple = (), group_id: Optional[int] = None) -> None:
+    """
+    Sharded layout: mirrors rows of a global table (users / groups / user_group_roles) matching `where` into the
+    group's shard (group_id) or into every shard. Rows gone from the global table are deleted from the copy,
+    so FK cascades in the shard remove dependent group data as they do in a single database. No-op without sharding.
+    """
+    if not sharding.DB_SHARDS:
+        return
+    with get_conn() as conn:
+        cur = conn.execute(f"SELECT * FROM {table} WHERE {where}", params)
+        columns = [d[0] for d in cur.description]
+        rows = cur.fetchall()
+    # DO UPDATE только при реальном отличии: иначе триггеры шарда (версии групп, change_log) срабатывают на каждую строку
+    upsert = (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+              f"ON CONFLICT(id) DO UPDATE SET " + ', '.join(f"{c} = excluded.{c}" for c in columns[1:])
+              + " WHERE " + ' OR '.join(f"{c} IS NOT excluded.{c}" for c in columns[1:]))
+    for shard in ([shard_for_group(group_id)] if group_id is not None else shard_ids()):
+        if shard is None:
+            continue
+        with get_conn(shard=shard) as conn:
+            conn.execute(f"DELETE FROM {table} WHERE ({where}) AND id NOT IN (SELECT value FROM json_each(?))",
+                         (*params, json.dumps([r[0] for r in rows])))
+            conn.executemany(upsert, rows)
+            conn.commit()
+
+
+def with_event_names(rows: List[Tuple], event_idx: int, name_idx: int) -> List[Tuple]:
+    """
+    Sharded layout: events live in the shards, so joins from global tables (audit_log) leave the event name NULL —
+    fills it from the events' shards. Returns rows unchanged without sharding.
+    """
+    if not sharding.DB_SHARDS:
+        return rows
+    by_shard: dict = {}
+    for row in rows:
+        if row[event_idx] is not None and row[name_idx] is None:
+            by_shard.setdefault(shard_for_id('events', row[event_idx]), set()).add(row[event_idx])
+    names = {}
+    for shard, ids in by_shard.items():
+        if shard is None:
+            continue
+        with get_conn(shard=shard) as conn:
+            names.update(conn.execute("SELECT id, name FROM events WHERE id IN (SELECT value FROM json_each(?))",
+                                      (json.dumps(sorted(ids)),)).fetchall())
+    return [row[:name_idx] + (names[row[event_idx]],) + row[name_idx + 1:]
+            if row[name_idx] is None and row[event_idx] in names else row for row in rows]
+
+
+# Снимок базы только для чтения (обновляет задание бота через database/backup.py:refresh_snapshot).
+# Тяжелые выборки (аналитика, старые страницы аудита) читают его, пока он не старше
+# SNAPSHOT_MAX_AGE секунд; иначе — основную базу. SNAPSHOT_MAX_AGE=0 отключает снимок.
+SNAPSHOT_MAX_AGE = int(os.getenv('SNAPSHOT_MAX_AGE', '900'))
+SNAPSHOT_POOL_SIZE = 8
+
+_snapshot_pool: list = []
+_snapshot_generation = None
+_snapshot_lock = threading.Lock()
+
+
+def snapshot_path() -> Path:
+    return Path(os.getenv('SNAPSHOT_PATH') or DB_PATH.with_name('bot_v2_snapshot.db'))
+
+
+@contextmanager
+def get_read_conn(group_id: Optional[int] = None):
+    """Connection for heavy reads: pooled read-only connection to a fresh snapshot, else the primary database.
+    With sharding group data is read from the group's shard (the snapshot covers the global database only)."""
+    global _snapshot_generation
+    if sharding.DB_SHARDS and group_id is not None:
+        with get_conn(group_id) as conn:
+            yield conn
+        return
+    path = snapshot_path()
+    try:
+        st = path.stat() if SNAPSHOT_MAX_AGE > 0 else None
+    except OSError:
+        st = None
+    if st is None or time.time() - st.st_mtime > SNAPSHOT_MAX_AGE:
+        with get_conn() as conn:
+            yield conn
+        return
+
+    # Снимок заменяется переименованием — новое поколение (inode, mtime) означает, что старые соединения устарели
+    generation = (st.st_ino, st.st_mtime_ns)
+    conn = None
+    with _snapshot_lock:
+        if generation != _snapshot_generation:
+            stale, _snapshot_pool[:] = list(_snapshot_pool), []
+            _snapshot_generation = generation
+            for c in stale:
+                c.close()
+        if _snapshot_pool:
+            conn = _snapshot_pool.pop()
+    if conn is None:
+        # immutable: файл снимка никогда не меняется на месте, блокировки не нужны
+        conn = sqlite3.connect(f"file:{path.as_posix()}?mode=ro&immutable=1", uri=True, check_same_thread=False)
+    try:
+        yield conn
+    finally:
+        with _snapshot_lock:
+            if generation == _snapshot_generation and len(_snapshot_pool) < SNAPSHOT_POOL_SIZE:
+                _snapshot_pool.append(conn)
+                conn = None
+        if conn is not None:
+            conn.close()
+
+
+# Слушатели изменений мероприятий: веб-процесс подписывает сюда SSE-хаб (services/live_updates.py).
+# В процессе бота список пуст, и публикация ничего не стоит.
+_change_listeners: list = []
+
+
+def add_change_listener(listener) -> None:
+    """listener(group_id, kind, event_id); kind: 'booked' | 'unbooked' | 'edited' | 'deleted'."""
+    if listener not in _change_listeners:
+        _change_listeners.append(listener)
+
+
+def _publish_change(kind: str, event_id: int, group_id: Optional[int] = None) -> None:
+    if not _change_listeners:
+        return
+    if group_id is None:
+        with get_conn(event_id=event_id) as conn:
+            row = conn.execute("SELECT group_id FROM events WHERE id = ?", (event_id,)).fetchone()
+        if not row:
+            return
+        group_id = row[0]
+    for listener in list(_change_listeners):
+        try:
+            listener(group_id, kind, event_id)
+        except Exception as e:
+            print(f"[LIVE] change listener failed: {e}")
+
+
 def _is_notification_time_future(event_time_str: str, time_before: int, time_unit: str) -> bool:
     """Check if notification time is in the future."""
     try:
@@ -41,12 +214,67 @@ def _is_notification_time_future(event_time_str: str, time_before: int, time_uni
         return False
 
 
+def _bulk_create_events(cur: sqlite3.Cursor, group_id: int, items: List[Tuple[str, str]], *,
+                        created_by_user_id: Optional[int] = None,
+                        role_requirements: List[Tuple[str, int]] = ()) -> Tuple[List[int], dict]:
+    """
+    Insert many events of one group inside the caller's transaction (the caller commits).
+
+    items: [(name, time_str), ...]. Event ids are reserved up front from sqlite_sequence, so the
+    default group notifications and role requirements of all events are inserted with executemany.
+    Should run under BEGIN IMMEDIATE, otherwise another writer may take the reserved ids.
+    Returns (event_ids in the order of items, row counts).
+    """
+    counts = {'events': 0, 'notifications': 0, 'role_requirements': 0}
+    if not items:
+        return [], counts
+    cur.execute(
+        "SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'events'), 0), "
+        "COALESCE((SELECT MAX(id) FROM events), 0))"
+    )
+    first_id = int(cur.fetchone()[0]) + 1
+    event_ids = list(range(first_id, first_id + len(items)))
+    if created_by_user_id is not None:
+        cur.executemany(
+            "INSERT INTO events (id, name, time, group_id, created_by_user_id) VALUES (?,?,?,?,?)",
+            [(eid, name, time_str, group_id, created_by_user_id) for eid, (name, time_str) in zip(event_ids, items)]
+        )
+    else:
+        cur.executemany(
+            "INSERT INTO events (id, name, time, group_id) VALUES (?,?,?,?)",
+            [(eid, name, time_str, group_id) for eid, (name, time_str) in zip(event_ids, items)]
+        )
+    counts['events'] = len(event_ids)
+
+    # Default group notifications (type='group'), only those still in the future
+    cur.execute("SELECT time_before, time_unit, message_text FROM notification_settings WHERE group_id = ? AND type = 'group'", (group_id,))
+    group_notifications = cur.fetchall()
+    notif_rows = [
+        (eid, time_before, time_unit, message_text)
+        for eid, (_name, time_str) in zip(event_ids, items)
+        for time_before, time_unit, message_text in group_notifications
+        if _is_notification_time_future(time_str, time_before, time_unit)
+    ]
+    if notif_rows:
+        cur.executemany("INSERT INTO event_notifications (event_id, time_before, time_unit, message_text) VALUES (?,?,?,?)", notif_rows)
+    counts['notifications'] = len(notif_rows)
+
+    req_rows = [(eid, role_name, required) for eid in event_ids for role_name, required in role_requirements]
+    if req_rows:
+        cur.executemany(
+            "INSERT INTO event_role_requirements (event_id, role_name, required) VALUES (?,?,?) "
+            "ON CONFLICT(event_id, role_name) DO UPDATE SET required = excluded.required",
+            req_rows
+        )
+    counts['role_requirements'] = len(req_rows)
+    return event_ids, counts
+
 class UserRepo:
     @staticmethod
     def upsert_user(telegram_id: int, username: Optional[str], phone: Optional[str], first_name: Optional[str], last_name: Optional[str]) -> int:
         with get_conn() as conn:
             cur = conn.cursor()
-            cur.execute("SELECT id FROM users WHERE telegram_id = ?", (telegram_id,))
+            cur.execute("SELECT id, username, phone, first_name, last_name FROM users WHERE telegram_id = ?", (telegram_id,))
             row = cur.fetchone()
             if row:
                 user_id = row[0]
@@ -57,7 +285,10 @@ class UserRepo:
                             (telegram_id, username, phone, first_name, last_name))
                 user_id = cur.lastrowid
             conn.commit()
-            return user_id
+        # upsert вызывается на каждое сообщение — копии в шардах трогаем, только если что-то поменялось
+        if row is None or tuple(row[1:]) != (username, phone, first_name, last_name):
+            sync_replicas('users', 'id = ?', (user_id,))
+        return user_id
 
     @staticmethod
     def get_by_telegram_id(telegram_id: int) -> Optional[Tuple]:
@@ -86,6 +317,7 @@ class UserRepo:
             cur = conn.cursor()
             cur.execute("UPDATE users SET phone = ? WHERE id = ?", (phone, user_id))
             conn.commit()
+        sync_replicas('users', 'id = ?', (user_id,))
 
     @staticmethod
     def get_telegram_id_by_user_id(user_id: int) -> Optional[int]:
@@ -118,6 +350,7 @@ class UserRepo:
 
     @staticmethod
     def list_with_groups() -> List[Tuple]:
+        # Основная база, не снимок: список показывается сразу после блокировки/удаления пользователя
         with get_conn() as conn:
             cur = conn.cursor()
             cur.execute(
@@ -140,6 +373,7 @@ class UserRepo:
             cur = conn.cursor()
             cur.execute("UPDATE users SET blocked = ? WHERE id = ?", (1 if blocked else 0, user_id))
             conn.commit()
+        sync_replicas('users', 'id = ?', (user_id,))
 
     @staticmethod
     def delete_user(user_id: int) -> None:
@@ -147,6 +381,7 @@ class UserRepo:
             cur = conn.cursor()
             cur.execute("DELETE FROM users WHERE id = ?", (user_id,))
             conn.commit()
+        sync_replicas('users', 'id = ?', (user_id,))
 
 
 class GroupRepo:
@@ -164,7 +399,9 @@ class GroupRepo:
             cur.execute("INSERT INTO groups (telegram_chat_id, title, owner_user_id) VALUES (?,?,?)",
                         (telegram_chat_id, title, owner_user_id))
             conn.commit()
-            return cur.lastrowid
+            group_id = cur.lastrowid
+        sync_replicas('groups', 'id = ?', (group_id,), group_id=group_id)
+        return group_id
 
     @staticmethod
     def get_by_id(group_id: int) -> Optional[Tuple]:
@@ -181,6 +418,14 @@ class GroupRepo:
             cur.execute("SELECT id, title, telegram_chat_id FROM groups ORDER BY title")
             return cur.fetchall()
 
+    @staticmethod
+    def list_chat_ids() -> List[str]:
+        """Return telegram_chat_id of every registered group."""
+        with get_conn() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT telegram_chat_id FROM groups")
+            return [r[0] for r in cur.fetchall()]
+
     @staticmethod
     def list_user_groups_with_roles(user_id: int) -> List[Tuple[int, str, str, str]]:
         """Return list of (group_id, title, role, telegram_chat_id) for the user."""
@@ -258,7 +503,7 @@ class GroupRepo:
 
     @staticmethod
     def count_group_events(group_id: int) -> int:
-        with get_conn() as conn:
+        with get_conn(group_id) as conn:
             cur = conn.cursor()
             cur.execute("SELECT COUNT(1) FROM events WHERE group_id = ?", (group_id,))
             row = cur.fetchone()
@@ -271,6 +516,8 @@ class GroupRepo:
             cur = conn.cursor()
             cur.execute("DELETE FROM groups WHERE id = ?", (group_id,))
             conn.commit()
+        # Удаление копии группы в шарде каскадом убирает ее мероприятия, шаблоны и оповещения
+        sync_replicas('groups', 'id = ?', (group_id,), group_id=group_id)
 
 
 class RoleRepo:
@@ -281,6 +528,7 @@ class RoleRepo:
             cur.execute("INSERT OR IGNORE INTO user_group_roles (user_id, group_id, role, confirmed) VALUES (?,?,?,?)",
                         (user_id, group_id, role, 1 if confirmed else 0))
             conn.commit()
+        sync_replicas('user_group_roles', 'user_id = ? AND group_id = ?', (user_id, group_id), group_id=group_id)
 
     @staticmethod
     def find_pending_admin_match(group_id: int, *, telegram_id: Optional[int], username: Optional[str], phone: Optional[str]) -> bool:
@@ -321,6 +569,7 @@ class RoleRepo:
             # Delete by phone (normalize last 10 digits)
             cur.execute("DELETE FROM pending_admins WHERE group_id = ? AND identifier_type = 'phone' AND REPLACE(REPLACE(REPLACE(identifier,'+',''),'-',''),' ','') LIKE '%' || (SELECT substr(REPLACE(REPLACE(REPLACE(COALESCE(phone,''),'+',''),'-',''),' ',''), -10) FROM users WHERE id = ?) || '%'", (group_id, user_id))
             conn.commit()
+        sync_replicas('user_group_roles', 'user_id = ? AND group_id = ?', (user_id, group_id), group_id=group_id)
 
     @staticmethod
     def confirm_pending_roles(user_id: int, group_id: int) -> None:
@@ -398,6 +647,7 @@ class RoleRepo:
                 cur.execute("DELETE FROM pending_admins WHERE group_id = ? AND identifier_type = 'username' AND LOWER(identifier) = (SELECT LOWER(COALESCE(username,'')) FROM users WHERE id = ?)", (group_id, user_id))
                 cur.execute("DELETE FROM pending_admins WHERE group_id = ? AND identifier_type = 'phone' AND REPLACE(REPLACE(REPLACE(identifier,'+',''),'-',''),' ','') LIKE '%' || (SELECT substr(REPLACE(REPLACE(REPLACE(COALESCE(phone,''),'+',''),'-',''),' ',''), -10) FROM users WHERE id = ?) || '%'", (group_id, user_id))
             conn.commit()
+        sync_replicas('user_group_roles', 'user_id = ? AND group_id = ?', (user_id, group_id), group_id=group_id)
 
     @staticmethod
     def find_groups_for_pending(telegram_id: Optional[int], username: Optional[str], phone: Optional[str]) -> List[int]:
@@ -442,7 +692,9 @@ class RoleRepo:
             cur = conn.cursor()
             cur.execute("DELETE FROM user_group_roles WHERE user_id = ? AND group_id = ? AND role = 'admin'", (user_id, group_id))
             conn.commit()
-            return cur.rowcount > 0
+            removed = cur.rowcount > 0
+        sync_replicas('user_group_roles', 'user_id = ? AND group_id = ?', (user_id, group_id), group_id=group_id)
+        return removed
 
     @staticmethod
     def add_pending_admin(group_id: int, identifier: str, identifier_type: str, created_by_user: int) -> None:
@@ -481,12 +733,13 @@ class RoleRepo:
             cur = conn.cursor()
             cur.execute("DELETE FROM user_group_roles WHERE group_id = ?", (group_id,))
             conn.commit()
+        sync_replicas('user_group_roles', 'group_id = ?', (group_id,), group_id=group_id)
 
 
 class NotificationRepo:
     @staticmethod
     def ensure_defaults(group_id: int) -> None:
-        with get_conn() as conn:
+        with get_conn(group_id) as conn:
             cur = conn.cursor()
             
             # Check if group has group templates
@@ -531,7 +784,7 @@ class NotificationRepo:
 
     @staticmethod
     def add_notification(group_id: int, time_before: int, time_unit: str, message_text: Optional[str], is_default: int = 0, notification_type: str = 'group') -> int:
-        with get_conn() as conn:
+        with get_conn(group_id) as conn:
             cur = conn.cursor()
             cur.execute("INSERT INTO notification_settings (group_id, time_before, time_unit, message_text, is_default, type) VALUES (?,?,?,?,?,?)",
                         (group_id, time_before, time_unit, message_text, is_default, notification_type))
@@ -540,21 +793,21 @@ class NotificationRepo:
 
     @staticmethod
     def list_notifications(group_id: int) -> List[Tuple]:
-        with get_conn() as conn:
+        with get_conn(group_id) as conn:
             cur = conn.cursor()
             cur.execute("SELECT id, time_before, time_unit, message_text, is_default FROM notification_settings WHERE group_id = ? AND type = 'group' ORDER BY time_before", (group_id,))
             return cur.fetchall()
 
     @staticmethod
     def list_personal_notifications(group_id: int) -> List[Tuple]:
-        with get_conn() as conn:
+        with get_conn(group_id) as conn:
             cur = conn.cursor()
             cur.execute("SELECT id, time_before, time_unit, message_text, is_default FROM notification_settings WHERE group_id = ? AND type = 'personal' ORDER BY time_before", (group_id,))
             return cur.fetchall()
 
     @staticmethod
     def delete_notification(notification_id: int) -> bool:
-        with get_conn() as conn:
+        with get_conn(shard=shard_for_id('notification_settings', notification_id)) as conn:
             cur = conn.cursor()
             cur.execute("DELETE FROM notification_settings WHERE id = ?", (notification_id,))
             conn.commit()
@@ -577,7 +830,7 @@ class NotificationRepo:
     @staticmethod
     def delete_by_group(group_id: int):
         """Delete all group notifications"""
-        with get_conn() as conn:
+        with get_conn(group_id) as conn:
             cur = conn.cursor()
             cur.execute("DELETE FROM notification_settings WHERE group_id = ?", (group_id,))
             conn.commit()
@@ -590,7 +843,7 @@ class EventRepo:
         Return events of group ordered by time asc.
         Returns: (id, name, time, responsible_user_id)
         """
-        with get_conn() as conn:
+        with get_conn(group_id) as conn:
             cur = conn.cursor()
             cur.execute(
                 "SELECT id, name, time, responsible_user_id FROM events WHERE group_id = ? ORDER BY time ASC",
@@ -600,7 +853,7 @@ class EventRepo:
 
     @staticmethod
     def get_by_id(event_id: int) -> Optional[Tuple[int, str, str, int, Optional[int]]]:
-        with get_conn() as conn:
+        with get_conn(event_id=event_id) as conn:
             cur = conn.cursor()
             cur.execute(
                 "SELECT id, name, time, group_id, responsible_user_id, allow_multi_roles_per_user FROM events WHERE id = ?",
@@ -611,7 +864,7 @@ class EventRepo:
     @staticmethod
     def get_audit(event_id: int) -> Tuple[Optional[int], Optional[str], Optional[int], Optional[str]]:
         """Return (created_by_user_id, created_at, updated_by_user_id, updated_at)"""
-        with get_conn() as conn:
+        with get_conn(event_id=event_id) as conn:
             cur = conn.cursor()
             cur.execute(
                 "SELECT created_by_user_id, created_at, updated_by_user_id, updated_at FROM events WHERE id = ?",
@@ -624,7 +877,7 @@ class EventRepo:
 
     @staticmethod
     def create(group_id: int, name: str, time_str: str, responsible_user_id: Optional[int] = None, created_by_user_id: Optional[int] = None) -> int:
-        with get_conn() as conn:
+        with get_conn(group_id) as conn:
             cur = conn.cursor()
             if created_by_user_id is not None:
                 cur.execute(
@@ -639,17 +892,91 @@ class EventRepo:
             conn.commit()
             return cur.lastrowid
 
+    @staticmethod
+    def import_many(group_id: int, items: List[Tuple[str, str]], created_by_user_id: Optional[int] = None,
+                    skip_duplicates: bool = True) -> List[Tuple[str, Optional[int]]]:
+        """
+        Create many events of a group in one transaction: group notification defaults and role templates
+        are loaded once, events/notifications/role requirements/audit rows are inserted with executemany.
+        items: [(name, time_str), ...]. A row is a duplicate if an event with the same time and name
+        already exists in the group or appeared earlier in the same batch (skipped when skip_duplicates).
+        Times are compared to the minute: the bot stores 'YYYY-MM-DD HH:MM:SS', imports bring 'YYYY-MM-DD HH:MM'.
+        Returns per-row (status, event_id): ('created', id) or ('duplicate', existing id or None).
+        """
+        results: List[Tuple[str, Optional[int]]] = [('duplicate', None)] * len(items)
+        if not items:
+            return results
+        with get_conn(group_id) as conn:
+            cur = conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            existing = {}
+            if skip_duplicates:
+                times = sorted({t[:16] for _n, t in items})
+                for i in range(0, len(times), 500):
+                    chunk = times[i:i + 500]
+                    # Диапазон по time — чтобы idx_events_group_time_name работал не только по group_id;
+                    # substr отсекает минуты внутри диапазона, которых нет в импорте
+                    cur.execute(
+                        f"SELECT id, name, time FROM events WHERE group_id = ? AND time >= ? AND time < ? "
+                        f"AND substr(time, 1, 16) IN ({','.join('?' for _ in chunk)})",
+                        (group_id, chunk[0], chunk[-1] + ':60', *chunk)
+                    )
+                    for eid, name, time_str in cur.fetchall():
+                        existing.setdefault((time_str[:16], name), eid)
+            to_create = []
+            index_map = []
+            seen = {}
+            batch_dups = []
+            for idx, (name, time_str) in enumerate(items):
+                key = (time_str[:16], name)
+                if skip_duplicates and key in existing:
+                    results[idx] = ('duplicate', existing[key])
+                    continue
+                if skip_duplicates and key in seen:
+                    batch_dups.append((idx, seen[key]))
+                    continue
+                seen[key] = idx
+                to_create.append((name, time_str))
+                index_map.append(idx)
+            if not to_create:
+                conn.rollback()
+                return results
+            cur.execute("SELECT role_name, required FROM group_role_templates WHERE group_id = ?", (group_id,))
+            role_reqs = [(rname, int(req or 1)) for rname, req in cur.fetchall()]
+            event_ids, counts = _bulk_create_events(cur, group_id, to_create, created_by_user_id=created_by_user_id,
+                                                    role_requirements=role_reqs)
+            audit_rows = [(created_by_user_id, 'event_created', group_id, eid, name) for eid, (name, _t) in zip(event_ids, to_create)]
+            if not sharding.DB_SHARDS:
+                cur.executemany("INSERT INTO audit_log (user_id, action, group_id, event_id, new_value) VALUES (?,?,?,?,?)", audit_rows)
+            conn.commit()
+        if sharding.DB_SHARDS:
+            # Журнал аудита — в глобальной базе, мероприятия — в шарде: одной транзакцией не записать
+            with get_conn() as conn:
+                conn.executemany("INSERT INTO audit_log (user_id, action, group_id, event_id, new_value) VALUES (?,?,?,?,?)", audit_rows)
+                conn.commit()
+        for idx, eid in zip(index_map, event_ids):
+            results[idx] = ('created', eid)
+        for idx, first_idx in batch_dups:
+            results[idx] = ('duplicate', results[first_idx][1])
+        print(f"[EVENT_IMPORT] group={group_id} created={counts['events']} notifications={counts['notifications']} "
+              f"role_reqs={counts['role_requirements']} duplicates={len(items) - len(event_ids)}")
+        return results
+
     @staticmethod
     def delete(event_id: int) -> bool:
-        with get_conn() as conn:
+        with get_conn(event_id=event_id) as conn:
             cur = conn.cursor()
+            group_row = cur.execute("SELECT group_id FROM events WHERE id = ?", (event_id,)).fetchone() if _change_listeners else None
             cur.execute("DELETE FROM events WHERE id = ?", (event_id,))
             conn.commit()
-            return cur.rowcount > 0
+            deleted = cur.rowcount > 0
+        if deleted and group_row:
+            _publish_change('deleted', event_id, group_row[0])
+        return deleted
 
     @staticmethod
     def set_responsible(event_id: int, user_id: Optional[int]) -> None:
-        with get_conn() as conn:
+        with get_conn(event_id=event_id) as conn:
             cur = conn.cursor()
             
             # Get current responsible user before updating
@@ -666,6 +993,7 @@ class EventRepo:
             group_row = cur.fetchone()
             if group_row:
                 group_id = group_row[0]
+                _publish_change('booked' if user_id else 'unbooked', event_id, group_id)
                 
                 # If there was a previous responsible user, remove their personal notifications
                 if current_responsible_id:
@@ -677,28 +1005,30 @@ class EventRepo:
 
     @staticmethod
     def update_name(event_id: int, name: str, updated_by_user_id: Optional[int] = None) -> None:
-        with get_conn() as conn:
+        with get_conn(event_id=event_id) as conn:
             cur = conn.cursor()
             if updated_by_user_id is not None:
                 cur.execute("UPDATE events SET name = ?, updated_by_user_id = ?, updated_at = datetime('now') WHERE id = ?", (name, updated_by_user_id, event_id))
             else:
                 cur.execute("UPDATE events SET name = ? WHERE id = ?", (name, event_id))
             conn.commit()
+        _publish_change('edited', event_id)
 
     @staticmethod
     def update_time(event_id: int, time_str: str, updated_by_user_id: Optional[int] = None) -> None:
-        with get_conn() as conn:
+        with get_conn(event_id=event_id) as conn:
             cur = conn.cursor()
             if updated_by_user_id is not None:
                 cur.execute("UPDATE events SET time = ?, updated_by_user_id = ?, updated_at = datetime('now') WHERE id = ?", (time_str, updated_by_user_id, event_id))
             else:
                 cur.execute("UPDATE events SET time = ? WHERE id = ?", (time_str, event_id))
             conn.commit()
+        _publish_change('edited', event_id)
 
     @staticmethod
     def update_responsible(event_id: int, responsible_user_id: Optional[int], updated_by_user_id: Optional[int] = None) -> None:
         print(f"EventRepo.update_responsible: event_id={event_id}, responsible_user_id={responsible_user_id}")
-        with get_conn() as conn:
+        with get_conn(event_id=event_id) as conn:
             cur = conn.cursor()
             if updated_by_user_id is not None:
                 cur.execute("UPDATE events SET responsible_user_id = ?, updated_by_user_id = ?, updated_at = datetime('now') WHERE id = ?", (responsible_user_id, updated_by_user_id, event_id))
@@ -707,11 +1037,12 @@ class EventRepo:
             rows_affected = cur.rowcount
             print(f"EventRepo.update_responsible: rows affected = {rows_affected}")
             conn.commit()
+        _publish_change('edited', event_id)
 
     @staticmethod
     def list_by_group_between(group_id: int, start_iso: str, end_iso: str) -> List[Tuple]:
         """Return events in group between [start_iso, end_iso], ordered by time."""
-        with get_conn() as conn:
+        with get_conn(group_id) as conn:
             cur = conn.cursor()
             cur.execute(
                 "SELECT id, name, time, responsible_user_id FROM events WHERE group_id = ? AND time >= ? AND time <= ? ORDER BY time",
@@ -719,10 +1050,59 @@ class EventRepo:
             )
             return cur.fetchall()
 
+    @staticmethod
+    def list_upcoming_page(group_id: int, from_iso: str, *, after: Optional[Tuple[str, int]] = None,
+                           before: Optional[Tuple[str, int]] = None, limit: int = 10) -> List[Tuple]:
+        """
+        Keyset page of events with time >= from_iso, ordered by (time, id).
+        after=(time, id) returns the page following that row, before=(time, id) the page preceding it.
+        Fetches limit+1 rows so the caller can tell whether another page exists in that direction.
+        Returns: (id, name, time, responsible_user_id)
+        """
+        with get_conn(group_id) as conn:
+            cur = conn.cursor()
+            if before is not None:
+                b_time, b_id = before
+                cur.execute(
+                    """
+                    SELECT id, name, time, responsible_user_id FROM events
+                    WHERE group_id = ? AND time >= ? AND (time < ? OR (time = ? AND id < ?))
+                    ORDER BY time DESC, id DESC
+                    LIMIT ?
+                    """,
+                    (group_id, from_iso, b_time, b_time, b_id, limit + 1),
+                )
+                return list(reversed(cur.fetchall()))
+            if after is not None:
+                a_time, a_id = after
+                cur.execute(
+                    """
+                    SELECT id, name, time, responsible_user_id FROM events
+                    WHERE group_id = ? AND time >= ? AND (time > ? OR (time = ? AND id > ?))
+                    ORDER BY time ASC, id ASC
+                    LIMIT ?
+                    """,
+                    (group_id, from_iso, a_time, a_time, a_id, limit + 1),
+                )
+            else:
+                cur.execute(
+                    "SELECT id, name, time, responsible_user_id FROM events WHERE group_id = ? AND time >= ? ORDER BY time ASC, id ASC LIMIT ?",
+                    (group_id, from_iso, limit + 1),
+                )
+            return cur.fetchall()
+
+    @staticmethod
+    def count_upcoming(group_id: int, from_iso: str) -> int:
+        with get_conn(group_id) as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT COUNT(1) FROM events WHERE group_id = ? AND time >= ?", (group_id, from_iso))
+            row = cur.fetchone()
+            return row[0] if row else 0
+
     @staticmethod
     def delete_by_group(group_id: int):
         """Delete all events in a group"""
-        with get_conn() as conn:
+        with get_conn(group_id) as conn:
             cur = conn.cursor()
             cur.execute("DELETE FROM events WHERE group_id = ?", (group_id,))
             conn.commit()
@@ -732,7 +1112,7 @@ class EventNotificationRepo:
     @staticmethod
     def create_from_group_defaults(event_id: int, group_id: int) -> None:
         """Create event notifications based on group notification settings (type='group' only)."""
-        with get_conn() as conn:
+        with get_conn(group_id) as conn:
             cur = conn.cursor()
             # Get event time
             cur.execute("SELECT time FROM events WHERE id = ?", (event_id,))
@@ -758,14 +1138,14 @@ class EventNotificationRepo:
     @staticmethod
     def list_by_event(event_id: int) -> List[Tuple]:
         """Return event notifications ordered by time_before."""
-        with get_conn() as conn:
+        with get_conn(event_id=event_id) as conn:
             cur = conn.cursor()
             cur.execute("SELECT id, time_before, time_unit, message_text FROM event_notifications WHERE event_id = ? ORDER BY time_before", (event_id,))
             return cur.fetchall()
 
     @staticmethod
     def add_notification(event_id: int, time_before: int, time_unit: str, message_text: Optional[str] = None) -> int:
-        with get_conn() as conn:
+        with get_conn(event_id=event_id) as conn:
             cur = conn.cursor()
             # Check if notification already exists
             cur.execute("SELECT id FROM event_notifications WHERE event_id = ? AND time_before = ? AND time_unit = ? AND (message_text = ? OR (message_text IS NULL AND ? IS NULL))",
@@ -781,7 +1161,7 @@ class EventNotificationRepo:
 
     @staticmethod
     def delete_notification(notification_id: int) -> bool:
-        with get_conn() as conn:
+        with get_conn(shard=shard_for_id('event_notifications', notification_id)) as conn:
             cur = conn.cursor()
             # Load event_id, time_before, time_unit to clear dispatch log
             cur.execute("SELECT event_id, time_before, time_unit FROM event_notifications WHERE id = ?", (notification_id,))
@@ -801,7 +1181,7 @@ class EventNotificationRepo:
     @staticmethod
     def delete_by_group(group_id: int):
         """Delete all event notifications for events in a group"""
-        with get_conn() as conn:
+        with get_conn(group_id) as conn:
             cur = conn.cursor()
             cur.execute("""
                 DELETE FROM event_notifications 
@@ -814,7 +1194,7 @@ class PersonalEventNotificationRepo:
     @staticmethod
     def create_from_group_for_user(event_id: int, group_id: int, user_id: int) -> None:
         """Create personal notifications for ONE user from group's personal settings (idempotent)."""
-        with get_conn() as conn:
+        with get_conn(group_id) as conn:
             cur = conn.cursor()
             # Get event time
             cur.execute("SELECT time FROM events WHERE id = ?", (event_id,))
@@ -843,7 +1223,7 @@ class PersonalEventNotificationRepo:
     @staticmethod
     def create_from_personal_templates(event_id: int, group_id: int, user_id: int) -> None:
         """Create personal notifications for a specific user based on personal templates."""
-        with get_conn() as conn:
+        with get_conn(group_id) as conn:
             cur = conn.cursor()
             # Get event time
             cur.execute("SELECT time FROM events WHERE id = ?", (event_id,))
@@ -871,7 +1251,7 @@ class PersonalEventNotificationRepo:
     @staticmethod
     def create_from_group_for_all_users(event_id: int, group_id: int) -> None:
         """Create personal notifications for all group members based on group settings."""
-        with get_conn() as conn:
+        with get_conn(group_id) as conn:
             cur = conn.cursor()
             # Get all group members
             cur.execute("""
@@ -900,7 +1280,7 @@ class PersonalEventNotificationRepo:
     @staticmethod
     def create_from_group_for_user(event_id: int, group_id: int, user_id: int) -> None:
         """Create personal notifications for specific user based on group settings, only for future events."""
-        with get_conn() as conn:
+        with get_conn(group_id) as conn:
             cur = conn.cursor()
             
             # Check if event is in the future
@@ -956,7 +1336,7 @@ class PersonalEventNotificationRepo:
     @staticmethod
     def update_user_for_event(event_id: int, old_user_id: int | None, new_user_id: int | None, group_id: int) -> None:
         """Update personal notifications when responsible user changes."""
-        with get_conn() as conn:
+        with get_conn(group_id) as conn:
             cur = conn.cursor()
             
             # Delete old notifications if old user existed
@@ -972,7 +1352,7 @@ class PersonalEventNotificationRepo:
     @staticmethod
     def delete_for_event(event_id: int) -> None:
         """Delete all personal notifications for an event."""
-        with get_conn() as conn:
+        with get_conn(event_id=event_id) as conn:
             cur = conn.cursor()
             cur.execute("DELETE FROM personal_event_notifications WHERE event_id = ?", (event_id,))
             conn.commit()
@@ -980,7 +1360,7 @@ class PersonalEventNotificationRepo:
     @staticmethod
     def list_by_user_and_event(user_id: int, event_id: int) -> List[Tuple]:
         """Return personal notifications for user and event, ordered by time_before."""
-        with get_conn() as conn:
+        with get_conn(event_id=event_id) as conn:
             cur = conn.cursor()
             cur.execute("SELECT id, time_before, time_unit, message_text FROM personal_event_notifications WHERE user_id = ? AND event_id = ? ORDER BY time_before", (user_id, event_id))
             return cur.fetchall()
@@ -988,14 +1368,14 @@ class PersonalEventNotificationRepo:
     @staticmethod
     def list_all_for_event(event_id: int) -> List[Tuple]:
         """Return all personal notifications for an event as (id, user_id, time_before, time_unit, message_text)."""
-        with get_conn() as conn:
+        with get_conn(event_id=event_id) as conn:
             cur = conn.cursor()
             cur.execute("SELECT id, user_id, time_before, time_unit, message_text FROM personal_event_notifications WHERE event_id = ? ORDER BY time_before", (event_id,))
             return cur.fetchall()
 
     @staticmethod
     def add_notification(user_id: int, event_id: int, time_before: int, time_unit: str, message_text: Optional[str] = None) -> int:
-        with get_conn() as conn:
+        with get_conn(event_id=event_id) as conn:
             cur = conn.cursor()
             # Check if notification already exists (based on UNIQUE constraint: user_id, event_id, time_before, time_unit)
             cur.execute("SELECT id FROM personal_event_notifications WHERE user_id = ? AND event_id = ? AND time_before = ? AND time_unit = ?",
@@ -1016,7 +1396,7 @@ class PersonalEventNotificationRepo:
     @staticmethod
     def delete_notification(notification_id: int, user_id: int) -> bool:
         """Delete personal notification, ensuring user owns it."""
-        with get_conn() as conn:
+        with get_conn(shard=shard_for_id('personal_event_notifications', notification_id)) as conn:
             cur = conn.cursor()
             # Load event_id, tb, tu for dispatch cleanup
             cur.execute("SELECT event_id, time_before, time_unit FROM personal_event_notifications WHERE id = ? AND user_id = ?", (notification_id, user_id))
@@ -1035,7 +1415,7 @@ class PersonalEventNotificationRepo:
     @staticmethod
     def admin_delete_notification(notification_id: int) -> bool:
         """Delete personal notification without user ownership check (for admins/owners)."""
-        with get_conn() as conn:
+        with get_conn(shard=shard_for_id('personal_event_notifications', notification_id)) as conn:
             cur = conn.cursor()
             cur.execute("SELECT user_id, event_id, time_before, time_unit FROM personal_event_notifications WHERE id = ?", (notification_id,))
             row = cur.fetchone()
@@ -1053,14 +1433,14 @@ class PersonalEventNotificationRepo:
     @staticmethod
     def delete_by_user_and_event(user_id: int, event_id: int) -> None:
         """Delete all personal notifications for a specific user and event."""
-        with get_conn() as conn:
+        with get_conn(event_id=event_id) as conn:
             cur = conn.cursor()
             cur.execute("DELETE FROM personal_event_notifications WHERE user_id = ? AND event_id = ?", (user_id, event_id))
             conn.commit()
 
     @staticmethod
     def delete_all_for_user_event(user_id: int, event_id: int) -> None:
-        with get_conn() as conn:
+        with get_conn(event_id=event_id) as conn:
             cur = conn.cursor()
             cur.execute("DELETE FROM personal_event_notifications WHERE user_id = ? AND event_id = ?", (user_id, event_id))
             conn.commit()
@@ -1068,17 +1448,22 @@ class PersonalEventNotificationRepo:
     @staticmethod
     def list_by_user(user_id: int) -> List[Tuple]:
         """Return all personal notifications for user across all events."""
-        with get_conn() as conn:
-            cur = conn.cursor()
-            cur.execute("""
-                SELECT pen.id, pen.event_id, pen.time_before, pen.time_unit, pen.message_text, e.name, e.time, g.title
-                FROM personal_event_notifications pen
-                JOIN events e ON e.id = pen.event_id
-                JOIN groups g ON g.id = e.group_id
-                WHERE pen.user_id = ?
-                ORDER BY e.time, pen.time_before
-            """, (user_id,))
-            return cur.fetchall()
+        rows = []
+        for shard in shard_ids():
+            with get_conn(shard=shard) as conn:
+                cur = conn.cursor()
+                cur.execute("""
+                    SELECT pen.id, pen.event_id, pen.time_before, pen.time_unit, pen.message_text, e.name, e.time, g.title
+                    FROM personal_event_notifications pen
+                    JOIN events e ON e.id = pen.event_id
+                    JOIN groups g ON g.id = e.group_id
+                    WHERE pen.user_id = ?
+                    ORDER BY e.time, pen.time_before
+                """, (user_id,))
+                rows.extend(cur.fetchall())
+        # Строки из нескольких шардов — общий порядок восстанавливаем здесь
+        rows.sort(key=lambda r: (r[6], r[2]))
+        return rows
 
     @staticmethod
     def list_personal_settings(user_id: int) -> List[Tuple]:
@@ -1117,7 +1502,7 @@ class PersonalEventNotificationRepo:
     @staticmethod
     def delete_by_group(group_id: int):
         """Delete all personal event notifications for events in a group"""
-        with get_conn() as conn:
+        with get_conn(group_id) as conn:
             cur = conn.cursor()
             cur.execute("""
                 DELETE FROM personal_event_notifications 
@@ -1129,7 +1514,7 @@ class PersonalEventNotificationRepo:
 class DispatchLogRepo:
     @staticmethod
     def mark_sent(kind: str, *, user_id: Optional[int], group_id: Optional[int], event_id: int, time_before: int, time_unit: str) -> None:
-        with get_conn() as conn:
+        with get_conn(event_id=event_id) as conn:
             cur = conn.cursor()
             cur.execute(
                 """
@@ -1143,7 +1528,7 @@ class DispatchLogRepo:
 
     @staticmethod
     def was_sent(kind: str, *, user_id: Optional[int], group_id: Optional[int], event_id: int, time_before: int, time_unit: str) -> bool:
-        with get_conn() as conn:
+        with get_conn(event_id=event_id) as conn:
             cur = conn.cursor()
             cur.execute(
                 """
@@ -1159,7 +1544,7 @@ class DispatchLogRepo:
     @staticmethod
     def get_sent_status_for_event_notifications(event_id: int) -> dict[tuple[int, str], bool]:
         """Get sent status for all event notifications of an event. Returns dict with (time_before, time_unit) as key."""
-        with get_conn() as conn:
+        with get_conn(event_id=event_id) as conn:
             cur = conn.cursor()
             cur.execute(
                 """
@@ -1189,7 +1574,7 @@ class DispatchLogRepo:
     @staticmethod
     def get_sent_status_for_personal_notifications(event_id: int, user_id: int) -> dict[tuple[int, str], bool]:
         """Get sent status for all personal notifications of a user for an event. Returns dict with (time_before, time_unit) as key."""
-        with get_conn() as conn:
+        with get_conn(event_id=event_id) as conn:
             cur = conn.cursor()
             cur.execute(
                 """
@@ -1220,45 +1605,55 @@ class DispatchLogRepo:
 class BookingRepo:
     @staticmethod
     def add_booking(user_id: int, event_id: int) -> int:
-        with get_conn() as conn:
+        with get_conn(event_id=event_id) as conn:
             cur = conn.cursor()
             cur.execute("INSERT OR IGNORE INTO bookings (user_id, event_id) VALUES (?,?)", (user_id, event_id))
             conn.commit()
-            return cur.lastrowid
+            added = cur.rowcount > 0
+            booking_id = cur.lastrowid
+        if added:
+            _publish_change('booked', event_id)
+        return booking_id
 
     @staticmethod
     def remove_booking(user_id: int, event_id: int) -> bool:
-        with get_conn() as conn:
+        with get_conn(event_id=event_id) as conn:
             cur = conn.cursor()
             cur.execute("DELETE FROM bookings WHERE user_id = ? AND event_id = ?", (user_id, event_id))
             conn.commit()
-            return cur.rowcount > 0
+            removed = cur.rowcount > 0
+        if removed:
+            _publish_change('unbooked', event_id)
+        return removed
 
     @staticmethod
     def has_booking(user_id: int, event_id: int) -> bool:
-        with get_conn() as conn:
+        with get_conn(event_id=event_id) as conn:
             cur = conn.cursor()
             cur.execute("SELECT 1 FROM bookings WHERE user_id = ? AND event_id = ? LIMIT 1", (user_id, event_id))
             return cur.fetchone() is not None
 
     @staticmethod
     def list_event_bookings(event_id: int) -> List[Tuple[int]]:
-        with get_conn() as conn:
+        with get_conn(event_id=event_id) as conn:
             cur = conn.cursor()
             cur.execute("SELECT user_id FROM bookings WHERE event_id = ?", (event_id,))
             return cur.fetchall()
 
     @staticmethod
     def list_user_bookings(user_id: int) -> List[Tuple[int]]:
-        with get_conn() as conn:
-            cur = conn.cursor()
-            cur.execute("SELECT event_id FROM bookings WHERE user_id = ?", (user_id,))
-            return cur.fetchall()
+        rows = []
+        for shard in shard_ids():
+            with get_conn(shard=shard) as conn:
+                cur = conn.cursor()
+                cur.execute("SELECT event_id FROM bookings WHERE user_id = ?", (user_id,))
+                rows.extend(cur.fetchall())
+        return rows
 
     @staticmethod
     def list_event_bookings_with_names(group_id: int, event_id: int) -> List[Tuple[int, str]]:
         """Return (user_id, name_to_show) using display_name if exists, else @username or user_id."""
-        with get_conn() as conn:
+        with get_conn(group_id) as conn:
             cur = conn.cursor()
             cur.execute(
                 """
@@ -1278,7 +1673,7 @@ class BookingRepo:
     @staticmethod
     def delete_by_group(group_id: int):
         """Delete all bookings for events in a group"""
-        with get_conn() as conn:
+        with get_conn(group_id) as conn:
             cur = conn.cursor()
             cur.execute("""
                 DELETE FROM bookings 
@@ -1290,7 +1685,7 @@ class BookingRepo:
 class DisplayNameRepo:
     @staticmethod
     def set_display_name(group_id: int, user_id: int, display_name: str) -> None:
-        with get_conn() as conn:
+        with get_conn(group_id) as conn:
             cur = conn.cursor()
             cur.execute(
                 "INSERT INTO user_display_names (group_id, user_id, display_name) VALUES (?,?,?)\n                 ON CONFLICT(group_id, user_id) DO UPDATE SET display_name = excluded.display_name",
@@ -1301,7 +1696,7 @@ class DisplayNameRepo:
     @staticmethod
     def create_display_name_from_user_info(group_id: int, user_id: int) -> None:
         """Create display name from user's first_name and last_name"""
-        with get_conn() as conn:
+        with get_conn(group_id) as conn:
             cur = conn.cursor()
             cur.execute("SELECT first_name, last_name FROM users WHERE id = ?", (user_id,))
             row = cur.fetchone()
@@ -1317,7 +1712,7 @@ class DisplayNameRepo:
 
     @staticmethod
     def get_display_name(group_id: int, user_id: int) -> Optional[str]:
-        with get_conn() as conn:
+        with get_conn(group_id) as conn:
             cur = conn.cursor()
             cur.execute("SELECT display_name FROM user_display_names WHERE group_id = ? AND user_id = ?", (group_id, user_id))
             row = cur.fetchone()
@@ -1326,7 +1721,7 @@ class DisplayNameRepo:
     @staticmethod
     def delete_by_group(group_id: int):
         """Delete all display names for a group"""
-        with get_conn() as conn:
+        with get_conn(group_id) as conn:
             cur = conn.cursor()
             cur.execute("DELETE FROM user_display_names WHERE group_id = ?", (group_id,))
             conn.commit()
@@ -1388,32 +1783,43 @@ class EventTemplateRepo:
                planning_horizon_days: int, allow_multi_roles_per_user: int,
                freq: Optional[str] = None, interval: Optional[int] = None, byweekday: Optional[str] = None,
                bymonthday: Optional[str] = None, bysetpos: Optional[int] = None, until: Optional[str] = None,
-               count: Optional[int] = None, exceptions_json: Optional[str] = None) -> int:
-        with get_conn() as conn:
+               count: Optional[int] = None, exceptions_json: Optional[str] = None, materialize_mode: str = 'eager') -> int:
+        with get_conn(group_id) as conn:
             cur = conn.cursor()
             cur.execute(
                 """
                 INSERT INTO event_templates 
                 (group_id, name, description, kind, base_time, timezone, planning_horizon_days, allow_multi_roles_per_user,
-                 freq, interval, byweekday, bymonthday, bysetpos, until, count, exceptions_json)
-                VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+                 freq, interval, byweekday, bymonthday, bysetpos, until, count, exceptions_json, materialize_mode)
+                VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
                 """,
                 (group_id, name, description, kind, base_time, timezone, planning_horizon_days, allow_multi_roles_per_user,
-                 freq, interval, byweekday, bymonthday, bysetpos, until, count, exceptions_json)
+                 freq, interval, byweekday, bymonthday, bysetpos, until, count, exceptions_json,
+                 'lazy' if materialize_mode == 'lazy' else 'eager')
             )
             conn.commit()
             return cur.lastrowid
 
     @staticmethod
     def list_by_group(group_id: int) -> List[Tuple]:
-        with get_conn() as conn:
+        with get_conn(group_id) as conn:
             cur = conn.cursor()
             cur.execute("SELECT id, name, kind, base_time, timezone, planning_horizon_days FROM event_templates WHERE group_id = ? ORDER BY id DESC", (group_id,))
             return cur.fetchall()
 
+    @staticmethod
+    def list_recurring() -> List[int]:
+        ids = []
+        for shard in shard_ids():
+            with get_conn(shard=shard) as conn:
+                cur = conn.cursor()
+                cur.execute("SELECT id FROM event_templates WHERE kind != 'one_time' AND freq IS NOT NULL ORDER BY id")
+                ids.extend(row[0] for row in cur.fetchall())
+        return sorted(ids)
+
     @staticmethod
     def get(template_id: int) -> Optional[Tuple]:
-        with get_conn() as conn:
+        with get_conn(template_id=template_id) as conn:
             cur = conn.cursor()
             cur.execute("SELECT * FROM event_templates WHERE id = ?", (template_id,))
             return cur.fetchone()
@@ -1421,7 +1827,7 @@ class EventTemplateRepo:
     @staticmethod
     def update_basic(template_id: int, *, planning_horizon_days: int, allow_multi_roles_per_user: int,
                      freq: Optional[str], interval: Optional[int]) -> None:
-        with get_conn() as conn:
+        with get_conn(template_id=template_id) as conn:
             cur = conn.cursor()
             cur.execute(
                 """
@@ -1433,9 +1839,27 @@ class EventTemplateRepo:
             )
             conn.commit()
 
+    @staticmethod
+    def set_materialize_mode(template_id: int, materialize_mode: str) -> None:
+        """'eager' — события создаются на весь горизонт, 'lazy' — только по требованию."""
+        with get_conn(template_id=template_id) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "UPDATE event_templates SET materialize_mode = ? WHERE id = ?",
+                ('lazy' if materialize_mode == 'lazy' else 'eager', template_id)
+            )
+            conn.commit()
+
+    @staticmethod
+    def list_lazy_by_group(group_id: int) -> List[Tuple]:
+        with get_conn(group_id) as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT * FROM event_templates WHERE group_id = ? AND materialize_mode = 'lazy' ORDER BY id", (group_id,))
+            return cur.fetchall()
+
     @staticmethod
     def set_allow_multi_roles(template_id: int, allow_multi_roles_per_user: int) -> None:
-        with get_conn() as conn:
+        with get_conn(template_id=template_id) as conn:
             cur = conn.cursor()
             cur.execute(
                 "UPDATE event_templates SET allow_multi_roles_per_user = ? WHERE id = ?",
@@ -1447,7 +1871,7 @@ class EventTemplateRepo:
 class TemplateRoleRequirementRepo:
     @staticmethod
     def upsert(template_id: int, role_name: str, required: int) -> None:
-        with get_conn() as conn:
+        with get_conn(template_id=template_id) as conn:
             cur = conn.cursor()
             cur.execute("SELECT id FROM template_role_requirements WHERE template_id = ? AND role_name = ?", (template_id, role_name))
             row = cur.fetchone()
@@ -1459,21 +1883,21 @@ class TemplateRoleRequirementRepo:
 
     @staticmethod
     def list(template_id: int) -> List[Tuple]:
-        with get_conn() as conn:
+        with get_conn(template_id=template_id) as conn:
             cur = conn.cursor()
             cur.execute("SELECT role_name, required FROM template_role_requirements WHERE template_id = ? ORDER BY role_name", (template_id,))
             return cur.fetchall()
 
     @staticmethod
     def delete_all(template_id: int) -> None:
-        with get_conn() as conn:
+        with get_conn(template_id=template_id) as conn:
             cur = conn.cursor()
             cur.execute("DELETE FROM template_role_requirements WHERE template_id = ?", (template_id,))
             conn.commit()
 
     @staticmethod
     def replace_all(template_id: int, items: List[Tuple[str, int]]) -> None:
-        with get_conn() as conn:
+        with get_conn(template_id=template_id) as conn:
             cur = conn.cursor()
             cur.execute("DELETE FROM template_role_requirements WHERE template_id = ?", (template_id,))
             for role_name, required in items:
@@ -1485,7 +1909,7 @@ class TemplateRoleRequirementRepo:
 class EventRoleRequirementRepo:
     @staticmethod
     def set_for_event(event_id: int, role_name: str, required: int) -> None:
-        with get_conn() as conn:
+        with get_conn(event_id=event_id) as conn:
             cur = conn.cursor()
             cur.execute("INSERT INTO event_role_requirements (event_id, role_name, required) VALUES (?,?,?) ON CONFLICT(event_id, role_name) DO UPDATE SET required = excluded.required",
                         (event_id, role_name, required))
@@ -1493,14 +1917,14 @@ class EventRoleRequirementRepo:
 
     @staticmethod
     def list_for_event(event_id: int) -> List[Tuple[str, int]]:
-        with get_conn() as conn:
+        with get_conn(event_id=event_id) as conn:
             cur = conn.cursor()
             cur.execute("SELECT role_name, required FROM event_role_requirements WHERE event_id = ? ORDER BY role_name", (event_id,))
             return cur.fetchall()
 
     @staticmethod
     def replace_for_event(event_id: int, role_names: List[str]) -> None:
-        with get_conn() as conn:
+        with get_conn(event_id=event_id) as conn:
             cur = conn.cursor()
             cur.execute("DELETE FROM event_role_requirements WHERE event_id = ?", (event_id,))
             for name in role_names:
@@ -1512,26 +1936,30 @@ class EventRoleRequirementRepo:
 class EventRoleAssignmentRepo:
     @staticmethod
     def assign(event_id: int, role_name: str, user_id: int) -> bool:
-        with get_conn() as conn:
+        with get_conn(event_id=event_id) as conn:
             cur = conn.cursor()
             try:
                 cur.execute("INSERT INTO event_role_assignments (event_id, role_name, user_id) VALUES (?,?,?)", (event_id, role_name, user_id))
                 conn.commit()
-                return True
             except Exception:
                 return False
+        _publish_change('booked', event_id)
+        return True
 
     @staticmethod
     def unassign(event_id: int, role_name: str, user_id: int) -> bool:
-        with get_conn() as conn:
+        with get_conn(event_id=event_id) as conn:
             cur = conn.cursor()
             cur.execute("DELETE FROM event_role_assignments WHERE event_id = ? AND role_name = ? AND user_id = ?", (event_id, role_name, user_id))
             conn.commit()
-            return cur.rowcount > 0
+            removed = cur.rowcount > 0
+        if removed:
+            _publish_change('unbooked', event_id)
+        return removed
 
     @staticmethod
     def list_for_event(event_id: int) -> List[Tuple[str, int]]:
-        with get_conn() as conn:
+        with get_conn(event_id=event_id) as conn:
             cur = conn.cursor()
             cur.execute("SELECT role_name, user_id FROM event_role_assignments WHERE event_id = ? ORDER BY role_name", (event_id,))
             return cur.fetchall()
@@ -1540,15 +1968,23 @@ class EventRoleAssignmentRepo:
 class TemplateGenerationRepo:
     @staticmethod
     def was_generated(template_id: int, occurrence_key: str) -> Optional[int]:
-        with get_conn() as conn:
+        with get_conn(template_id=template_id) as conn:
             cur = conn.cursor()
             cur.execute("SELECT event_id FROM template_generated_events WHERE template_id = ? AND occurrence_key = ?", (template_id, occurrence_key))
             row = cur.fetchone()
             return row[0] if row else None
 
+    @staticmethod
+    def last_key(template_id: int) -> Optional[str]:
+        with get_conn(template_id=template_id) as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT MAX(occurrence_key) FROM template_generated_events WHERE template_id = ?", (template_id,))
+            row = cur.fetchone()
+            return row[0] if row else None
+
     @staticmethod
     def mark_generated(template_id: int, occurrence_key: str, event_id: int) -> None:
-        with get_conn() as conn:
+        with get_conn(template_id=template_id) as conn:
             cur = conn.cursor()
             cur.execute("INSERT OR IGNORE INTO template_generated_events (template_id, occurrence_key, event_id) VALUES (?,?,?)", (template_id, occurrence_key, event_id))
             conn.commit()
@@ -1557,14 +1993,14 @@ class TemplateGenerationRepo:
 class GroupRoleTemplateRepo:
     @staticmethod
     def list(group_id: int) -> List[Tuple[str, int]]:
-        with get_conn() as conn:
+        with get_conn(group_id) as conn:
             cur = conn.cursor()
             cur.execute("SELECT role_name, required FROM group_role_templates WHERE group_id = ? ORDER BY role_name", (group_id,))
             return cur.fetchall()
 
     @staticmethod
     def upsert(group_id: int, role_name: str, required: int = 1) -> None:
-        with get_conn() as conn:
+        with get_conn(group_id) as conn:
             cur = conn.cursor()
             cur.execute("SELECT id FROM group_role_templates WHERE group_id = ? AND role_name = ?", (group_id, role_name))
             row = cur.fetchone()
@@ -1577,7 +2013,7 @@ class GroupRoleTemplateRepo:
     @staticmethod
     def replace_all(group_id: int, items: List[Tuple[str, int]]) -> None:
         """Replace all role templates for a group with provided (role_name, required) pairs."""
-        with get_conn() as conn:
+        with get_conn(group_id) as conn:
             cur = conn.cursor()
             cur.execute("DELETE FROM group_role_templates WHERE group_id = ?", (group_id,))
             for role_name, required in items:
@@ -1588,6 +2024,366 @@ class GroupRoleTemplateRepo:
                     )
             conn.commit()
 
+class GroupDataVersionRepo:
+    """Версии данных групп (таблица group_data_versions ведется триггерами на мероприятия, записи и участников)."""
+
+    @staticmethod
+    def get(group_id: int) -> Tuple[int, Optional[str]]:
+        """Returns (version, updated_at UTC). Group without changes yet -> (0, None)."""
+        with get_conn(group_id) as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT version, updated_at FROM group_data_versions WHERE group_id = ?", (group_id,))
+            row = cur.fetchone()
+            return (row[0], row[1]) if row else (0, None)
+
+    @staticmethod
+    def get_many(group_ids: List[int]) -> dict:
+        """{group_id: version} for the given groups (missing groups -> 0)."""
+        result = {gid: 0 for gid in group_ids}
+        by_shard: dict = {}
+        for gid in group_ids:
+            by_shard.setdefault(shard_for_group(gid), []).append(gid)
+        for shard, gids in by_shard.items():
+            with get_conn(shard=shard) as conn:
+                cur = conn.cursor()
+                for i in range(0, len(gids), 500):
+                    chunk = gids[i:i + 500]
+                    cur.execute(f"SELECT group_id, version FROM group_data_versions WHERE group_id IN ({','.join('?' for _ in chunk)})", chunk)
+                    result.update(cur.fetchall())
+        return result
+
+    @staticmethod
+    def list_for_user(user_id: int) -> List[Tuple[int, int, Optional[str]]]:
+        """Versions of every group the user is a member of or has bookings in: (group_id, version, updated_at)."""
+        rows = []
+        for shard in shard_ids():
+            with get_conn(shard=shard) as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    """
+                    SELECT g.group_id, COALESCE(v.version, 0), v.updated_at
+                    FROM (
+                        SELECT group_id FROM user_group_roles WHERE user_id = ?
+                        UNION
+                        SELECT e.group_id FROM event_role_assignments a JOIN events e ON e.id = a.event_id WHERE a.user_id = ?
+                    ) g
+                    LEFT JOIN group_data_versions v ON v.group_id = g.group_id
+                    ORDER BY g.group_id
+                    """,
+                    (user_id, user_id),
+                )
+                rows.extend(cur.fetchall())
+        return sorted(rows)
+
+
+class SyncRepo:
+    """Delta-sync для Mini App: что изменилось в группе после версии N (event_versions ведется триггерами)."""
+
+    _LABEL_SQL = "COALESCE(dn.display_name, '@' || u.username, u.first_name, CAST(u.telegram_id AS TEXT))"
+
+    @staticmethod
+    def changes_since(group_id: int, since: int) -> Tuple[int, int, List[int], List[int]]:
+        """Returns (version, members_version, changed event ids, deleted event ids) for changes with version > since."""
+        with get_conn(group_id) as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT version, members_version FROM group_data_versions WHERE group_id = ?", (group_id,))
+            row = cur.fetchone()
+            version, members_version = (row[0], row[1]) if row else (0, 0)
+            if since >= version:
+                return version, members_version, [], []
+            cur.execute(
+                "SELECT event_id, deleted FROM event_versions WHERE group_id = ? AND version > ? ORDER BY event_id",
+                (group_id, since),
+            )
+            changed, deleted = [], []
+            for eid, is_deleted in cur.fetchall():
+                (deleted if is_deleted else changed).append(eid)
+            return version, members_version, changed, deleted
+
+    @staticmethod
+    def load_events(group_id: int, event_ids: Optional[List[int]] = None) -> Tuple[List[Tuple], List[Tuple], List[Tuple], List[Tuple]]:
+        """
+        Events with rosters in four queries per chunk of ids (all group events when event_ids is None).
+        Returns (events (id, name, time, responsible_user_id), requirements (event_id, role_name, required),
+        assignments (event_id, role_name, user_id, label), bookings (event_id, user_id, label)).
+        """
+        events, reqs, assigns, bookings = [], [], [], []
+        with get_conn(group_id) as conn:
+            cur = conn.cursor()
+            if event_ids is None:
+                cur.execute("SELECT id FROM events WHERE group_id = ? ORDER BY time, id", (group_id,))
+                event_ids = [r[0] for r in cur.fetchall()]
+            for i in range(0, len(event_ids), 500):
+                chunk = event_ids[i:i + 500]
+                marks = ','.join('?' for _ in chunk)
+                cur.execute(
+                    f"SELECT id, name, time, responsible_user_id FROM events WHERE group_id = ? AND id IN ({marks}) ORDER BY time, id",
+                    (group_id, *chunk),
+                )
+                events.extend(cur.fetchall())
+                cur.execute(
+                    f"SELECT event_id, role_name, required FROM event_role_requirements WHERE event_id IN ({marks}) ORDER BY event_id, id",
+                    chunk,
+                )
+                reqs.extend(cur.fetchall())
+                cur.execute(
+                    f"""
+                    SELECT a.event_id, a.role_name, a.user_id, {SyncRepo._LABEL_SQL}
+                    FROM event_role_assignments a
+                    JOIN users u ON u.id = a.user_id
+                    LEFT JOIN user_display_names dn ON dn.user_id = a.user_id AND dn.group_id = ?
+                    WHERE a.event_id IN ({marks})
+                    ORDER BY a.event_id, a.id
+                    """,
+                    (group_id, *chunk),
+                )
+                assigns.extend(cur.fetchall())
+                cur.execute(
+                    f"""
+                    SELECT b.event_id, b.user_id, {SyncRepo._LABEL_SQL}
+                    FROM bookings b
+                    JOIN users u ON u.id = b.user_id
+                    LEFT JOIN user_display_names dn ON dn.user_id = b.user_id AND dn.group_id = ?
+                    WHERE b.event_id IN ({marks})
+                    ORDER BY b.event_id, b.id
+                    """,
+                    (group_id, *chunk),
+                )
+                bookings.extend(cur.fetchall())
+        return events, reqs, assigns, bookings
+
+    @staticmethod
+    def members(group_id: int) -> List[Tuple[int, str, str]]:
+        """Confirmed members as (user_id, role, label)."""
+        with get_conn(group_id) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""
+                SELECT r.user_id, r.role, {SyncRepo._LABEL_SQL}
+                FROM user_group_roles r
+                JOIN users u ON u.id = r.user_id
+                LEFT JOIN user_display_names dn ON dn.user_id = r.user_id AND dn.group_id = r.group_id
+                WHERE r.group_id = ? AND r.confirmed = 1
+                ORDER BY r.user_id
+                """,
+                (group_id,),
+            )
+            return cur.fetchall()
+
+
+class CalendarRepo:
+    """
+    Выборки для ICS-календарей: постранично по (time, id), чтобы стримить ответ без длинных соединений.
+    Читают основную базу, а не снимок: ETag строится по живой версии, и тело из устаревшего снимка
+    закэшировалось бы у клиента под новым ETag до следующего изменения.
+    """
+
+    @staticmethod
+    def group_page(group_id: int, from_iso: str, to_iso: str, after: Optional[Tuple[str, int]] = None, limit: int = 500) -> List[Tuple]:
+        """Returns (id, name, time, assignments) where assignments is 'role: user_id' joined by '\n'."""
+        a_time, a_id = after if after is not None else ('', 0)
+        with get_conn(group_id) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                SELECT e.id, e.name, e.time,
+                       (SELECT GROUP_CONCAT(a.role_name || ': ' || COALESCE(dn.display_name, '@' || u.username, u.first_name, u.telegram_id), char(10))
+                        FROM event_role_assignments a
+                        JOIN users u ON u.id = a.user_id
+                        LEFT JOIN user_display_names dn ON dn.user_id = a.user_id AND dn.group_id = e.group_id
+                        WHERE a.event_id = e.id)
+                FROM events e
+                WHERE e.group_id = ? AND e.time >= ? AND e.time < ? AND (e.time > ? OR (e.time = ? AND e.id > ?))
+                ORDER BY e.time, e.id
+                LIMIT ?
+                """,
+                (group_id, from_iso, to_iso, a_time, a_time, a_id, limit),
+            )
+            return cur.fetchall()
+
+    @staticmethod
+    def user_page(user_id: int, from_iso: str, to_iso: str, after: Optional[Tuple[str, int]] = None, limit: int = 500) -> List[Tuple]:
+        """Events the user booked a role in. Returns (id, name, time, group_title, roles joined by ', ')."""
+        a_time, a_id = after if after is not None else ('', 0)
+        rows = []
+        for shard in shard_ids():
+            with get_conn(shard=shard) as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    """
+                    SELECT e.id, e.name, e.time, g.title, GROUP_CONCAT(a.role_name, ', ')
+                    FROM event_role_assignments a
+                    JOIN events e ON e.id = a.event_id
+                    JOIN groups g ON g.id = e.group_id
+                    WHERE a.user_id = ? AND e.time >= ? AND e.time < ? AND (e.time > ? OR (e.time = ? AND e.id > ?))
+                    GROUP BY e.id
+                    ORDER BY e.time, e.id
+                    LIMIT ?
+                    """,
+                    (user_id, from_iso, to_iso, a_time, a_time, a_id, limit),
+                )
+                rows.extend(cur.fetchall())
+        # По странице из каждого шарда — общая страница по (time, id)
+        rows.sort(key=lambda r: (r[2], r[0]))
+        return rows[:limit]
+
+
+class EventArchiveRepo:
+    """Чтение холодного архива мероприятий (events_archive и *_archive, заполняет services/event_archive.py)."""
+
+    @staticmethod
+    def count_for_group(group_id: int) -> int:
+        with get_conn(group_id) as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT COUNT(*) FROM events_archive WHERE group_id = ?", (group_id,))
+            return cur.fetchone()[0]
+
+    @staticmethod
+    def list_for_group(group_id: int, offset: int = 0, limit: int = 50) -> List[Tuple]:
+        """Ordered by time asc. Returns (id, name, time, responsible_user_id, created_by_user_id, created_at, updated_by_user_id, updated_at)."""
+        with get_conn(group_id) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                SELECT id, name, time, responsible_user_id, created_by_user_id, created_at, updated_by_user_id, updated_at
+                FROM events_archive
+                WHERE group_id = ?
+                ORDER BY time, id
+                LIMIT ? OFFSET ?
+                """,
+                (group_id, limit, offset),
+            )
+            return cur.fetchall()
+
+    @staticmethod
+    def roles_for_events(event_ids: List[int]) -> Tuple[dict, dict]:
+        """({event_id: [(role_name, required)]}, {event_id: [(role_name, user_id)]}) for archived events."""
+        requirements: dict = {}
+        assignments: dict = {}
+        if not event_ids:
+            return requirements, assignments
+        marks = ','.join('?' * len(event_ids))
+        with get_conn(event_id=event_ids[0]) as conn:
+            cur = conn.cursor()
+            cur.execute(f"SELECT event_id, role_name, required FROM event_role_requirements_archive WHERE event_id IN ({marks}) "
+                        f"ORDER BY event_id, role_name", event_ids)
+            for eid, role_name, required in cur.fetchall():
+                requirements.setdefault(eid, []).append((role_name, required))
+            cur.execute(f"SELECT event_id, role_name, user_id FROM event_role_assignments_archive WHERE event_id IN ({marks}) "
+                        f"ORDER BY event_id, role_name, user_id", event_ids)
+            for eid, role_name, user_id in cur.fetchall():
+                assignments.setdefault(eid, []).append((role_name, user_id))
+        return requirements, assignments
+
+
+class AnalyticsRepo:
+    """
+    Аналитика группы: всё считает SQLite (GROUP BY по диапазону (group_id, time)) — по живым и архивным
+    мероприятиям через представления *_all.
+    Дневные итоги без фильтра по пользователю и с границами по целым дням берутся из group_daily_stats.
+    Границы: time_from включительно, time_to исключительно ('YYYY-MM-DD' или 'YYYY-MM-DD HH:MM').
+    """
+
+    # Как и раньше, мероприятия с неразбираемым временем в отчет не попадают
+    _TIME_OK = "e.time GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9] [0-9][0-9]:[0-9][0-9]*'"
+
+    @staticmethod
+    def _event_filter(group_id: int, time_from: Optional[str], time_to: Optional[str],
+                      user_id: Optional[int]) -> Tuple[str, list]:
+        where = ["e.group_id = ?", AnalyticsRepo._TIME_OK]
+        params: list = [group_id]
+        if time_from:
+            where.append("e.time >= ?")
+            params.append(time_from)
+        if time_to:
+            where.append("e.time < ?")
+            params.append(time_to)
+        if user_id:
+            where.append("(e.responsible_user_id = ? OR EXISTS (SELECT 1 FROM bookings_all b WHERE b.event_id = e.id AND b.user_id = ?))")
+            params += [user_id, user_id]
+        return " AND ".join(where), params
+
+    @staticmethod
+    def summary(group_id: int, time_from: Optional[str] = None, time_to: Optional[str] = None,
+                user_id: Optional[int] = None) -> dict:
+        """Returns {'daily': [(day, events)], 'user_bookings': [(label, n)], 'free_roles': [(role, n)], 'stats': {...}}."""
+        where, params = AnalyticsRepo._event_filter(group_id, time_from, time_to, user_id)
+        use_rollup = not user_id and all(b is None or len(b) == 10 for b in (time_from, time_to))
+        with get_read_conn(group_id) as conn:
+            cur = conn.cursor()
+            if use_rollup:
+                cur.execute(
+                    """
+                    SELECT day, events_count, bookings_count, free_slots
+                    FROM group_daily_stats
+                    WHERE group_id = ? AND day >= ? AND day < ? AND events_count > 0
+                    ORDER BY day
+                    """,
+                    (group_id, time_from or '', time_to or '~'),
+                )
+                rows = cur.fetchall()
+                daily = [(day, events) for day, events, _, _ in rows]
+                total_bookings = sum(r[2] for r in rows)
+                total_free = sum(r[3] for r in rows)
+            else:
+                cur.execute(
+                    f"SELECT substr(e.time, 1, 10) AS day, COUNT(*) FROM events_all e WHERE {where} GROUP BY day ORDER BY day",
+                    params,
+                )
+                daily = cur.fetchall()
+                total_bookings = total_free = None
+
+            cur.execute(f"SELECT COUNT(DISTINCT NULLIF(e.responsible_user_id, 0)) FROM events_all e WHERE {where}", params)
+            unique_responsibles = cur.fetchone()[0]
+
+            cur.execute(
+                f"""
+                SELECT COALESCE(NULLIF(dn.display_name, ''), '@' || NULLIF(u.username, ''), CAST(u.id AS TEXT)) AS label,
+                       COUNT(*) AS cnt
+                FROM events_all e
+                JOIN event_role_assignments_all a ON a.event_id = e.id
+                JOIN users u ON u.id = a.user_id
+                LEFT JOIN user_display_names dn ON dn.group_id = e.group_id AND dn.user_id = a.user_id
+                WHERE {where}
+                GROUP BY label
+                ORDER BY cnt DESC, label
+                """,
+                params,
+            )
+            user_bookings = cur.fetchall()
+
+            cur.execute(
+                f"""
+                SELECT r.role_name,
+                       SUM(MAX(0, r.required - (SELECT COUNT(*) FROM event_role_assignments_all a
+                                                WHERE a.event_id = r.event_id AND a.role_name = r.role_name))) AS free
+                FROM events_all e
+                JOIN event_role_requirements_all r ON r.event_id = e.id
+                WHERE {where}
+                GROUP BY r.role_name
+                HAVING free > 0
+                ORDER BY free DESC, r.role_name
+                """,
+                params,
+            )
+            free_roles = cur.fetchall()
+
+        return {
+            'daily': daily,
+            'user_bookings': user_bookings,
+            'free_roles': free_roles,
+            'stats': {
+                'events_total': sum(n for _, n in daily),
+                'unique_responsibles': unique_responsibles,
+                'total_bookings': total_bookings if total_bookings is not None else sum(n for _, n in user_bookings),
+                'total_free_roles': total_free if total_free is not None else sum(n for _, n in free_roles),
+            },
+        }
+
+
+AUDIT_COUNT_TTL = 300
+
+
 class AuditLogRepo:
     @staticmethod
     def add(action: str, *, user_id: Optional[int] = None, group_id: Optional[int] = None, event_id: Optional[int] = None, old_value: Optional[str] = None, new_value: Optional[str] = None) -> None:
@@ -1599,28 +2395,105 @@ class AuditLogRepo:
             )
             conn.commit()
 
+    # Кэш общего числа строк по фильтру: (count, max_id, посчитано_в). Новые строки досчитываются по id > max_id,
+    # полный пересчет — раз в AUDIT_COUNT_TTL (удаления в других процессах)
+    _count_cache: dict = {}
+    _count_lock = threading.Lock()
+
     @staticmethod
-    def list(page: int = 1, per_page: int = 50, *, group_id: Optional[int] = None, event_id: Optional[int] = None) -> List[Tuple]:
-        offset = max(0, (int(page or 1) - 1) * int(per_page or 50))
-        with get_conn() as conn:
+    def _filter(group_id: Optional[int], event_id: Optional[int]) -> Tuple[List[str], List]:
+        where, params = [], []
+        if group_id:
+            where.append("a.group_id = ?")
+            params.append(group_id)
+        if event_id:
+            where.append("a.event_id = ?")
+            params.append(event_id)
+        return where, params
+
+    @staticmethod
+    def list_page(*, group_id: Optional[int] = None, event_id: Optional[int] = None, before_id: Optional[int] = None,
+                  after_id: Optional[int] = None, limit: int = 50) -> Tuple[List[Tuple], bool, bool]:
+        """
+        Keyset page, newest first: before_id — older than the cursor, after_id — newer than it, neither — first page.
+        Rows: (id, created_at, user_id, action, group_id, event_id, old_value, new_value,
+               telegram_id, username, first_name, last_name, group_title, event_name).
+        Returns (rows, has_newer, has_older).
+        """
+        limit = max(1, int(limit or 50))
+        where, params = AuditLogRepo._filter(group_id, event_id)
+        if after_id is not None:
+            where.append("a.id > ?")
+            params.append(after_id)
+            order = "ASC"
+        else:
+            if before_id is not None:
+                where.append("a.id < ?")
+                params.append(before_id)
+            order = "DESC"
+        # Первая страница — из основной базы (свежие действия видны сразу), более старые — из снимка
+        with (get_read_conn() if before_id is not None else get_conn()) as conn:
             cur = conn.cursor()
-            base = "SELECT id, created_at, user_id, action, group_id, event_id, old_value, new_value FROM audit_log"
-            where = []
-            params: List = []
-            if group_id:
-                where.append("group_id = ?")
-                params.append(group_id)
-            if event_id:
-                where.append("event_id = ?")
-                params.append(event_id)
-            sql = base + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY id DESC LIMIT ? OFFSET ?"
-            params.extend([per_page, offset])
-            cur.execute(sql, tuple(params))
+            cur.execute(
+                f"""
+                SELECT a.id, a.created_at, a.user_id, a.action, a.group_id, a.event_id, a.old_value, a.new_value,
+                       u.telegram_id, u.username, u.first_name, u.last_name, g.title, e.name
+                FROM audit_log a
+                LEFT JOIN users u ON u.id = a.user_id
+                LEFT JOIN groups g ON g.id = a.group_id
+                LEFT JOIN events e ON e.id = a.event_id
+                {"WHERE " + " AND ".join(where) if where else ""}
+                ORDER BY a.id {order}
+                LIMIT ?
+                """,
+                (*params, limit + 1),
+            )
             rows = cur.fetchall()
-            # total count
-            cur.execute("SELECT COUNT(*) FROM audit_log" + (" WHERE " + " AND ".join(where) if where else ""), tuple(params[:-2]))
-            total = cur.fetchone()[0]
-            return rows, total
+            more = len(rows) > limit
+            rows = with_event_names(rows[:limit], 5, 13)
+            if after_id is not None:
+                rows.reverse()
+                return rows, more, True
+            has_newer = False
+            if before_id is not None and rows:
+                # Курсор мог указывать на удаленную строку — проверяем, есть ли что-то новее
+                fw, fp = AuditLogRepo._filter(group_id, event_id)
+                cur.execute("SELECT 1 FROM audit_log a WHERE " + " AND ".join(fw + ["a.id > ?"]) + " LIMIT 1",
+                            (*fp, rows[0][0]))
+                has_newer = cur.fetchone() is not None
+            return rows, has_newer, more
+
+    @staticmethod
+    def count(*, group_id: Optional[int] = None, event_id: Optional[int] = None) -> int:
+        """Total rows for the filter; cached, only rows appended since the last call are counted."""
+        key = (group_id or None, event_id or None)
+        now = time.monotonic()
+        with AuditLogRepo._count_lock:
+            cached = AuditLogRepo._count_cache.get(key)
+        if cached and now - cached[2] > AUDIT_COUNT_TTL:
+            cached = None
+        where, params = AuditLogRepo._filter(group_id, event_id)
+        with get_conn() as conn:
+            cur = conn.cursor()
+            if cached:
+                total, max_id, counted_at = cached
+                cur.execute("SELECT COUNT(*), MAX(a.id) FROM audit_log a WHERE " + " AND ".join(where + ["a.id > ?"]),
+                            (*params, max_id))
+                added, new_max = cur.fetchone()
+                entry = (total + added, new_max or max_id, counted_at)
+            else:
+                cur.execute("SELECT COUNT(*), COALESCE(MAX(a.id), 0) FROM audit_log a" + (" WHERE " + " AND ".join(where) if where else ""),
+                            params)
+                total, max_id = cur.fetchone()
+                entry = (total, max_id, now)
+        with AuditLogRepo._count_lock:
+            AuditLogRepo._count_cache[key] = entry
+        return entry[0]
+
+    @staticmethod
+    def invalidate_count() -> None:
+        with AuditLogRepo._count_lock:
+            AuditLogRepo._count_cache.clear()
 
     @staticmethod
     def delete(audit_id: int) -> bool:
@@ -1628,11 +2501,12 @@ class AuditLogRepo:
             cur = conn.cursor()
             cur.execute("DELETE FROM audit_log WHERE id = ?", (audit_id,))
             conn.commit()
-            return cur.rowcount > 0
+        AuditLogRepo.invalidate_count()
+        return cur.rowcount > 0
 
     @staticmethod
     def replace_all(group_id: int, items: List[Tuple[str, int]]) -> None:
-        with get_conn() as conn:
+        with get_conn(group_id) as conn:
             cur = conn.cursor()
             cur.execute("DELETE FROM group_role_templates WHERE group_id = ?", (group_id,))
             for role_name, required in items:
@@ -1640,162 +2514,235 @@ class AuditLogRepo:
                     cur.execute("INSERT INTO group_role_templates (group_id, role_name, required) VALUES (?,?,?)", (group_id, role_name.strip(), int(required)))
             conn.commit()
 
+# Ленивые шаблоны: событие создается заранее хотя бы за сутки (и не позже самого раннего оповещения группы)
+LAZY_MIN_LEAD = timedelta(days=1)
+# Запас на период фонового задания материализации (оно запускается раз в час)
+LAZY_JOB_MARGIN = timedelta(hours=2)
+
+_UNIT_DELTAS = {
+    'minutes': timedelta(minutes=1),
+    'hours': timedelta(hours=1),
+    'days': timedelta(days=1),
+    'weeks': timedelta(weeks=1),
+    'months': timedelta(days=30),
+}
+
+
 class TemplateGenerator:
     @staticmethod
-    def _parse_weekdays(s: Optional[str]) -> List[int]:
-        if not s:
-            return []
-        map_wd = {
-            'MO': 0, 'TU': 1, 'WE': 2, 'TH': 3, 'FR': 4, 'SA': 5, 'SU': 6
-        }
-        result: List[int] = []
-        for part in s.split(','):
-            part = part.strip().upper()
-            if part in map_wd:
-                result.append(map_wd[part])
-        return result
+    def _horizon_end(tpl: Tuple, now_cmp: datetime) -> Optional[datetime]:
+        """Rolling horizon: planning_horizon_days counted from max(base_time, now)."""
+        from services.recurrence import parse_datetime
+
+        base_dt = parse_datetime(tpl[5])
+        if base_dt is None:
+            return None
+        return max(base_dt, now_cmp) + timedelta(days=int(tpl[7] or 60))
 
     @staticmethod
-    def _daterange(start: datetime, end: datetime, step_days: int):
-        cur = start
-        while cur <= end:
-            yield cur
-            cur += timedelta(days=step_days)
+    def _lazy_lead(group_id: int) -> timedelta:
+        """How far ahead a lazy template must have real events: the longest group notification lead."""
+        lead = LAZY_MIN_LEAD
+        with get_conn(group_id) as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT time_before, time_unit FROM notification_settings WHERE group_id = ? AND type = 'group'", (group_id,))
+            for time_before, time_unit in cur.fetchall():
+                unit = _UNIT_DELTAS.get(time_unit)
+                if unit is not None and time_before:
+                    lead = max(lead, unit * int(time_before))
+        return lead + LAZY_JOB_MARGIN
 
     @staticmethod
-    def generate_for_template(template_id: int, created_by_user_id: Optional[int] = None) -> int:
-        """Generate events from template within its planning_horizon_days. Returns number of created events."""
-        from datetime import datetime
-        created = 0
+    def _occurrence_keys(tpl: Tuple, now_cmp: datetime, after_key: Optional[str] = None) -> List[str]:
+        """Occurrence keys ('YYYY-MM-DD HH:MM', ascending) of a template that should exist as real events.
+
+        Eager templates: up to the rolling horizon. Lazy templates ('materialize_mode' = 'lazy'):
+        only up to the notification lead time, the rest stays virtual.
+        With after_key only occurrences after that key are produced; the recurrence engine
+        jumps straight to that period, so extending a long series costs only the new occurrences.
+        """
+        from services.recurrence import occurrences, parse_datetime
+
+        horizon_end = TemplateGenerator._horizon_end(tpl, now_cmp)
+        if horizon_end is None:
+            return []
+        if TemplateGenerator._is_lazy(tpl):
+            horizon_end = min(horizon_end, now_cmp + TemplateGenerator._lazy_lead(tpl[1]))
+
+        start = now_cmp
+        after_dt = parse_datetime(after_key) if after_key else None
+        if after_dt is not None and after_dt >= start:
+            start = after_dt + timedelta(minutes=1)
+
+        return [occ.strftime('%Y-%m-%d %H:%M') for occ in occurrences(tpl, start, horizon_end)]
+
+    @staticmethod
+    def _is_lazy(tpl: Tuple) -> bool:
+        # materialize_mode is appended by a migration, so it is the column after created_at
+        return len(tpl) > 18 and tpl[18] == 'lazy'
+
+    @staticmethod
+    def _insert_occurrences(template_id: int, tpl: Tuple, keys: List[str], created_by_user_id: Optional[int] = None) -> Tuple[dict, dict]:
+        """Create events for not yet generated keys in one transaction. Returns ({key: event_id}, row counts)."""
+        group_id, name = tpl[1], tpl[2]
+        with get_conn(group_id) as conn:
+            cur = conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            cur.execute("SELECT occurrence_key FROM template_generated_events WHERE template_id = ? AND occurrence_key >= ?",
+                        (template_id, keys[0]))
+            existing = {row[0] for row in cur.fetchall()}
+            new_keys = [k for k in keys if k not in existing]
+            if not new_keys:
+                conn.rollback()
+                return {}, {'events': 0, 'notifications': 0, 'role_requirements': 0}
+            cur.execute("SELECT role_name, required FROM template_role_requirements WHERE template_id = ?", (template_id,))
+            role_reqs = cur.fetchall()
+            event_ids, counts = _bulk_create_events(cur, group_id, [(name, k) for k in new_keys],
+                                                    created_by_user_id=created_by_user_id, role_requirements=role_reqs)
+            cur.executemany(
+                "INSERT OR IGNORE INTO template_generated_events (template_id, occurrence_key, event_id) VALUES (?,?,?)",
+                [(template_id, k, eid) for k, eid in zip(new_keys, event_ids)]
+            )
+            conn.commit()
+        return dict(zip(new_keys, event_ids)), counts
+
+    @staticmethod
+    def generate_for_template(template_id: int, created_by_user_id: Optional[int] = None, resume: bool = False) -> int:
+        """Generate events from template within its planning_horizon_days. Returns number of created events.
+
+        All occurrences are written in one transaction: keys already generated are fetched with a single
+        query, events and their notifications/role requirements/links are inserted with executemany.
+        resume=True continues after the last generated occurrence_key (used by the background job;
+        after a template edit the full walk is needed, so the web handlers keep the default).
+        Lazy templates always walk [now, now + lead]: a far-future occurrence opened by materialize()
+        would otherwise move the last key past the lead and the near-term events would never be created.
+        """
+        import time as _time
+        started = _time.perf_counter()
         tpl = EventTemplateRepo.get(template_id)
         if not tpl:
             return 0
-        (
-            _id, group_id, name, description, kind, base_time, timezone,
-            planning_horizon_days, allow_multi_roles_per_user, freq, interval,
-            byweekday, bymonthday, bysetpos, until, count, exceptions_json,
-            *_
-        ) = tpl
 
-        # Time window: horizon counted from the base event date
-        now_naive = datetime.now()
+        after_key = TemplateGenerationRepo.last_key(template_id) if resume and not TemplateGenerator._is_lazy(tpl) else None
+        keys = TemplateGenerator._occurrence_keys(tpl, datetime.now(), after_key=after_key)
+        if not keys:
+            return 0
+        created, counts = TemplateGenerator._insert_occurrences(template_id, tpl, keys, created_by_user_id)
 
-        # Base start time
-        try:
-            base_dt = datetime.strptime(base_time, '%Y-%m-%d %H:%M')
-        except Exception:
-            try:
-                base_dt = datetime.fromisoformat(base_time.replace('Z', ''))
-            except Exception:
-                return 0
+        elapsed_ms = (_time.perf_counter() - started) * 1000
+        print(f"[TEMPLATE_GEN] template={template_id} events={counts['events']} notifications={counts['notifications']} "
+              f"role_reqs={counts['role_requirements']} skipped={len(keys) - len(created)} in {elapsed_ms:.1f} ms")
+        return len(created)
 
-        # Apply template timezone if available (treat base_time as wall-clock in that tz)
-        try:
-            from zoneinfo import ZoneInfo  # Python 3.9+
-            tzinfo = ZoneInfo(timezone) if timezone else None
-        except Exception:
-            tzinfo = None
-        if tzinfo is not None and base_dt.tzinfo is None:
-            base_dt = base_dt.replace(tzinfo=tzinfo)
-
-        # Use naive "now" for wall-clock comparisons
-        now_cmp = now_naive
-
-        # Horizon end relative to base date
-        horizon_end = base_dt + timedelta(days=int(planning_horizon_days or 60))
-
-        # Exceptions set (YYYY-MM-DD)
-        exc_dates = set()
-        if exceptions_json:
+    @staticmethod
+    def extend_recurring() -> int:
+        """Extend every recurring template up to now + planning_horizon_days (lazy ones up to the lead time).
+        Returns number of created events."""
+        created = 0
+        for template_id in EventTemplateRepo.list_recurring():
             try:
-                import json
-                items = json.loads(exceptions_json)
-                for it in items:
-                    if isinstance(it, str):
-                        exc_dates.add(it)
-            except Exception:
-                pass
-
-        # Helper to create one occurrence
-        def ensure_occurrence(start_dt: datetime):
-            nonlocal created
-            # Compare and store as naive wall-clock time
-            cmp_dt = start_dt.replace(tzinfo=None) if start_dt.tzinfo is not None else start_dt
-            if cmp_dt < now_cmp:
-                return
-            key = cmp_dt.strftime('%Y-%m-%d %H:%M')
-            if TemplateGenerationRepo.was_generated(template_id, key):
+                created += TemplateGenerator.generate_for_template(template_id, resume=True)
+            except Exception as e:
+                print(f"[TEMPLATE_GEN] failed to extend template={template_id}: {e}")
+        return created
+
+    @staticmethod
+    def materialize(template_id: int, occurrence_key: str, created_by_user_id: Optional[int] = None) -> Optional[int]:
+        """Turn a virtual occurrence into a real event (idempotent). Returns event id or None if the key is not an occurrence."""
+        from services.recurrence import occurrences, parse_datetime
+
+        existing = TemplateGenerationRepo.was_generated(template_id, occurrence_key)
+        if existing:
+            return existing if EventRepo.get_by_id(existing) else None
+        tpl = EventTemplateRepo.get(template_id)
+        occ_dt = parse_datetime(occurrence_key)
+        if not tpl or occ_dt is None:
+            return None
+        # Only real, not yet passed occurrences of the rule within the horizon may be created
+        now = datetime.now().replace(second=0, microsecond=0)
+        horizon_end = TemplateGenerator._horizon_end(tpl, now)
+        if horizon_end is None or occ_dt < now or occ_dt > horizon_end or occ_dt not in occurrences(tpl, occ_dt, occ_dt):
+            return None
+        key = occ_dt.strftime('%Y-%m-%d %H:%M')
+        created, _counts = TemplateGenerator._insert_occurrences(template_id, tpl, [key], created_by_user_id)
+        print(f"[TEMPLATE_GEN] materialized template={template_id} occurrence={key}")
+        return created.get(key) or TemplateGenerationRepo.was_generated(template_id, key)
+
+    @staticmethod
+    def virtual_occurrences(group_id: int, from_key: str, *, after: Optional[Tuple[str, int]] = None,
+                            until: Optional[Tuple[str, int]] = None, limit: Optional[int] = None) -> List[Tuple]:
+        """
+        Not yet materialized occurrences of the group's lazy templates, in the same shape as event rows:
+        (-template_id, name, occurrence_key, None), ordered by (time, id) like EventRepo.list_upcoming_page.
+        after/until are exclusive (time, id) bounds; limit keeps only the first rows.
+        """
+        import heapq
+        from itertools import islice
+        from services.recurrence import occurrences, parse_datetime
+
+        templates = EventTemplateRepo.list_lazy_by_group(group_id)
+        if not templates:
+            return []
+        now_cmp = datetime.now()
+        start_dt = parse_datetime(from_key) or now_cmp
+        if after is not None:
+            start_dt = max(start_dt, parse_datetime(after[0]) or start_dt)
+        generated = TemplateGenerator._generated_since(group_id, templates, start_dt)
+
+        def rows_for(tpl):
+            tid, name = tpl[0], tpl[2]
+            end_dt = TemplateGenerator._horizon_end(tpl, now_cmp)
+            if end_dt is None:
                 return
-            event_id = EventRepo.create(group_id, name, key, created_by_user_id=created_by_user_id)
-            # create default group notifications for the event
-            try:
-                EventNotificationRepo.create_from_group_defaults(event_id, group_id)
-            except Exception:
-                pass
-            # copy role requirements
-            for role_name, required in TemplateRoleRequirementRepo.list(template_id):
-                EventRoleRequirementRepo.set_for_event(event_id, role_name, required)
-            TemplateGenerationRepo.mark_generated(template_id, key, event_id)
-            created += 1
-
-        if kind == 'one_time' or not freq:
-            ensure_occurrence(base_dt)
-            return created
-
-        freq = (freq or '').lower()
-        interval = int(interval or 1)
-
-        if freq == 'daily':
-            start_date = base_dt
-            for day_dt in TemplateGenerator._daterange(start_date, horizon_end, interval):
-                if day_dt.strftime('%Y-%m-%d') in exc_dates:
+            if until is not None:
+                end_dt = min(end_dt, parse_datetime(until[0]) or end_dt)
+            for occ in occurrences(tpl, start_dt, end_dt):
+                key = occ.strftime('%Y-%m-%d %H:%M')
+                if (tid, key) in generated:
                     continue
-                # keep base hour/minute
-                occ = day_dt.replace(hour=base_dt.hour, minute=base_dt.minute, second=0, microsecond=0)
-                ensure_occurrence(occ)
-
-        elif freq == 'weekly':
-            # Generate strictly from the first event date every N weeks, ignoring byweekday
-            cur_dt = base_dt
-            while cur_dt <= horizon_end:
-                if cur_dt.strftime('%Y-%m-%d') not in exc_dates:
-                    ensure_occurrence(cur_dt.replace())
-                cur_dt += timedelta(weeks=interval)
-
-        elif freq == 'monthly':
-            # bymonthday like '1,15,-1'
-            days = []
-            if bymonthday:
-                for token in bymonthday.split(','):
-                    token = token.strip()
-                    try:
-                        days.append(int(token))
-                    except Exception:
-                        pass
-            if not days:
-                days = [base_dt.day]
-
-            cur = base_dt
-            while cur <= horizon_end:
-                y, m = cur.year, cur.month
-                from calendar import monthrange
-                last_day = monthrange(y, m)[1]
-                for d in days:
-                    if d < 0:
-                        day = last_day + 1 + d  # -1 => last day
-                    else:
-                        day = d
-                    if day < 1 or day > last_day:
-                        continue
-                    occ = cur.replace(day=day, hour=base_dt.hour, minute=base_dt.minute)
-                    if occ.strftime('%Y-%m-%d') in exc_dates:
-                        continue
-                    ensure_occurrence(occ)
-                # add interval months
-                nm = m + interval
-                y += (nm - 1) // 12
-                m = ((nm - 1) % 12) + 1
-                cur = cur.replace(year=y, month=m)
+                row = (-tid, name, key, None)
+                if after is not None and (key, -tid) <= (after[0], after[1]):
+                    continue
+                if until is not None and (key, -tid) >= (until[0], until[1]):
+                    return
+                yield row
 
-        return created
+        merged = heapq.merge(*(rows_for(t) for t in templates), key=lambda r: (r[2], r[0]))
+        return list(islice(merged, limit) if limit is not None else merged)
 
+    @staticmethod
+    def count_virtual_occurrences(group_id: int, from_key: str) -> int:
+        """
+        Number of rows virtual_occurrences(group_id, from_key) returns, without building or merging them:
+        per template, occurrences up to its horizon minus the already materialized ones.
+        """
+        from services.recurrence import occurrences, parse_datetime
+
+        templates = EventTemplateRepo.list_lazy_by_group(group_id)
+        if not templates:
+            return 0
+        now_cmp = datetime.now()
+        start_dt = parse_datetime(from_key) or now_cmp
+        generated = {}
+        for tid, key in TemplateGenerator._generated_since(group_id, templates, start_dt):
+            generated.setdefault(tid, set()).add(parse_datetime(key))
+        total = 0
+        for tpl in templates:
+            end_dt = TemplateGenerator._horizon_end(tpl, now_cmp)
+            if end_dt is None:
+                continue
+            skip = generated.get(tpl[0], ())
+            total += sum(1 for occ in occurrences(tpl, start_dt, end_dt) if occ.replace(second=0) not in skip)
+        return total
+
+    @staticmethod
+    def _generated_since(group_id: int, templates: List[Tuple], start_dt: datetime) -> set:
+        """(template_id, occurrence_key) of the templates' occurrences materialized at or after start_dt."""
+        with get_conn(group_id) as conn:
+            cur = conn.cursor()
+            placeholders = ','.join('?' for _ in templates)
+            cur.execute(
+                f"SELECT template_id, occurrence_key FROM template_generated_events WHERE template_id IN ({placeholders}) AND occurrence_key >= ?",
+                tuple(t[0] for t in templates) + (start_dt.strftime('%Y-%m-%d %H:%M'),)
+            )
+            return set(cur.fetchall())
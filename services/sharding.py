@@ -0,0 +1,341 @@
+"""
+Шардирование базы по группам: включается DB_SHARDS > 0, по умолчанию выключено (одна база data/bot_v2.db).
+
+Все группы в одном файле делят одну блокировку записи — шторм бронирований в большой группе задерживает
+напоминания остальных. При DB_SHARDS = N:
+- глобальная база (DB_PATH) — пользователи, группы, роли участников, приглашения, FAQ, журнал аудита,
+  личные настройки оповещений и карта group_shards;
+- шарды data/shards/shard_K.db — полная схема; в них живут мероприятия, записи, оповещения, шаблоны,
+  версии и агрегаты групп шарда, а также копии users, своих groups и user_group_roles (нужны FK-каскадам
+  и JOIN'ам). Копии обновляет repositories.sync_replicas после каждой записи в глобальную базу.
+
+Маршрутизация — repositories.get_conn(group_id | event_id= | template_id= | shard=):
+группа закрепляется за шардом group_id % N при первом обращении и дальше читается из group_shards.
+AUTOINCREMENT в шарде K начинается с (K + 1) * ID_RANGE, поэтому шард мероприятия или шаблона
+определяется по самому id; id, созданные до разбиения, записаны в shard_legacy_ids.
+
+Число шардов можно увеличить (новые шарды создаются пустыми, новые группы распределяются по всем),
+но не уменьшить: существующие группы закреплены за своими шардами и не переносятся.
+
+CLI: python -m services.sharding split --shards N   — разбить существующую базу (бот и веб остановлены)
+     python -m services.sharding status
+"""
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+DB_SHARDS = int(os.getenv('DB_SHARDS', '0'))
+SHARDS_DIR = Path(os.getenv('SHARDS_DIR') or (BASE_DIR / 'data' / 'shards'))
+# Диапазон id одного шарда: 10^12 строк на шард, id остаются меньше 2^53 (безопасны для JS) до 9000 шардов
+ID_RANGE = 10 ** 12
+LEGACY_CACHE_SIZE = 100_000
+
+# Таблицы, строки которых приходят в обработчики только по id (callback'и, формы) — их шард ищется по id
+ROUTED_ID_TABLES = ('events', 'event_templates', 'notification_settings', 'event_notifications',
+                    'personal_event_notifications')
+# Глобальные таблицы, копии которых лежат в шардах
+REPLICA_TABLES = ('users', 'groups', 'user_group_roles')
+
+# Данные групп в порядке FK. {g} — подзапрос со списком групп шарда
+_GROUP_TABLES: List[Tuple[str, str]] = [
+    ('notification_settings', "group_id IN {g}"),
+    ('events', "group_id IN {g}"),
+    ('event_notifications', "event_id IN (SELECT id FROM events WHERE group_id IN {g})"),
+    ('personal_event_notifications', "event_id IN (SELECT id FROM events WHERE group_id IN {g})"),
+    ('notification_dispatch_log', "event_id IN (SELECT id FROM events WHERE group_id IN {g})"),
+    ('bookings', "event_id IN (SELECT id FROM events WHERE group_id IN {g})"),
+    ('user_display_names', "group_id IN {g}"),
+    ('event_templates', "group_id IN {g}"),
+    ('template_role_requirements', "template_id IN (SELECT id FROM event_templates WHERE group_id IN {g})"),
+    ('group_roles', "group_id IN {g}"),
+    ('group_role_templates', "group_id IN {g}"),
+    ('event_role_requirements', "event_id IN (SELECT id FROM events WHERE group_id IN {g})"),
+    ('event_role_assignments', "event_id IN (SELECT id FROM events WHERE group_id IN {g})"),
+    ('template_generated_events', "template_id IN (SELECT id FROM event_templates WHERE group_id IN {g})"),
+    ('events_archive', "group_id IN {g}"),
+    ('event_role_requirements_archive', "event_id IN (SELECT id FROM events_archive WHERE group_id IN {g})"),
+    ('event_role_assignments_archive', "event_id IN (SELECT id FROM events_archive WHERE group_id IN {g})"),
+    ('bookings_archive', "event_id IN (SELECT id FROM events_archive WHERE group_id IN {g})"),
+]
+# Таблицы, которые ведут триггеры: при копировании триггеры шарда их заполняют заново — значения переносятся
+# из глобальной базы поверх (версии, которые уже видели клиенты delta-sync, и вклад архива в агрегаты)
+_TRIGGER_TABLES: List[Tuple[str, str]] = [
+    ('group_data_versions', "group_id IN {g}"),
+    ('event_versions', "group_id IN {g}"),
+    ('group_daily_stats', "group_id IN {g}"),
+]
+_LEGACY_SOURCES: List[Tuple[str, str, str]] = [
+    ('events', 'events', "group_id IN {g}"),
+    ('events', 'events_archive', "group_id IN {g}"),
+    ('event_templates', 'event_templates', "group_id IN {g}"),
+    ('notification_settings', 'notification_settings', "group_id IN {g}"),
+    ('event_notifications', 'event_notifications', "event_id IN (SELECT id FROM events WHERE group_id IN {g})"),
+    ('personal_event_notifications', 'personal_event_notifications', "event_id IN (SELECT id FROM events WHERE group_id IN {g})"),
+]
+
+_group_shards: Dict[int, int] = {}
+_legacy_shards: Dict[Tuple[str, int], Optional[int]] = {}
+_lock = threading.Lock()
+
+
+def shard_path(shard: int) -> Path:
+    return SHARDS_DIR / f"shard_{shard}.db"
+
+
+def id_base(shard: int) -> int:
+    """First AUTOINCREMENT id of a shard."""
+    return (shard + 1) * ID_RANGE
+
+
+def database_files(global_path: Path) -> List[Tuple[Optional[int], Path]]:
+    """(shard, path) of every database file: global first (shard None), then the shards. For backups and maintenance."""
+    return [(None, global_path)] + [(shard, shard_path(shard)) for shard in range(DB_SHARDS)]
+
+
+def _connect(path: Path) -> sqlite3.Connection:
+    return sqlite3.connect(path.as_posix(), timeout=30)
+
+
+def shard_for_group(global_path: Path, group_id: int) -> Optional[int]:
+    """Shard of the group; a group without a shard yet is pinned to group_id % DB_SHARDS. None — no such group."""
+    shard = _group_shards.get(group_id)
+    if shard is not None:
+        return shard
+    conn = _connect(global_path)
+    try:
+        row = conn.execute("SELECT shard FROM group_shards WHERE group_id = ?", (group_id,)).fetchone()
+        if row is None:
+            conn.execute("INSERT OR IGNORE INTO group_shards (group_id, shard) SELECT id, id % ? FROM groups WHERE id = ?",
+                         (DB_SHARDS, group_id))
+            conn.commit()
+            row = conn.execute("SELECT shard FROM group_shards WHERE group_id = ?", (group_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    with _lock:
+        _group_shards[group_id] = row[0]
+    return row[0]
+
+
+def shard_for_id(global_path: Path, table: str, row_id) -> Optional[int]:
+    """Shard of a row of a ROUTED_ID_TABLES table by its id. None — unknown id (the global database answers 'not found')."""
+    try:
+        row_id = int(row_id)
+    except (TypeError, ValueError):
+        return None
+    if row_id >= ID_RANGE:
+        shard = row_id // ID_RANGE - 1
+        return shard if shard < DB_SHARDS else None
+    key = (table, row_id)
+    if key in _legacy_shards:
+        return _legacy_shards[key]
+    conn = _connect(global_path)
+    try:
+        row = conn.execute("SELECT shard FROM shard_legacy_ids WHERE kind = ? AND id = ?", key).fetchone()
+    finally:
+        conn.close()
+    with _lock:
+        if len(_legacy_shards) >= LEGACY_CACHE_SIZE:
+            _legacy_shards.clear()
+        _legacy_shards[key] = row[0] if row else None
+    return row[0] if row else None
+
+
+def _autoincrement_tables(conn: sqlite3.Connection, schema: str = 'main') -> List[str]:
+    return [row[0] for row in conn.execute(
+        f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table' AND sql LIKE '%AUTOINCREMENT%'"
+    ) if row[0] not in REPLICA_TABLES]
+
+
+def _set_sequences(conn: sqlite3.Connection, shard: int, schema: str = 'main') -> None:
+    """Moves AUTOINCREMENT counters of the shard's own tables to the shard's id range."""
+    base = id_base(shard) - 1
+    for table in _autoincrement_tables(conn, schema):
+        updated = conn.execute(f"UPDATE {schema}.sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (base, table)).rowcount
+        if not updated:
+            conn.execute(f"INSERT INTO {schema}.sqlite_sequence (name, seq) VALUES (?, ?)", (table, base))
+
+
+def _columns(conn: sqlite3.Connection, table: str, schema: str = 'main') -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def _copy_table(conn: sqlite3.Connection, table: str, where: str, params: tuple = ()) -> int:
+    """INSERT INTO shard.table SELECT ... FROM main.table WHERE ... by column name (column order may differ)."""
+    source = set(_columns(conn, table))
+    cols = ', '.join(c for c in _columns(conn, table, 'shard') if c in source)
+    return conn.execute(f"INSERT INTO shard.{table} ({cols}) SELECT {cols} FROM main.{table} WHERE {where}", params).rowcount
+
+
+def prepare_shard(global_path: Path, shard: int) -> bool:
+    """Creates or migrates a shard file. A new shard gets its id range and a copy of users. Returns True if created."""
+    from database.init_db import init_db_file
+
+    path = shard_path(shard)
+    created = init_db_file(path)
+    if created:
+        conn = _connect(global_path)
+        try:
+            conn.execute("ATTACH DATABASE ? AS shard", (path.as_posix(),))
+            conn.execute("BEGIN IMMEDIATE")
+            _set_sequences(conn, shard, 'shard')
+            _copy_table(conn, 'users', '1')
+            conn.commit()
+        finally:
+            conn.close()
+    return created
+
+
+def ensure_shards(global_path: Path) -> None:
+    """Startup check for the sharded layout: every shard exists and is migrated, the global database is already split."""
+    if not DB_SHARDS:
+        return
+    conn = _connect(global_path)
+    try:
+        max_shard = conn.execute("SELECT MAX(shard) FROM group_shards").fetchone()[0]
+        unsplit = max_shard is None and conn.execute("SELECT 1 FROM events LIMIT 1").fetchone() is not None
+    finally:
+        conn.close()
+    if unsplit:
+        raise RuntimeError(f"DB_SHARDS={DB_SHARDS}, но база не разбита на шарды: python -m services.sharding split --shards {DB_SHARDS}")
+    if max_shard is not None and max_shard >= DB_SHARDS:
+        raise RuntimeError(f"В group_shards есть шард {max_shard}, а DB_SHARDS={DB_SHARDS}: число шардов нельзя уменьшить")
+    for shard in range(DB_SHARDS):
+        if prepare_shard(global_path, shard):
+            print(f"[SHARDS] создан шард {shard}: {shard_path(shard)}")
+
+
+def split(global_path: Path, shards: int) -> Dict[int, Dict[str, int]]:
+    """
+    Splits a single database into `shards` shard files (run with the bot and the web app stopped).
+    Group data is copied shard by shard and verified by row counts; only then it is deleted from the global database.
+    Returns {shard: {table: rows}}.
+    """
+    from database.backup import backup
+    from database.init_db import init_db_file
+
+    if shards < 1:
+        raise ValueError("shards must be >= 1")
+    existing = [shard_path(n) for n in range(shards) if shard_path(n).exists()]
+    if existing:
+        raise RuntimeError(f"Файлы шардов уже существуют: {', '.join(p.name for p in existing)}")
+    init_db_file(global_path)
+    print("[SHARDS] резервная копия перед разбиением...")
+    backup(global_path, rotate_after=False)
+
+    conn = _connect(global_path)
+    conn.isolation_level = None
+    report: Dict[int, Dict[str, int]] = {}
+    try:
+        if conn.execute("SELECT 1 FROM group_shards LIMIT 1").fetchone():
+            raise RuntimeError("База уже разбита на шарды (group_shards не пуст)")
+        max_id = max(conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {t}").fetchone()[0]
+                     for t in ROUTED_ID_TABLES + ('events_archive',))
+        if max_id >= ID_RANGE:
+            raise RuntimeError(f"id {max_id} не помещается ниже ID_RANGE={ID_RANGE}")
+
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("INSERT INTO group_shards (group_id, shard) SELECT id, id % ? FROM groups", (shards,))
+        conn.execute("COMMIT")
+
+        for shard in range(shards):
+            g = f"(SELECT group_id FROM main.group_shards WHERE shard = {shard})"
+            path = shard_path(shard)
+            init_db_file(path)
+            conn.execute("ATTACH DATABASE ? AS shard", (path.as_posix(),))
+            copied = [('users', '1'), ('groups', "id IN {g}"), ('user_group_roles', "group_id IN {g}")] + _GROUP_TABLES
+            counts: Dict[str, int] = {}
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Копии глобальных таблиц (все пользователи, свои группы и их участники), затем данные групп
+                for table, where in copied:
+                    counts[table] = _copy_table(conn, table, where.format(g=g))
+                for table, where in _TRIGGER_TABLES:
+                    conn.execute(f"DELETE FROM shard.{table}")
+                    _copy_table(conn, table, where.format(g=g))
+                for kind, table, where in _LEGACY_SOURCES:
+                    conn.execute(f"INSERT OR IGNORE INTO main.shard_legacy_ids (kind, id, shard) "
+                                 f"SELECT ?, id, ? FROM main.{table} WHERE {where.format(g=g)}", (kind, shard))
+                # Копирование записало в журнал изменений шарда вставку каждой строки — это не изменения
+                conn.execute("DELETE FROM shard.change_log")
+                _set_sequences(conn, shard, 'shard')
+                for table, where in copied:
+                    source = conn.execute(f"SELECT COUNT(*) FROM main.{table} WHERE {where.format(g=g)}").fetchone()[0]
+                    target = conn.execute(f"SELECT COUNT(*) FROM shard.{table}").fetchone()[0]
+                    if source != target:
+                        raise RuntimeError(f"шард {shard}: {table} в исходной базе {source} строк, в шарде {target}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.execute("DETACH DATABASE shard")
+            report[shard] = counts
+            print(f"[SHARDS] шард {shard}: " + ', '.join(f"{t}={n}" for t, n in counts.items() if n))
+
+        # Все шарды записаны и проверены — убираем данные групп из глобальной базы: дочерние таблицы первыми,
+        # таблицы триггеров последними (удаление мероприятий их снова трогает). Личные настройки
+        # (personal_event_notifications без event_id) остаются в глобальной базе
+        g_all = "(SELECT group_id FROM main.group_shards)"
+        conn.execute("BEGIN IMMEDIATE")
+        for table, where in list(reversed(_GROUP_TABLES)) + _TRIGGER_TABLES:
+            conn.execute(f"DELETE FROM main.{table} WHERE {where.format(g=g_all)}")
+        # Журнал изменений начинается в шардах заново; пустой журнал глобальной базы при сохраненном seq
+        # сообщает потребителям со старой позицией (ChangeLogTruncated), что состояние надо перечитать
+        conn.execute("DELETE FROM main.change_log")
+        conn.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    with _lock:
+        _group_shards.clear()
+        _legacy_shards.clear()
+    return report
+
+
+def status(global_path: Path) -> List[Tuple[int, int, int, int]]:
+    """(shard, groups, events, file bytes) for every shard file."""
+    rows = []
+    conn = _connect(global_path)
+    try:
+        groups = dict(conn.execute("SELECT shard, COUNT(*) FROM group_shards GROUP BY shard").fetchall())
+    finally:
+        conn.close()
+    for shard in sorted(set(groups) | set(range(DB_SHARDS))):
+        path = shard_path(shard)
+        events = 0
+        if path.exists():
+            shard_conn = _connect(path)
+            try:
+                events = shard_conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+            finally:
+                shard_conn.close()
+        rows.append((shard, groups.get(shard, 0), events, path.stat().st_size if path.exists() else 0))
+    return rows
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from database.init_db import DB_PATH
+
+    parser = argparse.ArgumentParser(description='Шардирование базы по группам')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p_split = sub.add_parser('split', help='разбить существующую базу на шарды')
+    p_split.add_argument('--shards', type=int, required=True)
+    sub.add_parser('status', help='группы и мероприятия по шардам')
+    args = parser.parse_args()
+
+    if args.cmd == 'split':
+        split(DB_PATH, args.shards)
+        print(f"Готово. Запускайте бота и веб с DB_SHARDS={args.shards}")
+    else:
+        for shard, groups, events, size in status(DB_PATH):
+            print(f"shard {shard}: groups={groups} events={events} size={size} bytes")
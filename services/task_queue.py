@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Set, Tuple
+
+
+class ChatTaskQueue:
+    """
+    Per-chat sequential task queue.
+
+    Tasks submitted for the same chat run strictly one after another in submission order,
+    tasks of different chats run in parallel, and at most max_concurrency tasks run at once.
+    A chat's worker exists only while that chat has pending tasks.
+    Queue latency (submit -> start) is recorded for the last `window` tasks.
+    """
+
+    def __init__(self, max_concurrency: int = 8, max_pending_per_chat: int = 100, window: int = 1000,
+                 slow_threshold: float = 1.0):
+        self.max_concurrency = max_concurrency
+        self.max_pending_per_chat = max_pending_per_chat
+        self.slow_threshold = slow_threshold
+        self._queues: Dict[int, Deque[Tuple[float, str, Callable[[], Awaitable]]]] = {}
+        self._workers: Set[asyncio.Task] = set()
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.max_latency = 0.0
+
+    def submit(self, chat_id: int, factory: Callable[[], Awaitable], label: str = '') -> bool:
+        """Schedule factory() after all earlier tasks of chat_id. Returns False if the chat's backlog is full."""
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_concurrency)
+        q = self._queues.get(chat_id)
+        if q is not None and len(q) >= self.max_pending_per_chat:
+            self.dropped += 1
+            logging.warning(f"[CHAT_QUEUE] chat={chat_id} backlog full ({len(q)}), dropping {label}")
+            return False
+        item = (time.monotonic(), label, factory)
+        if q is None:
+            q = deque([item])
+            self._queues[chat_id] = q
+            task = asyncio.create_task(self._drain(chat_id, q))
+            self._workers.add(task)
+            task.add_done_callback(self._workers.discard)
+        else:
+            q.append(item)
+        return True
+
+    async def _drain(self, chat_id: int, q: Deque) -> None:
+        try:
+            while q:
+                enqueued_at, label, factory = q[0]
+                async with self._sem:
+                    self._record_latency(time.monotonic() - enqueued_at, chat_id, label)
+                    try:
+                        await factory()
+                    except Exception:
+                        self.failed += 1
+                        logging.exception(f"[CHAT_QUEUE] task {label} failed for chat={chat_id}")
+                    finally:
+                        self.processed += 1
+                q.popleft()
+        finally:
+            # No await between the last popleft() and here, so nothing can be appended in between
+            if self._queues.get(chat_id) is q:
+                del self._queues[chat_id]
+
+    def _record_latency(self, latency: float, chat_id: int, label: str) -> None:
+        self._latencies.append(latency)
+        if latency > self.max_latency:
+            self.max_latency = latency
+        if latency >= self.slow_threshold:
+            logging.warning(f"[CHAT_QUEUE] {label} for chat={chat_id} waited {latency * 1000:.0f} ms in queue")
+
+    def stats(self) -> dict:
+        lat = sorted(self._latencies)
+        n = len(lat)
+
+        def pct(p: float) -> float:
+            return lat[min(n - 1, int(p * n))] * 1000 if n else 0.0
+
+        return {
+            'processed': self.processed,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'active_chats': len(self._queues),
+            'pending': sum(len(q) for q in self._queues.values()),
+            'latency_avg_ms': (sum(lat) / n * 1000) if n else 0.0,
+            'latency_p50_ms': pct(0.50),
+            'latency_p95_ms': pct(0.95),
+            'latency_max_ms': self.max_latency * 1000,
+        }
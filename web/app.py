@@ -2,12 +2,14 @@ from fastapi import FastAPI, Request, HTTPException, Form
 from fastapi.responses import HTMLResponse
 from fastapi.exceptions import RequestValidationError
 from typing import List
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse, Response
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.sessions import SessionMiddleware
+from starlette.concurrency import run_in_threadpool
 from jinja2 import Environment, FileSystemLoader, select_autoescape
 from pathlib import Path
 from datetime import datetime, timedelta
+import asyncio
 import json
 import base64
 import hmac
@@ -16,8 +18,11 @@ import hashlib
 import sys
 import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from services.repositories import UserRepo, GroupRepo, EventRepo, RoleRepo, PersonalEventNotificationRepo, NotificationRepo, BookingRepo, DisplayNameRepo, EventNotificationRepo, DispatchLogRepo, EventTemplateRepo, TemplateRoleRequirementRepo, TemplateGenerationRepo, TemplateGenerator, EventRoleRequirementRepo, EventRoleAssignmentRepo, get_conn
-from services.repositories import AuditLogRepo, FAQRepo
+from services.repositories import UserRepo, GroupRepo, EventRepo, RoleRepo, PersonalEventNotificationRepo, NotificationRepo, BookingRepo, DisplayNameRepo, EventNotificationRepo, DispatchLogRepo, EventTemplateRepo, TemplateRoleRequirementRepo, TemplateGenerationRepo, TemplateGenerator, EventRoleRequirementRepo, EventRoleAssignmentRepo, get_conn, sync_replicas
+from services.repositories import AuditLogRepo, FAQRepo, GroupDataVersionRepo, CalendarRepo, SyncRepo, AnalyticsRepo, EventArchiveRepo, add_change_listener
+from services import ics
+from services.ics_import import import_ics
+from services.live_updates import HUB as LIVE_HUB, HEARTBEAT_SECONDS
 
 # Import test configuration from .env
 import os
@@ -242,6 +247,20 @@ def _require_admin(user_id: int, group_id: int):
     raise HTTPException(status_code=403, detail="Admin permissions required")
 
 
+def _require_group_access(urow, group_id: int) -> str | None:
+    """Same access rule as group_view: member, superadmin or a user with bookings in the group. Returns group role."""
+    role = RoleRepo.get_user_role(urow[0], group_id)
+    if role is not None or is_superadmin(urow[1]):
+        return role
+    with get_conn(group_id) as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT 1 FROM bookings b JOIN events e ON e.id = b.event_id WHERE b.user_id = ? AND e.group_id = ? LIMIT 1",
+                    (urow[0], group_id))
+        if cur.fetchone():
+            return None
+    raise HTTPException(status_code=403, detail="Access denied")
+
+
 def _role_label(role: str | None) -> str:
     mapping = {
         'superadmin': 'Суперадмин',
@@ -254,6 +273,96 @@ def _role_label(role: str | None) -> str:
     return mapping.get(role, role.capitalize() if role else 'Участник')
 
 
+AUDIT_ACTION_LABELS = {
+    'event_created': 'Создание',
+    'event_name_updated': 'Наименование',
+    'event_time_updated': 'Дата и время',
+    'event_responsible_updated': 'Ответственный',
+    'event_deleted': 'Удаление',
+    'event_booked': 'Бронь',
+    'event_unbooked': 'Отмена брони',
+    'role_booked': 'Бронь',
+    'role_unbooked': 'Отмена брони',
+    'role_requirement_added': 'Роль добавлена',
+    'role_requirement_removed': 'Роль удалена',
+    'notify_group': 'Групповое сообщение',
+    'notify_personal': 'Личное сообщение',
+    'group_notification_created': 'Групповое оповещение',
+    'group_notification_deleted': 'Групповое оповещение',
+    'personal_notification_created': 'Личное оповещение',
+    'personal_notification_deleted': 'Личное оповещение',
+    'member_display_name_updated': 'Имя участника',
+    'member_role_updated': 'Роль участника',
+    'member_removed': 'Удаление участника',
+    'member_added': 'Добавление участника',
+    'group_deleted': 'Удаление группы',
+}
+
+
+def _fmt_audit_ts(s: str) -> str:
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M"):
+        try:
+            return datetime.strptime(s, fmt).strftime("%d.%m.%Y %H:%M:%S")
+        except Exception:
+            continue
+    return s
+
+
+def _audit_items(rows) -> list[dict]:
+    """AuditLogRepo.list_page rows (already joined with users/groups/events) -> template items."""
+    items = []
+    for (aid, created_at, uid, action, gid_a, eid_a, oldv, newv, tid, uname, first, last, group_title, event_name) in rows:
+        user_label = str(uid) if uid else '—'
+        if uid and tid is not None:
+            disp = (first or '')
+            if last:
+                disp = f"{disp} {last}".strip()
+            if not disp:
+                disp = f"@{uname}" if uname else (str(tid) if tid else str(uid))
+            user_label = f"{disp} ({tid})" if tid else disp
+        items.append({
+            'id': aid,
+            'ts': _fmt_audit_ts(created_at),
+            'action': action,
+            'action_ru': AUDIT_ACTION_LABELS.get(action, action),
+            'user_label': user_label,
+            'group_id': gid_a,
+            'group_title': group_title,
+            'event_id': eid_a,
+            'event_name': event_name,
+            'old': oldv,
+            'new': newv,
+        })
+    return items
+
+
+def _audit_page(request: Request, group_id: int | None, event_id: int | None) -> dict:
+    """
+    Keyset page of the audit log for the query string (per_page, before/after cursors, page as a display counter).
+    Returns template context: audit_items, audit_total, audit_page, audit_per_page, audit_newer, audit_older.
+    """
+    def _int(name: str) -> int | None:
+        try:
+            return int(request.query_params.get(name) or 0) or None
+        except ValueError:
+            return None
+    per_page = min(_int('per_page') or 50, 200)
+    before, after = _int('before'), _int('after')
+    page = _int('page') or 1
+    rows, has_newer, has_older = AuditLogRepo.list_page(group_id=group_id, event_id=event_id, before_id=before,
+                                                        after_id=None if before else after, limit=per_page)
+    if not has_newer:
+        page = 1
+    return {
+        'audit_items': _audit_items(rows),
+        'audit_total': AuditLogRepo.count(group_id=group_id, event_id=event_id),
+        'audit_page': page,
+        'audit_per_page': per_page,
+        'audit_newer': rows[0][0] if rows and has_newer else None,
+        'audit_older': rows[-1][0] if rows and has_older else None,
+    }
+
+
 def _normalize_dt_local(val: str | None) -> str | None:
     if not val:
         return None
@@ -485,9 +594,9 @@ async def index(request: Request):
             audit_page = int(request.query_params.get('page') or 1)
             audit_per_page = int(request.query_params.get('per_page') or 50)
             audit_filters = {'group_id': request.query_params.get('group_id'), 'event_id': request.query_params.get('event_id')}
+            audit_newer = audit_older = None
             if is_super and (request.query_params.get('tab') == 'audit'):
                 try:
-                    from services.repositories import AuditLogRepo
                     # Load groups list
                     groups_all = GroupRepo.list_all()
                     audit_groups = [(gid, title) for (gid, title, _chat) in groups_all]
@@ -501,85 +610,10 @@ async def index(request: Request):
                             audit_events = [(eid, name) for (eid, name, _t, _r) in evs]
                         except Exception:
                             audit_events = []
-                    (audit_rows, audit_total) = AuditLogRepo.list(page=audit_page, per_page=audit_per_page, group_id=gflt, event_id=eflt)
-                    # Enrich rows for display
-                    def _fmt_ts(s: str) -> str:
-                        from datetime import datetime as _dt
-                        for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M"):
-                            try:
-                                return _dt.strptime(s, fmt).strftime("%d.%m.%Y %H:%M:%S")
-                            except Exception:
-                                continue
-                        return s
-                    audit_items = []
-                    action_map = {
-                        'event_created': 'Создание',
-                        'event_name_updated': 'Наименование',
-                        'event_time_updated': 'Дата и время',
-                        'event_responsible_updated': 'Ответственный',
-                        'event_deleted': 'Удаление',
-                        'event_booked': 'Бронь',
-                        'event_unbooked': 'Отмена брони',
-                        'role_booked': 'Бронь',
-                        'role_unbooked': 'Отмена брони',
-                        'role_requirement_added': 'Роль добавлена',
-                        'role_requirement_removed': 'Роль удалена',
-                        'notify_group': 'Групповое сообщение',
-                        'notify_personal': 'Личное сообщение',
-                        'group_notification_created': 'Групповое оповещение',
-                        'group_notification_deleted': 'Групповое оповещение',
-                        'personal_notification_created': 'Личное оповещение',
-                        'personal_notification_deleted': 'Личное оповещение',
-                        'member_display_name_updated': 'Имя участника',
-                        'member_role_updated': 'Роль участника',
-                        'member_removed': 'Удаление участника',
-                        'member_added': 'Добавление участника',
-                        'group_deleted': 'Удаление группы',
-                    }
-                    for (_id, created_at, uid, action, gid_a, eid_a, oldv, newv) in audit_rows:
-                        # user label
-                        user_label = str(uid) if uid else '—'
-                        user_tid = None
-                        try:
-                            u = UserRepo.get_by_id(uid) if uid else None
-                            if u:
-                                _iid, _tid, _uname, _phone, _first, _last, *_rest = u
-                                user_tid = _tid
-                                disp = (_first or '')
-                                if _last:
-                                    disp = f"{disp} {_last}".strip()
-                                if not disp:
-                                    disp = f"@{_uname}" if _uname else (str(_tid) if _tid else str(uid))
-                                user_label = f"{disp} ({_tid})" if _tid else disp
-                        except Exception:
-                            pass
-                        # group
-                        group_title = None
-                        try:
-                            g = GroupRepo.get_by_id(gid_a) if gid_a else None
-                            group_title = g[2] if g else None
-                        except Exception:
-                            group_title = None
-                        # event
-                        event_name = None
-                        try:
-                            ev = EventRepo.get_by_id(eid_a) if eid_a else None
-                            event_name = ev[1] if ev else None
-                        except Exception:
-                            event_name = None
-                        audit_items.append({
-                            'id': _id,
-                            'ts': _fmt_ts(created_at),
-                            'action': action,
-                            'action_ru': action_map.get(action, action),
-                            'user_label': user_label,
-                            'group_id': gid_a,
-                            'group_title': group_title,
-                            'event_id': eid_a,
-                            'event_name': event_name,
-                            'old': oldv,
-                            'new': newv,
-                        })
+                    audit_ctx = _audit_page(request, gflt, eflt)
+                    audit_items, audit_total = audit_ctx['audit_items'], audit_ctx['audit_total']
+                    audit_page, audit_per_page = audit_ctx['audit_page'], audit_ctx['audit_per_page']
+                    audit_newer, audit_older = audit_ctx['audit_newer'], audit_ctx['audit_older']
                 except Exception:
                     audit_rows, audit_total = [], 0
                     audit_groups, audit_events = [], []
@@ -589,7 +623,7 @@ async def index(request: Request):
                 'username': username,
                 'telegram_id': telegram_id,
                 'phone': phone,
-            }, users=users, is_superadmin=is_super, audit_rows=audit_rows, audit_items=(audit_items if (request.query_params.get('tab') == 'audit') else []), audit_total=audit_total, audit_page=audit_page, audit_per_page=audit_per_page, audit_filters=audit_filters, audit_groups=(audit_groups if (request.query_params.get('tab') == 'audit') else []), audit_events=(audit_events if (request.query_params.get('tab') == 'audit') else []), request=request, project_name=PROJECT_NAME)
+            }, users=users, is_superadmin=is_super, audit_rows=audit_rows, audit_items=(audit_items if (request.query_params.get('tab') == 'audit') else []), audit_total=audit_total, audit_page=audit_page, audit_per_page=audit_per_page, audit_newer=audit_newer, audit_older=audit_older, audit_filters=audit_filters, audit_groups=(audit_groups if (request.query_params.get('tab') == 'audit') else []), audit_events=(audit_events if (request.query_params.get('tab') == 'audit') else []), request=request, project_name=PROJECT_NAME)
     
     # Если данные из Telegram не пришли, пробуем из переменных окружения
     if TEST_TELEGRAM_ID:
@@ -641,9 +675,9 @@ async def index(request: Request):
             audit_page = int(request.query_params.get('page') or 1)
             audit_per_page = int(request.query_params.get('per_page') or 50)
             audit_filters = {'group_id': request.query_params.get('group_id'), 'event_id': request.query_params.get('event_id')}
+            audit_newer = audit_older = None
             if is_super and (request.query_params.get('tab') == 'audit'):
                 try:
-                    from services.repositories import AuditLogRepo
                     groups_all = GroupRepo.list_all()
                     audit_groups = [(gid, title) for (gid, title, _chat) in groups_all]
                     audit_events = []
@@ -655,79 +689,10 @@ async def index(request: Request):
                             audit_events = [(eid, name) for (eid, name, _t, _r) in evs]
                         except Exception:
                             audit_events = []
-                    (audit_rows, audit_total) = AuditLogRepo.list(page=audit_page, per_page=audit_per_page, group_id=gflt, event_id=eflt)
-                    def _fmt_ts(s: str) -> str:
-                        from datetime import datetime as _dt
-                        for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M"):
-                            try:
-                                return _dt.strptime(s, fmt).strftime("%d.%m.%Y %H:%M:%S")
-                            except Exception:
-                                continue
-                        return s
-                    audit_items = []
-                    action_map = {
-                        'event_created': 'Создание',
-                        'event_name_updated': 'Наименование',
-                        'event_time_updated': 'Дата и время',
-                        'event_responsible_updated': 'Ответственный',
-                        'event_deleted': 'Удаление',
-                        'event_booked': 'Бронь',
-                        'event_unbooked': 'Отмена брони',
-                        'role_booked': 'Бронь',
-                        'role_unbooked': 'Отмена брони',
-                        'role_requirement_added': 'Роль добавлена',
-                        'role_requirement_removed': 'Роль удалена',
-                        'notify_group': 'Групповое сообщение',
-                        'notify_personal': 'Личное сообщение',
-                        'group_notification_created': 'Групповое оповещение',
-                        'group_notification_deleted': 'Групповое оповещение',
-                        'personal_notification_created': 'Личное оповещение',
-                        'personal_notification_deleted': 'Личное оповещение',
-                        'member_display_name_updated': 'Имя участника',
-                        'member_role_updated': 'Роль участника',
-                        'member_removed': 'Удаление участника',
-                        'member_added': 'Добавление участника',
-                        'group_deleted': 'Удаление группы',
-                    }
-                    for (_id, created_at, uid, action, gid_a, eid_a, oldv, newv) in audit_rows:
-                        user_label = str(uid) if uid else '—'
-                        try:
-                            u = UserRepo.get_by_id(uid) if uid else None
-                            if u:
-                                _iid, _tid, _uname, _phone, _first, _last, *_rest = u
-                                disp = (_first or '')
-                                if _last:
-                                    disp = f"{disp} {_last}".strip()
-                                if not disp:
-                                    disp = f"@{_uname}" if _uname else (str(_tid) if _tid else str(uid))
-                                user_label = f"{disp} ({_tid})" if _tid else disp
-                        except Exception:
-                            pass
-                        group_title = None
-                        try:
-                            g = GroupRepo.get_by_id(gid_a) if gid_a else None
-                            group_title = g[2] if g else None
-                        except Exception:
-                            group_title = None
-                        event_name = None
-                        try:
-                            ev = EventRepo.get_by_id(eid_a) if eid_a else None
-                            event_name = ev[1] if ev else None
-                        except Exception:
-                            event_name = None
-                        audit_items.append({
-                            'id': _id,
-                            'ts': _fmt_ts(created_at),
-                            'action': action,
-                            'action_ru': action_map.get(action, action),
-                            'user_label': user_label,
-                            'group_id': gid_a,
-                            'group_title': group_title,
-                            'event_id': eid_a,
-                            'event_name': event_name,
-                            'old': oldv,
-                            'new': newv,
-                        })
+                    audit_ctx = _audit_page(request, gflt, eflt)
+                    audit_items, audit_total = audit_ctx['audit_items'], audit_ctx['audit_total']
+                    audit_page, audit_per_page = audit_ctx['audit_page'], audit_ctx['audit_per_page']
+                    audit_newer, audit_older = audit_ctx['audit_newer'], audit_ctx['audit_older']
                 except Exception:
                     audit_rows, audit_total = [], 0
                     audit_groups, audit_events = [], []
@@ -737,12 +702,217 @@ async def index(request: Request):
                 'username': username,
                 'telegram_id': telegram_id,
                 'phone': phone,
-            }, users=users, is_superadmin=is_super, audit_rows=audit_rows, audit_items=(audit_items if (request.query_params.get('tab') == 'audit') else []), audit_total=audit_total, audit_page=audit_page, audit_per_page=audit_per_page, audit_filters=audit_filters, audit_groups=(audit_groups if (request.query_params.get('tab') == 'audit') else []), audit_events=(audit_events if (request.query_params.get('tab') == 'audit') else []), request=request, project_name=PROJECT_NAME)
+            }, users=users, is_superadmin=is_super, audit_rows=audit_rows, audit_items=(audit_items if (request.query_params.get('tab') == 'audit') else []), audit_total=audit_total, audit_page=audit_page, audit_per_page=audit_per_page, audit_newer=audit_newer, audit_older=audit_older, audit_filters=audit_filters, audit_groups=(audit_groups if (request.query_params.get('tab') == 'audit') else []), audit_events=(audit_events if (request.query_params.get('tab') == 'audit') else []), request=request, project_name=PROJECT_NAME)
     
     # Если ничего не получилось, показываем стартовую страницу
     return render('welcome.html', message="Требуется авторизация", user_info=None, request=request, group_name=GROUP_NAME, project_name=PROJECT_NAME)
 
 
+def _group_member_labels(gid: int, urow) -> tuple[dict[int, str], list[tuple[int, str]]]:
+    """(member_name_map, member_options) for event cards; superadmins are hidden from non-superadmin viewers."""
+    member_rows = GroupRepo.list_group_members(gid)
+    member_name_map: dict[int, str] = {}
+    for mid, uname in member_rows:
+        dn = DisplayNameRepo.get_display_name(gid, mid)
+        member_name_map[mid] = dn if dn else (f"@{uname}" if uname else str(mid))
+    
+    # Filter out superadmin if current user is not superadmin
+    is_superadmin_flag = is_superadmin(urow[1])  # urow[1] is telegram_id
+    if not is_superadmin_flag:
+        # Remove superadmin from member options
+        filtered_member_rows = []
+        for mid, uname in member_rows:
+            # Check if this user is superadmin
+            user_role = RoleRepo.get_user_role(mid, gid)
+            if user_role != 'superadmin':
+                filtered_member_rows.append((mid, uname))
+        member_rows = filtered_member_rows
+    
+    member_options = [(mid, member_name_map[mid]) for mid, _ in member_rows]
+    return member_name_map, member_options
+
+
+def _event_audit_labels(gid: int, eid: int, audit: tuple | None = None) -> dict:
+    """audit — (created_by, created_at, updated_by, updated_at), если уже прочитаны (архивные мероприятия)."""
+    c_uid, c_at, u_uid, u_at = audit if audit is not None else EventRepo.get_audit(eid)
+    def _fmt_dt_ru(dt_str: str | None) -> str:
+        if not dt_str:
+            return '—'
+        from datetime import datetime as _dt, timezone as _tz, timedelta as _td
+        # Parse as naive then treat as UTC (SQLite datetime('now') is UTC), convert to Europe/Moscow
+        for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M"):
+            try:
+                d_naive = _dt.strptime(dt_str, fmt)
+                d_utc = d_naive.replace(tzinfo=_tz.utc)
+                try:
+                    from zoneinfo import ZoneInfo
+                    tz_msk = ZoneInfo('Europe/Moscow')
+                    d_local = d_utc.astimezone(tz_msk)
+                except Exception:
+                    # Fallback fixed offset +3
+                    d_local = d_utc + _td(hours=3)
+                return d_local.strftime("%d.%m.%Y %H:%M:%S")
+            except Exception:
+                continue
+        return dt_str
+    def label_for(uid: int | None) -> str:
+        if not uid:
+            return '—'
+        dn = DisplayNameRepo.get_display_name(gid, uid)
+        if dn:
+            return dn
+        u = UserRepo.get_by_id(uid)
+        if u and u[2]:
+            return f"@{u[2]}"
+        return str(uid)
+    return {
+        'created_by': label_for(c_uid),
+        'created_at': _fmt_dt_ru(c_at),
+        'updated_by': label_for(u_uid),
+        'updated_at': _fmt_dt_ru(u_at),
+    }
+
+
+def _event_card_data(gid: int, user_id: int, eid: int, name: str, time_str: str, resp_uid: int | None,
+                     member_name_map: dict[int, str], has_any_bookings: bool) -> dict:
+    """Data for one event card (_event_card.html)."""
+    disp, input_val = _format_time_display(time_str)
+    # Load roles and assignments for this event
+    try:
+        role_requirements = EventRoleRequirementRepo.list_for_event(eid)
+    except Exception:
+        role_requirements = []
+    try:
+        role_assignments = EventRoleAssignmentRepo.list_for_event(eid)
+    except Exception:
+        role_assignments = []
+    # Map role -> assigned user_id (first assignment if multiple present)
+    assignments_map = {}
+    for rname, uid in role_assignments:
+        if rname not in assignments_map:
+            assignments_map[rname] = uid
+    # Build label for assigned users (display name -> username -> telegram_id)
+    def _user_label(uid: int | None) -> str:
+        if not uid:
+            return ''
+        dn = DisplayNameRepo.get_display_name(gid, uid)
+        if dn:
+            return dn
+        u = UserRepo.get_by_id(uid)
+        if u:
+            # Some versions return 7 fields (including blocked). Accept extra.
+            _iid, _tid, _uname, _phone, _first, _last, *_rest = u
+            if _uname:
+                return f"@{_uname}"
+            if _first or _last:
+                return f"{(_first or '').strip()} {(_last or '').strip()}".strip()
+            if _tid:
+                return str(_tid)
+        return str(uid)
+    assignments_label_map = { r: _user_label(uid) for r, uid in assignments_map.items() }
+    # Whether current user already has any role in this event
+    current_user_has_role = any(uid == user_id for _, uid in role_assignments)
+    # Read allow_multi_roles_per_user flag
+    allow_multi_roles_per_user = 0
+    try:
+        with get_conn(event_id=eid) as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT allow_multi_roles_per_user FROM events WHERE id = ?", (eid,))
+            row = cur.fetchone()
+            allow_multi_roles_per_user = row[0] if row else 0
+    except Exception:
+        allow_multi_roles_per_user = 0
+    return {
+        'id': eid,
+        'name': name,
+        'time_display': _format_time_with_weekday(time_str),
+        'time_input': input_val,
+        'responsible_user_id': resp_uid,
+        'responsible_name': member_name_map.get(resp_uid) if resp_uid is not None else None,
+        'has_any_bookings': has_any_bookings,
+        'role_requirements': role_requirements,
+        'role_assignments': assignments_map,
+        'role_assignment_labels': assignments_label_map,
+        'allow_multi_roles_per_user': allow_multi_roles_per_user,
+        'current_user_has_role': 1 if current_user_has_role else 0,
+    }
+
+
+def _event_card_fragment(request: Request, urow, gid: int, eid: int, status: str,
+                         tab: str | None = None, page: int | None = None, per_page: int | None = None) -> HTMLResponse:
+    """
+    Re-rendered card of one event for in-place replacement after book/unbook (fragment=1).
+    X-Booking-Status carries the action result; an error still returns the current card so the page shows the real state.
+    """
+    user_id = urow[0]
+    event = EventRepo.get_by_id(eid)
+    if not event or event[3] != gid:
+        return HTMLResponse('', status_code=404, headers={'X-Booking-Status': 'booking_error'})
+    role = RoleRepo.get_user_role(user_id, gid)
+    is_admin = (role in ("owner", "admin", "superadmin")) or is_superadmin(urow[1])
+    member_name_map, member_options = _group_member_labels(gid, urow)
+    try:
+        audit_labels = {eid: _event_audit_labels(gid, eid)}
+    except Exception:
+        audit_labels = {}
+    e = _event_card_data(gid, user_id, eid, event[1], event[2], event[4], member_name_map,
+                         has_any_bookings=bool(BookingRepo.list_event_bookings(eid)))
+    response = render('event_card_fragment.html', e=e, group=GroupRepo.get_by_id(gid), is_admin=is_admin,
+                      current_user_id=user_id, member_options=member_options, member_name_map=member_name_map,
+                      audit_labels=audit_labels, active_tab=tab or 'active', current_page=page or 1,
+                      per_page=per_page or 10, request=request)
+    response.headers['X-Booking-Status'] = status
+    response.status_code = 200 if status != 'booking_error' else 409
+    return response
+
+
+def _archived_event_cards(gid: int, offset: int, limit: int, member_name_map: dict[int, str], audit_labels: dict) -> list[dict]:
+    """Read-only cards for events moved to the cold archive (events_archive); fills audit_labels for them."""
+    rows = EventArchiveRepo.list_for_group(gid, offset, limit) if limit > 0 else []
+    requirements, assignments = EventArchiveRepo.roles_for_events([r[0] for r in rows])
+    user_labels: dict[int, str] = {}
+    def _user_label(uid: int) -> str:
+        if uid not in user_labels:
+            dn = DisplayNameRepo.get_display_name(gid, uid)
+            u = None if dn else UserRepo.get_by_id(uid)
+            if dn:
+                user_labels[uid] = dn
+            elif u and u[2]:
+                user_labels[uid] = f"@{u[2]}"
+            elif u and (u[4] or u[5]):
+                user_labels[uid] = f"{(u[4] or '').strip()} {(u[5] or '').strip()}".strip()
+            else:
+                user_labels[uid] = str(u[1]) if u else str(uid)
+        return user_labels[uid]
+    cards = []
+    for eid, name, time_str, resp_uid, c_uid, c_at, u_uid, u_at in rows:
+        assignments_map = {}
+        for rname, uid in assignments.get(eid, []):
+            assignments_map.setdefault(rname, uid)
+        audit_labels[eid] = _event_audit_labels(gid, eid, (c_uid, c_at, u_uid, u_at))
+        cards.append({
+            'id': eid,
+            'cold': True,
+            'name': name,
+            'time_display': _format_time_with_weekday(time_str),
+            'time_input': _format_time_display(time_str)[1],
+            'responsible_user_id': resp_uid,
+            'responsible_name': member_name_map.get(resp_uid) if resp_uid is not None else None,
+            'has_any_bookings': False,
+            'role_requirements': requirements.get(eid, []),
+            'role_assignments': assignments_map,
+            'role_assignment_labels': {r: _user_label(uid) for r, uid in assignments_map.items()},
+        })
+    return cards
+
+
+def _booking_result(request: Request, urow, gid: int, eid: int, status: str, fragment: int | None,
+                    redirect_url: str, tab: str | None = None, page: int | None = None, per_page: int | None = None):
+    if fragment:
+        return _event_card_fragment(request, urow, gid, eid, status, tab, page, per_page)
+    return RedirectResponse(redirect_url, status_code=303)
+
+
 @app.get('/group/{gid}', response_class=HTMLResponse)
 async def group_view(request: Request, gid: int, tab: str = None, page: int = 1, per_page: int = 10):
     urow = _require_user(request)
@@ -774,68 +944,13 @@ async def group_view(request: Request, gid: int, tab: str = None, page: int = 1,
     # Global superadmin should also see admin UI
     is_admin = (role in ("owner", "admin", "superadmin")) or is_superadmin_req
     bookings_map = {eid: BookingRepo.list_event_bookings_with_names(gid, eid) for (eid, _, _, _) in events}
-    member_rows = GroupRepo.list_group_members(gid)
-    member_name_map: dict[int, str] = {}
-    for mid, uname in member_rows:
-        dn = DisplayNameRepo.get_display_name(gid, mid)
-        member_name_map[mid] = dn if dn else (f"@{uname}" if uname else str(mid))
-    
-    # Filter out superadmin if current user is not superadmin
-    from config import SUPERADMIN_ID
-    is_superadmin_flag = is_superadmin(urow[1])  # urow[1] is telegram_id
-    if not is_superadmin_flag:
-        # Remove superadmin from member options
-        filtered_member_rows = []
-        for mid, uname in member_rows:
-            # Check if this user is superadmin
-            user_role = RoleRepo.get_user_role(mid, gid)
-            if user_role != 'superadmin':
-                filtered_member_rows.append((mid, uname))
-        member_rows = filtered_member_rows
-    
-    member_options = [(mid, member_name_map[mid]) for mid, _ in member_rows]
+    member_name_map, member_options = _group_member_labels(gid, urow)
 
     # Build audit labels for events
     audit_labels = {}
     try:
         for eid, _, _, _ in events:
-            c_uid, c_at, u_uid, u_at = EventRepo.get_audit(eid)
-            def _fmt_dt_ru(dt_str: str | None) -> str:
-                if not dt_str:
-                    return '—'
-                from datetime import datetime as _dt, timezone as _tz, timedelta as _td
-                # Parse as naive then treat as UTC (SQLite datetime('now') is UTC), convert to Europe/Moscow
-                for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M"):
-                    try:
-                        d_naive = _dt.strptime(dt_str, fmt)
-                        d_utc = d_naive.replace(tzinfo=_tz.utc)
-                        try:
-                            from zoneinfo import ZoneInfo
-                            tz_msk = ZoneInfo('Europe/Moscow')
-                            d_local = d_utc.astimezone(tz_msk)
-                        except Exception:
-                            # Fallback fixed offset +3
-                            d_local = d_utc + _td(hours=3)
-                        return d_local.strftime("%d.%m.%Y %H:%M:%S")
-                    except Exception:
-                        continue
-                return dt_str
-            def label_for(uid: int | None) -> str:
-                if not uid:
-                    return '—'
-                dn = DisplayNameRepo.get_display_name(gid, uid)
-                if dn:
-                    return dn
-                u = UserRepo.get_by_id(uid)
-                if u and u[2]:
-                    return f"@{u[2]}"
-                return str(uid)
-            audit_labels[eid] = {
-                'created_by': label_for(c_uid),
-                'created_at': _fmt_dt_ru(c_at),
-                'updated_by': label_for(u_uid),
-                'updated_at': _fmt_dt_ru(u_at),
-            }
+            audit_labels[eid] = _event_audit_labels(gid, eid)
     except Exception:
         audit_labels = {}
     # Разделяем мероприятия на активные и архивные
@@ -846,66 +961,8 @@ async def group_view(request: Request, gid: int, tab: str = None, page: int = 1,
     all_archived_events = []
     
     for eid, name, time_str, resp_uid in events:
-        disp, input_val = _format_time_display(time_str)
-        # Load roles and assignments for this event
-        try:
-            role_requirements = EventRoleRequirementRepo.list_for_event(eid)
-        except Exception:
-            role_requirements = []
-        try:
-            role_assignments = EventRoleAssignmentRepo.list_for_event(eid)
-        except Exception:
-            role_assignments = []
-        # Map role -> assigned user_id (first assignment if multiple present)
-        assignments_map = {}
-        for rname, uid in role_assignments:
-            if rname not in assignments_map:
-                assignments_map[rname] = uid
-        # Build label for assigned users (display name -> username -> telegram_id)
-        def _user_label(uid: int | None) -> str:
-            if not uid:
-                return ''
-            dn = DisplayNameRepo.get_display_name(gid, uid)
-            if dn:
-                return dn
-            u = UserRepo.get_by_id(uid)
-            if u:
-                # Some versions return 7 fields (including blocked). Accept extra.
-                _iid, _tid, _uname, _phone, _first, _last, *_rest = u
-                if _uname:
-                    return f"@{_uname}"
-                if _first or _last:
-                    return f"{(_first or '').strip()} {(_last or '').strip()}".strip()
-                if _tid:
-                    return str(_tid)
-            return str(uid)
-        assignments_label_map = { r: _user_label(uid) for r, uid in assignments_map.items() }
-        # Whether current user already has any role in this event
-        current_user_has_role = any(uid == user_id for _, uid in role_assignments)
-        # Read allow_multi_roles_per_user flag
-        allow_multi_roles_per_user = 0
-        try:
-            with get_conn() as conn:
-                cur = conn.cursor()
-                cur.execute("SELECT allow_multi_roles_per_user FROM events WHERE id = ?", (eid,))
-                row = cur.fetchone()
-                allow_multi_roles_per_user = row[0] if row else 0
-        except Exception:
-            allow_multi_roles_per_user = 0
-        event_data = {
-            'id': eid,
-            'name': name,
-            'time_display': _format_time_with_weekday(time_str),
-            'time_input': input_val,
-            'responsible_user_id': resp_uid,
-            'responsible_name': member_name_map.get(resp_uid) if resp_uid is not None else None,
-            'has_any_bookings': len(bookings_map.get(eid, [])) > 0,
-            'role_requirements': role_requirements,
-            'role_assignments': assignments_map,
-            'role_assignment_labels': assignments_label_map,
-            'allow_multi_roles_per_user': allow_multi_roles_per_user,
-            'current_user_has_role': 1 if current_user_has_role else 0,
-        }
+        event_data = _event_card_data(gid, user_id, eid, name, time_str, resp_uid, member_name_map,
+                                      has_any_bookings=len(bookings_map.get(eid, [])) > 0)
         
         # Проверяем, прошло ли мероприятие
         try:
@@ -923,7 +980,26 @@ async def group_view(request: Request, gid: int, tab: str = None, page: int = 1,
         except ValueError:
             # Если не удалось распарсить время, считаем активным
             all_active_events.append(event_data)
-    
+
+    # Повторения ленивых шаблонов, еще не созданные как события, показываем виртуальными карточками
+    try:
+        virtual_rows = TemplateGenerator.virtual_occurrences(gid, now.strftime('%Y-%m-%d %H:%M'))
+    except Exception:
+        virtual_rows = []
+    if virtual_rows:
+        for neg_tid, name, key, _resp in virtual_rows:
+            all_active_events.append({
+                'id': None,
+                'virtual': True,
+                'template_id': -neg_tid,
+                'occurrence_key': key,
+                'name': name,
+                'time_display': _format_time_with_weekday(key),
+                'time_input': _format_time_display(key)[1],
+            })
+        # time_input — 'YYYY-MM-DDTHH:MM' у всех карточек, сортировка по нему совпадает с порядком по времени
+        all_active_events.sort(key=lambda e: e['time_input'])
+
     # Применяем пагинацию
     def paginate_events(events_list, current_page, items_per_page):
         total_items = len(events_list)
@@ -946,9 +1022,23 @@ async def group_view(request: Request, gid: int, tab: str = None, page: int = 1,
     active_pagination = paginate_events(all_active_events, page, per_page)
     active_events = active_pagination['events']
     
-    # Пагинация для архивных мероприятий
-    archived_pagination = paginate_events(all_archived_events, page, per_page)
-    archived_events = archived_pagination['events']
+    # Архив: сначала холодные (events_archive, они старше), затем прошедшие, но еще не перенесенные
+    cold_total = EventArchiveRepo.count_for_group(gid)
+    archived_total = cold_total + len(all_archived_events)
+    start_idx = (page - 1) * per_page
+    end_idx = start_idx + per_page
+    archived_events = _archived_event_cards(gid, start_idx, min(end_idx, cold_total) - start_idx, member_name_map, audit_labels)
+    archived_events += all_archived_events[max(0, start_idx - cold_total):max(0, end_idx - cold_total)]
+    archived_total_pages = (archived_total + per_page - 1) // per_page
+    archived_pagination = {
+        'events': archived_events,
+        'total_items': archived_total,
+        'total_pages': archived_total_pages,
+        'current_page': page,
+        'items_per_page': per_page,
+        'has_prev': page > 1,
+        'has_next': page < archived_total_pages,
+    }
     
     event_count = GroupRepo.count_group_events(gid)
     # Role label: show localized role if present; otherwise show "Отсутствует"
@@ -991,86 +1081,135 @@ async def create_events_multiple(request: Request, gid: int, items: str | None =
     urow = _require_user(request)
     user_id = urow[0]
     _require_admin(user_id, gid)
-    created_any = False
+    rows: list[tuple[str, str]] = []
     if name and time:
         for t, n in zip(time, name):
             t = _normalize_dt_local((t or '').strip())
             n = (n or '').strip()
-            if not t and not n:
-                continue
-            if t and n:
-                eid = EventRepo.create(gid, n, t, created_by_user_id=user_id)
-                try:
-                    AuditLogRepo.add('event_created', user_id=user_id, group_id=gid, event_id=eid, new_value=n)
-                except Exception:
-                    pass
-                EventNotificationRepo.create_from_group_defaults(eid, gid)
-                # Apply group role templates
-                try:
-                    from services.repositories import GroupRoleTemplateRepo
-                    for rname, req in GroupRoleTemplateRepo.list(gid):
-                        EventRoleRequirementRepo.set_for_event(eid, rname, int(req or 1))
-                except Exception:
-                    pass
-                # Personal notifications will be created when responsible person is assigned
-                created_any = True
-            elif t:
-                eid = EventRepo.create(gid, f"Событие {t}", t, created_by_user_id=user_id)
-                try:
-                    AuditLogRepo.add('event_created', user_id=user_id, group_id=gid, event_id=eid, new_value=f"Событие {t}")
-                except Exception:
-                    pass
-                EventNotificationRepo.create_from_group_defaults(eid, gid)
-                try:
-                    from services.repositories import GroupRoleTemplateRepo
-                    for rname, req in GroupRoleTemplateRepo.list(gid):
-                        EventRoleRequirementRepo.set_for_event(eid, rname, int(req or 1))
-                except Exception:
-                    pass
-                # Personal notifications will be created when responsible person is assigned
-                created_any = True
-            elif n:
+            if not t:
                 continue
+            rows.append((n or f"Событие {t}", t))
     elif items:
         for line in items.splitlines():
             if not line.strip():
                 continue
             if '|' in line:
                 time_part, name_part = line.split('|', 1)
-                eid = EventRepo.create(gid, name_part.strip(), _normalize_dt_local(time_part.strip()) or time_part.strip(), created_by_user_id=user_id)
-                try:
-                    AuditLogRepo.add('event_created', user_id=user_id, group_id=gid, event_id=eid, new_value=name_part.strip())
-                except Exception:
-                    pass
-                EventNotificationRepo.create_from_group_defaults(eid, gid)
-                try:
-                    from services.repositories import GroupRoleTemplateRepo
-                    for rname, req in GroupRoleTemplateRepo.list(gid):
-                        EventRoleRequirementRepo.set_for_event(eid, rname, int(req or 1))
-                except Exception:
-                    pass
-                # Personal notifications will be created when responsible person is assigned
-                created_any = True
+                rows.append((name_part.strip(), _normalize_dt_local(time_part.strip()) or time_part.strip()))
             else:
                 t = _normalize_dt_local(line.strip()) or line.strip()
-                eid = EventRepo.create(gid, f"Событие {t}", t, created_by_user_id=user_id)
-                try:
-                    AuditLogRepo.add('event_created', user_id=user_id, group_id=gid, event_id=eid, new_value=f"Событие {t}")
-                except Exception:
-                    pass
-                EventNotificationRepo.create_from_group_defaults(eid, gid)
-                try:
-                    from services.repositories import GroupRoleTemplateRepo
-                    for rname, req in GroupRoleTemplateRepo.list(gid):
-                        EventRoleRequirementRepo.set_for_event(eid, rname, int(req or 1))
-                except Exception:
-                    pass
-                # Personal notifications will be created when responsible person is assigned
-                created_any = True
-    ok = 'created' if created_any else 'noop'
+                rows.append((f"Событие {t}", t))
+    # Personal notifications will be created when responsible person is assigned
+    EventRepo.import_many(gid, rows, created_by_user_id=user_id, skip_duplicates=False)
+    ok = 'created' if rows else 'noop'
     return RedirectResponse(url=f"/group/{gid}?ok={ok}", status_code=303)
 
 
+IMPORT_MAX_ROWS = 1000
+
+
+def _parse_import_rows(raw: bytes, fmt: str) -> list[dict]:
+    """CSV (columns time,name; header optional; ',' or ';') or JSON (list or {"events": [...]}) -> list of dicts."""
+    text = raw.decode('utf-8-sig')
+    if fmt == 'json':
+        data = json.loads(text)
+        if isinstance(data, dict):
+            data = data.get('events', [])
+        if not isinstance(data, list):
+            raise ValueError("JSON must be a list of events or {\"events\": [...]}")
+        return [it if isinstance(it, dict) else {'_invalid': it} for it in data]
+    import csv
+    import io
+    lines = [ln for ln in text.splitlines() if ln.strip()]
+    if not lines:
+        return []
+    delimiter = ';' if lines[0].count(';') > lines[0].count(',') else ','
+    reader = csv.reader(io.StringIO('\n'.join(lines)), delimiter=delimiter)
+    result = []
+    header = None
+    for i, cols in enumerate(reader):
+        cols = [c.strip() for c in cols]
+        if i == 0 and any(c.lower() in ('time', 'name', 'время', 'название') for c in cols):
+            aliases = {'время': 'time', 'название': 'name'}
+            header = [aliases.get(c.lower(), c.lower()) for c in cols]
+            continue
+        if header:
+            result.append(dict(zip(header, cols)))
+        else:
+            result.append({'time': cols[0] if cols else '', 'name': cols[1] if len(cols) > 1 else ''})
+    return result
+
+
+@app.post('/group/{gid}/events/import')
+async def import_events(request: Request, gid: int, skip_duplicates: int = 1):
+    """
+    Bulk import of events from CSV or JSON: raw body (Content-Type text/csv or application/json)
+    or multipart upload in field 'file'. Rows are validated, then written in one transaction.
+    Returns per-row results: created / duplicate / error.
+    iCalendar (.ics / text/calendar) is parsed as a stream and imported in batches; only counters are returned.
+    """
+    urow = _require_user(request)
+    user_id = urow[0]
+    _require_admin(user_id, gid)
+
+    content_type = (request.headers.get('content-type') or '').lower()
+    if content_type.startswith('multipart/form-data'):
+        form = await request.form()
+        upload = form.get('file')
+        if upload is None or not hasattr(upload, 'read'):
+            raise HTTPException(status_code=400, detail="File is required")
+        filename = (getattr(upload, 'filename', '') or '').lower()
+        if filename.endswith('.ics') or form.get('format') == 'ics':
+            # Загрузка уже лежит во временном файле — читаем его построчно в потоке, не блокируя event loop
+            await upload.seek(0)
+            stats = await run_in_threadpool(import_ics, gid, upload.file, created_by_user_id=user_id)
+            return JSONResponse(stats)
+        raw = await upload.read()
+        fmt = 'json' if filename.endswith('.json') or form.get('format') == 'json' else 'csv'
+    else:
+        raw = await request.body()
+        if 'calendar' in content_type:
+            import io
+            stats = await run_in_threadpool(import_ics, gid, io.BytesIO(raw), created_by_user_id=user_id)
+            return JSONResponse(stats)
+        fmt = 'json' if 'json' in content_type else 'csv'
+    try:
+        parsed = _parse_import_rows(raw, fmt)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"Cannot parse {fmt.upper()}: {e}")
+    if len(parsed) > IMPORT_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"Too many rows (max {IMPORT_MAX_ROWS})")
+
+    results: list[dict] = []
+    valid: list[tuple[str, str]] = []
+    valid_rows: list[int] = []
+    for row_no, item in enumerate(parsed, start=1):
+        time_raw = str(item.get('time') or '').strip()
+        name_val = str(item.get('name') or '').strip()
+        norm = _normalize_dt_local(time_raw) if time_raw else None
+        try:
+            datetime.strptime(norm or '', "%Y-%m-%d %H:%M")
+        except ValueError:
+            results.append({'row': row_no, 'status': 'error', 'error': f"invalid time: {time_raw!r}" if time_raw else "time is required"})
+            continue
+        valid.append((name_val or f"Событие {norm}", norm))
+        valid_rows.append(row_no)
+        results.append({'row': row_no, 'status': 'pending', 'time': norm, 'name': name_val or f"Событие {norm}"})
+
+    outcome = EventRepo.import_many(gid, valid, created_by_user_id=user_id, skip_duplicates=bool(skip_duplicates))
+    by_row = {r['row']: r for r in results}
+    for row_no, (status, eid) in zip(valid_rows, outcome):
+        by_row[row_no]['status'] = status
+        by_row[row_no]['event_id'] = eid
+
+    summary = {
+        'created': sum(1 for r in results if r['status'] == 'created'),
+        'duplicates': sum(1 for r in results if r['status'] == 'duplicate'),
+        'errors': sum(1 for r in results if r['status'] == 'error'),
+    }
+    return JSONResponse({**summary, 'results': results})
+
+
 @app.post('/group/{gid}/events/{eid}/update')
 async def update_event(request: Request, gid: int, eid: int, name: str | None = Form(None), time: str | None = Form(None), responsible_user_id: int | None = Form(None)):
     urow = _require_user(request)
@@ -1187,7 +1326,7 @@ async def update_event_from_card(request: Request, gid: int, eid: int, name: str
                 
                 # Check allow_multi_roles_per_user
                 allow_multi = 0
-                with get_conn() as conn:
+                with get_conn(event_id=eid) as conn:
                     cur = conn.cursor()
                     cur.execute("SELECT allow_multi_roles_per_user FROM events WHERE id = ?", (eid,))
                     row = cur.fetchone()
@@ -1237,6 +1376,286 @@ async def update_event_from_card(request: Request, gid: int, eid: int, name: str
     return RedirectResponse(url=f"/group/{gid}{param_string}", status_code=303)
 
 
+@app.post('/group/{gid}/occurrences/{tid}/open')
+async def open_virtual_occurrence(request: Request, gid: int, tid: int, key: str = Form(...), tab: str | None = Form(None), page: int | None = Form(None), per_page: int | None = Form(None)):
+    """Materialize a virtual occurrence of a lazy template so it can be booked or edited."""
+    urow = _require_user(request)
+    user_id = urow[0]
+    role = RoleRepo.get_user_role(user_id, gid)
+    if role is None and not is_superadmin(urow[1]):
+        raise HTTPException(status_code=403, detail="Access denied")
+    tpl = EventTemplateRepo.get(tid)
+    if not tpl or tpl[1] != gid:
+        raise HTTPException(status_code=404, detail="Template not found")
+    eid = TemplateGenerator.materialize(tid, key, created_by_user_id=user_id)
+    if not eid:
+        raise HTTPException(status_code=404, detail="Occurrence not found")
+    try:
+        AuditLogRepo.add('occurrence_materialized', user_id=user_id, group_id=gid, event_id=eid, new_value=key)
+    except Exception:
+        pass
+
+    params = []
+    if tab:
+        params.append(f"tab={tab}")
+    if page:
+        params.append(f"page={page}")
+    if per_page:
+        params.append(f"per_page={per_page}")
+    param_string = "&".join(params)
+    return RedirectResponse(url=f"/group/{gid}" + (f"?{param_string}" if param_string else ""), status_code=303)
+
+
+# --- JSON API: delta sync for the Mini App ---
+def _sync_events_payload(gid: int, event_ids: list[int] | None) -> list[dict]:
+    events, reqs, assigns, bookings = SyncRepo.load_events(gid, event_ids)
+    roles: dict[int, dict[str, dict]] = {}
+    for eid, role_name, required in reqs:
+        roles.setdefault(eid, {})[role_name] = {'role': role_name, 'required': required, 'users': []}
+    for eid, role_name, uid, label in assigns:
+        slot = roles.setdefault(eid, {}).setdefault(role_name, {'role': role_name, 'required': 0, 'users': []})
+        slot['users'].append([uid, label])
+    booked: dict[int, list] = {}
+    for eid, uid, label in bookings:
+        booked.setdefault(eid, []).append([uid, label])
+    payload = []
+    for eid, name, time_str, resp_uid in events:
+        item = {'id': eid, 'name': name, 'time': time_str}
+        if resp_uid:
+            item['responsible_user_id'] = resp_uid
+        if eid in roles:
+            item['roles'] = list(roles[eid].values())
+        if eid in booked:
+            item['bookings'] = booked[eid]
+        payload.append(item)
+    return payload
+
+
+@app.get('/api/group/{gid}/sync')
+async def api_group_sync(request: Request, gid: int, since: int = 0):
+    """
+    Events, rosters and members of a group. since=0 -> full snapshot; since=N -> only events changed after
+    version N ('events' upserts, 'deleted' ids) and members if they changed. The client keeps 'version' for the next call.
+    """
+    urow = _require_user(request)
+    _require_group_access(urow, gid)
+    version, members_version, changed, deleted = SyncRepo.changes_since(gid, since)
+    etag = f'W/"g{gid}-v{version}"'
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers=headers)
+    # Клиент с версией из будущего (база пересоздана) получает полный снимок
+    full = since <= 0 or since > version
+    body = {'group_id': gid, 'version': version, 'full': full, 'user_id': urow[0]}
+    if full:
+        body['events'] = _sync_events_payload(gid, None)
+        body['deleted'] = []
+    else:
+        body['events'] = _sync_events_payload(gid, changed) if changed else []
+        body['deleted'] = deleted
+    if full or members_version > since:
+        show_superadmins = is_superadmin(urow[1])
+        body['members'] = [[uid, role, label] for uid, role, label in SyncRepo.members(gid)
+                           if show_superadmins or role != 'superadmin']
+    return JSONResponse(body, headers=headers)
+
+
+# --- Live updates (SSE) ---
+add_change_listener(LIVE_HUB.publish)
+
+
+def _sse(event: str, data: dict, event_id: int | None = None) -> str:
+    head = f"id: {event_id}\n" if event_id is not None else ''
+    return f"{head}event: {event}\ndata: {json.dumps(data, separators=(',', ':'), ensure_ascii=False)}\n\n"
+
+
+@app.get('/group/{gid}/live')
+async def group_live(request: Request, gid: int):
+    """
+    Server-Sent Events stream of changes in the group: 'changes' with {"v": version, "changes": [{"id", "kind"}], "members"?}.
+    On reconnect the browser sends Last-Event-ID (the last version seen) and gets the missed changes first.
+    """
+    urow = _require_user(request)
+    _require_group_access(urow, gid)
+    sub = await LIVE_HUB.subscribe(gid)
+    if sub is None:
+        raise HTTPException(status_code=503, detail="Too many live connections", headers={'Retry-After': '30'})
+    last_event_id = request.headers.get('last-event-id') or request.query_params.get('since')
+
+    async def stream():
+        try:
+            yield 'retry: 5000\n\n'
+            if last_event_id and last_event_id.isdigit():
+                since = int(last_event_id)
+                version, members_version, changed, deleted = await asyncio.to_thread(SyncRepo.changes_since, gid, since)
+                if version > since:
+                    changes = [{'id': eid, 'kind': 'edited'} for eid in changed] + [{'id': eid, 'kind': 'deleted'} for eid in deleted]
+                    data = {'v': version, 'changes': changes}
+                    if members_version > since:
+                        data['members'] = True
+                    yield _sse('changes', data, version)
+            else:
+                version = (await asyncio.to_thread(GroupDataVersionRepo.get, gid))[0]
+                yield _sse('hello', {'v': version}, version)
+            while True:
+                if sub.overflow:
+                    yield _sse('reload', {})
+                    return
+                try:
+                    message = await asyncio.wait_for(sub.queue.get(), timeout=HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ': ping\n\n'
+                    continue
+                yield _sse('changes', message, message['v'])
+        finally:
+            LIVE_HUB.unsubscribe(sub)
+
+    return StreamingResponse(stream(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.get('/group/{gid}/events/{eid}/card', response_class=HTMLResponse)
+async def event_card(request: Request, gid: int, eid: int):
+    """Current card of one event (used by the live page to refresh changed cards)."""
+    urow = _require_user(request)
+    _require_group_access(urow, gid)
+    return _event_card_fragment(request, urow, gid, eid, 'ok', request.query_params.get('tab'))
+
+
+# --- Calendar subscription (ICS) ---
+# Календарные клиенты не проходят авторизацию Telegram, поэтому ссылка подписывается HMAC-токеном
+# Без секрета ссылки отключены: общеизвестный ключ позволил бы подделать токен для любого пользователя
+_calendar_secret = os.getenv('CALENDAR_SECRET') or os.getenv('BOT_TOKEN')
+CALENDAR_SECRET = _calendar_secret.encode() if _calendar_secret else None
+if CALENDAR_SECRET is None:
+    print("[CALENDAR] CALENDAR_SECRET/BOT_TOKEN не заданы — ссылки на календарь отключены")
+CALENDAR_PAST_DAYS = 30
+CALENDAR_FUTURE_DAYS = 365
+
+
+def _calendar_token(scope: str, user_id: int, gid: int = 0) -> str:
+    digest = hmac.new(CALENDAR_SECRET, f"cal:{scope}:{gid}:{user_id}".encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:18]).decode().rstrip('=')
+
+
+def _check_calendar_token(token: str | None, scope: str, user_id: int, gid: int = 0) -> None:
+    if CALENDAR_SECRET is None:
+        raise HTTPException(status_code=404, detail="Calendar links are disabled")
+    if not token or not hmac.compare_digest(token, _calendar_token(scope, user_id, gid)):
+        raise HTTPException(status_code=403, detail="Invalid calendar token")
+    user = UserRepo.get_by_id(user_id)
+    if not user or user[6]:
+        raise HTTPException(status_code=403, detail="Access denied")
+
+
+def _calendar_window() -> tuple[str, str]:
+    from zoneinfo import ZoneInfo
+    now = datetime.now(ZoneInfo('Europe/Moscow')).replace(tzinfo=None)
+    return ((now - timedelta(days=CALENDAR_PAST_DAYS)).strftime('%Y-%m-%d'),
+            (now + timedelta(days=CALENDAR_FUTURE_DAYS)).strftime('%Y-%m-%d'))
+
+
+def _calendar_conditional(request: Request, etag: str, last_modified_utc: str | None):
+    """Returns (304 response or None, headers). last_modified_utc: SQLite 'YYYY-MM-DD HH:MM:SS' (UTC)."""
+    from email.utils import format_datetime, parsedate_to_datetime
+    from datetime import timezone as _tz
+    headers = {'ETag': etag, 'Cache-Control': 'private, max-age=300'}
+    lm = None
+    if last_modified_utc:
+        try:
+            lm = datetime.strptime(last_modified_utc, "%Y-%m-%d %H:%M:%S").replace(tzinfo=_tz.utc)
+            headers['Last-Modified'] = format_datetime(lm, usegmt=True)
+        except ValueError:
+            lm = None
+    inm = request.headers.get('if-none-match')
+    if inm is not None:
+        if etag in [t.strip() for t in inm.split(',')] or inm.strip() == '*':
+            return Response(status_code=304, headers=headers), headers
+    elif lm is not None and request.headers.get('if-modified-since'):
+        try:
+            if lm <= parsedate_to_datetime(request.headers['if-modified-since']):
+                return Response(status_code=304, headers=headers), headers
+        except (TypeError, ValueError):
+            pass
+    return None, headers
+
+
+def _ics_stamp(updated_at: str | None) -> str:
+    try:
+        return datetime.strptime(updated_at or '', "%Y-%m-%d %H:%M:%S").strftime('%Y%m%dT%H%M%SZ')
+    except ValueError:
+        return '19700101T000000Z'
+
+
+@app.get('/group/{gid}/calendar.ics')
+async def group_calendar(request: Request, gid: int, u: int, token: str | None = None):
+    """All events of the group within the calendar window. Link is per member: ?u=<user id>&token=..."""
+    _check_calendar_token(token, 'group', u, gid)
+    if RoleRepo.get_user_role(u, gid) is None:
+        user = UserRepo.get_by_id(u)
+        if not (user and is_superadmin(user[1])):
+            raise HTTPException(status_code=403, detail="Access denied")
+    group = GroupRepo.get_by_id(gid)
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
+    version, updated_at = GroupDataVersionRepo.get(gid)
+    from_iso, to_iso = _calendar_window()
+    # Окно календаря сдвигается раз в сутки — дата входит в ETag
+    etag = f'W/"g{gid}-v{version}-{from_iso}"'
+    not_modified, headers = _calendar_conditional(request, etag, updated_at)
+    if not_modified is not None:
+        return not_modified
+    stamp = _ics_stamp(updated_at)
+    base_url = str(request.base_url).rstrip('/')
+
+    def blocks():
+        after = None
+        while True:
+            rows = CalendarRepo.group_page(gid, from_iso, to_iso, after=after)
+            for eid, name, time_str, assignments in rows:
+                yield ics.vevent(f"event-{eid}@jem-reminder", time_str, name, description=assignments,
+                                 url=f"{base_url}/group/{gid}", dtstamp=stamp)
+            if len(rows) < 500:
+                return
+            after = (rows[-1][2], rows[-1][0])
+
+    return StreamingResponse(ics.stream_calendar(group[2] or f"Группа {gid}", blocks()),
+                             media_type='text/calendar; charset=utf-8', headers=headers)
+
+
+@app.get('/user/{uid}/calendar.ics')
+async def user_calendar(request: Request, uid: int, token: str | None = None):
+    """Events in all groups where the user has booked a role."""
+    _check_calendar_token(token, 'user', uid)
+    versions = GroupDataVersionRepo.list_for_user(uid)
+    from_iso, to_iso = _calendar_window()
+    fingerprint = hashlib.sha1(';'.join(f"{g}:{v}" for g, v, _ in versions).encode()).hexdigest()[:16]
+    etag = f'W/"u{uid}-{fingerprint}-{from_iso}"'
+    last_modified = max((ts for _, _, ts in versions if ts), default=None)
+    not_modified, headers = _calendar_conditional(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+    stamp = _ics_stamp(last_modified)
+    base_url = str(request.base_url).rstrip('/')
+
+    def blocks():
+        after = None
+        while True:
+            rows = CalendarRepo.user_page(uid, from_iso, to_iso, after=after)
+            for eid, name, time_str, group_title, roles in rows:
+                yield ics.vevent(f"event-{eid}-u{uid}@jem-reminder", time_str, name,
+                                 description=f"{group_title or ''}\nРоль: {roles}".strip(),
+                                 url=base_url, dtstamp=stamp)
+            if len(rows) < 500:
+                return
+            after = (rows[-1][2], rows[-1][0])
+
+    return StreamingResponse(ics.stream_calendar(f"{PROJECT_NAME}: мои записи", blocks()),
+                             media_type='text/calendar; charset=utf-8', headers=headers)
+
+
 # --- Settings: notifications & admins ---
 @app.get('/group/{gid}/settings', response_class=HTMLResponse)
 async def group_settings(request: Request, gid: int):
@@ -1277,7 +1696,12 @@ async def group_settings(request: Request, gid: int):
     notifications_count = len(notifications)
     personal_notifications_count = len(personal_notifications)
     effective_role = 'superadmin' if is_super else role
-    return render('group_settings.html', group=group, role=effective_role, notifications=notifications, personal_notifications=personal_notifications, pending=pending, admins=admins, members=members, current_display_name=current_display_name, member_display_names=member_display_names, role_map=role_map, event_count=event_count, notifications_count=notifications_count, personal_notifications_count=personal_notifications_count, role_templates=role_templates, request=request, project_name=PROJECT_NAME)
+    base_url = str(request.base_url).rstrip('/')
+    calendar_urls = {
+        'group': f"{base_url}/group/{gid}/calendar.ics?u={user_id}&token={_calendar_token('group', user_id, gid)}",
+        'user': f"{base_url}/user/{user_id}/calendar.ics?token={_calendar_token('user', user_id)}",
+    } if CALENDAR_SECRET is not None else None
+    return render('group_settings.html', calendar_urls=calendar_urls, group=group, role=effective_role, notifications=notifications, personal_notifications=personal_notifications, pending=pending, admins=admins, members=members, current_display_name=current_display_name, member_display_names=member_display_names, role_map=role_map, event_count=event_count, notifications_count=notifications_count, personal_notifications_count=personal_notifications_count, role_templates=role_templates, request=request, project_name=PROJECT_NAME)
 
 
 @app.post('/group/{gid}/settings/notifications/add')
@@ -1687,7 +2111,7 @@ async def event_settings(request: Request, gid: int, eid: int):
     template_row = None
     template_roles = []
     try:
-        with get_conn() as conn:
+        with get_conn(event_id=eid) as conn:
             cur = conn.cursor()
             cur.execute("SELECT template_id, occurrence_key FROM template_generated_events WHERE event_id = ?", (eid,))
             row = cur.fetchone()
@@ -1816,7 +2240,7 @@ async def add_event_notification_text(request: Request, gid: int, eid: int, noti
 
 
 @app.post('/group/{gid}/events/{eid}/convert-to-template')
-async def convert_event_to_template(request: Request, gid: int, eid: int, kind: str = Form('recurring'), repeat_every: int = Form(1), repeat_unit: str = Form('week'), planning_horizon_days: int = Form(60), allow_multi_roles_per_user: int = Form(0)):
+async def convert_event_to_template(request: Request, gid: int, eid: int, kind: str = Form('recurring'), repeat_every: int = Form(1), repeat_unit: str = Form('week'), planning_horizon_days: int = Form(60), allow_multi_roles_per_user: int = Form(0), materialize_mode: str = Form('eager')):
     urow = _require_user(request)
     user_id = urow[0]
     role = RoleRepo.get_user_role(user_id, gid)
@@ -1834,7 +2258,7 @@ async def convert_event_to_template(request: Request, gid: int, eid: int, kind:
     unit_map = {'day': 'daily', 'week': 'weekly', 'month': 'monthly'}
     freq = unit_map.get(repeat_unit, 'weekly') if kind != 'one_time' else None
     interval = repeat_every if kind != 'one_time' else None
-    template_id = EventTemplateRepo.create(group_id, name, None, 'recurring' if kind != 'one_time' else 'one_time', time_str, tz, planning_horizon_days, allow_multi_roles_per_user, freq=freq, interval=interval, byweekday=None)
+    template_id = EventTemplateRepo.create(group_id, name, None, 'recurring' if kind != 'one_time' else 'one_time', time_str, tz, planning_horizon_days, allow_multi_roles_per_user, freq=freq, interval=interval, byweekday=None, materialize_mode=materialize_mode)
 
     # Link current event as generated occurrence for its datetime to avoid duplicate creation
     try:
@@ -1876,8 +2300,6 @@ async def group_audit(request: Request, gid: int):
     if not is_allowed:
         raise HTTPException(status_code=403, detail="Access denied")
 
-    page = int(request.query_params.get('page') or 1)
-    per_page = int(request.query_params.get('per_page') or 50)
     event_id = request.query_params.get('event_id')
     eflt = int(event_id) if event_id else None
 
@@ -1888,83 +2310,30 @@ async def group_audit(request: Request, gid: int):
     except Exception:
         audit_events = []
 
-    # Load audit rows
     try:
-        (audit_rows, audit_total) = AuditLogRepo.list(page=page, per_page=per_page, group_id=gid, event_id=eflt)
+        audit_ctx = _audit_page(request, gid, eflt)
     except Exception:
-        audit_rows, audit_total = [], 0
-
-    # Formatting helpers
-    def _fmt_ts(s: str) -> str:
-        from datetime import datetime as _dt
-        for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M"):
-            try:
-                return _dt.strptime(s, fmt).strftime("%d.%m.%Y %H:%M:%S")
-            except Exception:
-                continue
-        return s
-
-    action_map = {
-        'event_created': 'Создание',
-        'event_name_updated': 'Наименование',
-        'event_time_updated': 'Дата и время',
-        'event_responsible_updated': 'Ответственный',
-        'event_deleted': 'Удаление',
-        'event_booked': 'Бронь',
-        'event_unbooked': 'Отмена брони',
-        'role_booked': 'Бронь',
-        'role_unbooked': 'Отмена брони',
-        'role_requirement_added': 'Роль добавлена',
-        'role_requirement_removed': 'Роль удалена',
-        'notify_group': 'Групповое сообщение',
-        'notify_personal': 'Личное сообщение',
-        'group_notification_created': 'Групповое оповещение',
-        'group_notification_deleted': 'Групповое оповещение',
-        'personal_notification_created': 'Личное оповещение',
-        'personal_notification_deleted': 'Личное оповещение',
-        'member_display_name_updated': 'Имя участника',
-        'member_role_updated': 'Роль участника',
-        'member_removed': 'Удаление участника',
-        'member_added': 'Добавление участника',
-        'group_deleted': 'Удаление группы',
-    }
+        audit_ctx = {'audit_items': [], 'audit_total': 0, 'audit_page': 1, 'audit_per_page': 50, 'audit_newer': None, 'audit_older': None}
 
-    audit_items = []
-    for (_id, created_at, uid, action, gid_a, eid_a, oldv, newv) in audit_rows:
-        # user label
-        user_label = str(uid) if uid else '—'
-        try:
-            u = UserRepo.get_by_id(uid) if uid else None
-            if u:
-                _iid, _tid, _uname, _phone, _first, _last, *_rest = u
-                disp = (_first or '')
-                if _last:
-                    disp = f"{disp} {_last}".strip()
-                if not disp:
-                    disp = f"@{_uname}" if _uname else (str(_tid) if _tid else str(uid))
-                user_label = f"{disp} ({_tid})" if _tid else disp
-        except Exception:
-            pass
-        # event
-        event_name = None
-        try:
-            ev = EventRepo.get_by_id(eid_a) if eid_a else None
-            event_name = ev[1] if ev else None
-        except Exception:
-            event_name = None
-        audit_items.append({
-            'id': _id,
-            'ts': _fmt_ts(created_at),
-            'action': action,
-            'action_ru': action_map.get(action, action),
-            'user_label': user_label,
-            'event_id': eid_a,
-            'event_name': event_name,
-            'old': oldv,
-            'new': newv,
-        })
+    return render('group_audit.html', request=request, gid=gid, audit_events=audit_events, event_filter=(eflt or ''), group=GroupRepo.get_by_id(gid), project_name=PROJECT_NAME, **audit_ctx)
 
-    return render('group_audit.html', request=request, gid=gid, audit_items=audit_items, audit_total=audit_total, audit_page=page, audit_per_page=per_page, audit_events=audit_events, event_filter=(eflt or ''), group=GroupRepo.get_by_id(gid), project_name=PROJECT_NAME)
+@app.get('/api/audit/archive')
+async def audit_archive_search(request: Request, group_id: int | None = None, event_id: int | None = None,
+                               action: str | None = None, q: str | None = None, date_from: str | None = None,
+                               date_to: str | None = None, before: int | None = None, limit: int = 100):
+    """Поиск по архиву аудита (строки старше срока хранения). Суперадмин — по всем группам, владелец/админ — по своей."""
+    urow = _require_user(request)
+    if not is_superadmin(urow[1]):
+        if not group_id or RoleRepo.get_user_role(urow[0], group_id) not in ('owner', 'admin', 'superadmin'):
+            raise HTTPException(status_code=403, detail="Access denied")
+    from services.audit_archive import search as search_audit_archive
+    limit = max(1, min(int(limit or 100), 500))
+    items = await run_in_threadpool(search_audit_archive, group_id=group_id, event_id=event_id, action=action, text=q,
+                                    date_from=date_from, date_to=date_to, before_id=before, limit=limit)
+    for item in items:
+        item['ts'] = _fmt_audit_ts(item['created_at'] or '')
+        item['action_ru'] = AUDIT_ACTION_LABELS.get(item['action'], item['action'])
+    return JSONResponse({'items': items, 'next_before': items[-1]['id'] if len(items) == limit else None})
 
 @app.post('/group/{gid}/settings/admins/pending/{pid}/delete')
 async def delete_pending_invite(request: Request, gid: int, pid: int):
@@ -1994,6 +2363,7 @@ async def update_template_from_event(request: Request, gid: int, eid: int,
                                      planning_horizon_days: Optional[int] = Form(None),
                                      allow_multi_roles_per_user: Optional[int] = Form(None),
                                      regenerate: Optional[int] = Form(0),
+                                     materialize_mode: Optional[str] = Form(None),
                                      role_names: Optional[List[str]] = Form(None),
                                      roles_only: Optional[int] = Form(None)):
     urow = _require_user(request)
@@ -2003,7 +2373,7 @@ async def update_template_from_event(request: Request, gid: int, eid: int,
         raise HTTPException(status_code=403, detail="Access denied")
 
     # get template by event
-    with get_conn() as conn:
+    with get_conn(event_id=eid) as conn:
         cur = conn.cursor()
         cur.execute("SELECT template_id FROM template_generated_events WHERE event_id = ?", (eid,))
         row = cur.fetchone()
@@ -2028,7 +2398,7 @@ async def update_template_from_event(request: Request, gid: int, eid: int,
         EventTemplateRepo.update_basic(template_id, planning_horizon_days=new_horizon, allow_multi_roles_per_user=new_allow, freq=new_freq, interval=new_interval)
         # Set base_time to current event time so generation anchors from this event
         try:
-            with get_conn() as conn:
+            with get_conn(event_id=eid) as conn:
                 cur = conn.cursor()
                 # Read this event time
                 cur.execute("SELECT time FROM events WHERE id = ?", (eid,))
@@ -2041,6 +2411,8 @@ async def update_template_from_event(request: Request, gid: int, eid: int,
     elif allow_multi_roles_per_user is not None:
         # Allow updating only the multi-roles flag (when saving roles without touching periodicity)
         EventTemplateRepo.set_allow_multi_roles(template_id, allow_multi_roles_per_user)
+    if not roles_only and materialize_mode in ('eager', 'lazy'):
+        EventTemplateRepo.set_materialize_mode(template_id, materialize_mode)
 
     # Replace template roles if provided (one name per line; quantity not used)
     try:
@@ -2091,17 +2463,7 @@ async def update_template_from_event(request: Request, gid: int, eid: int,
 @app.get('/group/{gid}/analytics', response_class=HTMLResponse)
 async def group_analytics(request: Request, gid: int, start: str | None = None, end: str | None = None, user: int | None = None):
     urow = _require_user(request)
-    user_id = urow[0]
-    role = RoleRepo.get_user_role(user_id, gid)
-    try:
-        from config import SUPERADMIN_ID as CFG_SA
-    except Exception:
-        CFG_SA = None
-    is_superadmin_req = is_superadmin(urow[1])
-    if role is None and not is_superadmin_req:
-        events = EventRepo.list_by_group(gid)
-        if not any(BookingRepo.has_booking(user_id, eid) for eid, _, _, _ in events):
-            raise HTTPException(status_code=403, detail="Access denied")
+    _require_group_access(urow, gid)
 
     group = GroupRepo.get_by_id(gid)
     member_rows = GroupRepo.list_group_members(gid)
@@ -2117,74 +2479,27 @@ async def group_analytics(request: Request, gid: int, start: str | None = None,
             return None
         for fmt in ("%Y-%m-%d", "%Y-%m-%d %H:%M"):
             try:
-                return _dt.strptime(s, fmt)
+                return _dt.strptime(s, fmt), fmt == "%Y-%m-%d"
             except Exception:
                 continue
         return None
-    dt_start = parse_dt(start)
-    dt_end = parse_dt(end)
-
-    events = EventRepo.list_by_group(gid)
-    from collections import Counter
-    total_by_day = Counter()
-    responsible_set = set()
-    user_bookings_counter = Counter()  # Счетчик бронирований по пользователям
-    free_roles_counter = Counter()      # Счетчик свободных ролей
-    for eid, name, time_str, resp_uid in events:
-        try:
-            try:
-                t = _dt.strptime(time_str, "%Y-%m-%d %H:%M:%S")
-            except ValueError:
-                t = _dt.strptime(time_str, "%Y-%m-%d %H:%M")
-        except Exception:
-            continue
-        if dt_start and t < dt_start:
-            continue
-        if dt_end and t > dt_end:
-            continue
-        if user and user != 0:
-            if resp_uid != user:
-                booked = BookingRepo.list_event_bookings_with_names(gid, eid)
-                if not any(uid == user for uid, _name in booked):
-                    continue
-        day_key = t.strftime('%Y-%m-%d')
-        total_by_day[day_key] += 1
-        if resp_uid:
-            responsible_set.add(resp_uid)
-        try:
-            # Получаем статистику по фактическим бронированиям ролей
-            from services.repositories import EventRoleAssignmentRepo, EventRoleRequirementRepo
-            role_assignments = EventRoleAssignmentRepo.list_for_event(eid)
-            role_requirements = EventRoleRequirementRepo.list_for_event(eid)
-            
-            # Считаем бронирования по пользователям
-            for role_name, user_id in role_assignments:
-                # Получаем имя пользователя
-                user_row = UserRepo.get_by_id(user_id)
-                if user_row:
-                    display_name = DisplayNameRepo.get_display_name(gid, user_id)
-                    user_name = display_name if display_name else (f"@{user_row[2]}" if user_row[2] else str(user_id))
-                    user_bookings_counter[user_name] += 1
-            
-            # Считаем свободные роли
-            assigned_roles = {role_name for role_name, _ in role_assignments}
-            for role_name, required_count in role_requirements:
-                assigned_count = sum(1 for rname, _ in role_assignments if rname == role_name)
-                free_count = max(0, int(required_count or 0) - assigned_count)
-                if free_count > 0:
-                    free_roles_counter[role_name] += free_count
-        except Exception:
-            pass
-
-    daily = sorted(total_by_day.items())
-    user_bookings = sorted(user_bookings_counter.items(), key=lambda x: (-x[1], x[0]))
-    free_roles = sorted(free_roles_counter.items(), key=lambda x: (-x[1], x[0]))
-    stats = {
-        'events_total': sum(total_by_day.values()),
-        'unique_responsibles': len(responsible_set),
-        'total_bookings': sum(user_bookings_counter.values()),
-        'total_free_roles': sum(free_roles_counter.values()),
-    }
+    # Границы для SQL: начало включительно, конец исключительно; дата без времени в "По" включает весь день
+    time_from = time_to = None
+    parsed = parse_dt(start)
+    if parsed:
+        dt_start, date_only = parsed
+        time_from = dt_start.strftime('%Y-%m-%d' if date_only else '%Y-%m-%d %H:%M')
+    parsed = parse_dt(end)
+    if parsed:
+        dt_end, date_only = parsed
+        time_to = (dt_end + timedelta(days=1)).strftime('%Y-%m-%d') if date_only \
+            else (dt_end + timedelta(minutes=1)).strftime('%Y-%m-%d %H:%M')
+
+    summary = AnalyticsRepo.summary(gid, time_from, time_to, user or None)
+    daily = summary['daily']
+    user_bookings = summary['user_bookings']
+    free_roles = summary['free_roles']
+    stats = summary['stats']
 
     return render('group_analytics.html', group=group, members=members, daily=daily, user_bookings=user_bookings, free_roles=free_roles, stats=stats, request=request, gid=gid, start=start or '', end=end or '', user=user or 0, project_name=PROJECT_NAME)
 
@@ -2199,7 +2514,7 @@ async def update_event_roles(request: Request, gid: int, eid: int, allow_multi_r
         raise HTTPException(status_code=403, detail="Access denied")
     # Update event flag
     try:
-        with get_conn() as conn:
+        with get_conn(event_id=eid) as conn:
             cur = conn.cursor()
             cur.execute("UPDATE events SET allow_multi_roles_per_user = ? WHERE id = ?", (1 if allow_multi_roles_per_user else 0, eid))
             conn.commit()
@@ -2248,7 +2563,7 @@ async def admin_audit_delete(request: Request, aid: int):
 
     # Update event flag
     try:
-        with get_conn() as conn:
+        with get_conn(event_id=eid) as conn:
             cur = conn.cursor()
             cur.execute("UPDATE events SET allow_multi_roles_per_user = ? WHERE id = ?", (1 if allow_multi_roles_per_user else 0, eid))
             conn.commit()
@@ -2507,7 +2822,7 @@ async def delete_event(request: Request, gid: int, eid: int, tab: str | None = F
     return RedirectResponse(f"/group/{gid}{param_string}", status_code=303)
 
 @app.post('/group/{gid}/events/{eid}/book')
-async def book_event(request: Request, gid: int, eid: int, tab: str | None = Form(None), page: int | None = Form(None), per_page: int | None = Form(None)):
+async def book_event(request: Request, gid: int, eid: int, tab: str | None = Form(None), page: int | None = Form(None), per_page: int | None = Form(None), fragment: int | None = Form(None)):
     urow = _require_user(request)
     user_id = urow[0]
     
@@ -2519,12 +2834,12 @@ async def book_event(request: Request, gid: int, eid: int, tab: str | None = For
     print(f"EVENT BEFORE: {event}")
     if not event:
         print(f"BOOKING ERROR: event not found")
-        return RedirectResponse(f"/group/{gid}?ok=booking_error", status_code=303)
+        return _booking_result(request, urow, gid, eid, 'booking_error', fragment, f"/group/{gid}?ok=booking_error")
     
     # Check if user is already responsible
     if event[4] == user_id:  # user is already responsible
         print(f"BOOKING ERROR: user {user_id} is already responsible for event {eid}")
-        return RedirectResponse(f"/group/{gid}?ok=booking_error", status_code=303)
+        return _booking_result(request, urow, gid, eid, 'booking_error', fragment, f"/group/{gid}?ok=booking_error", tab, page, per_page)
     
     # Book the event - use set_responsible to create notifications
     print(f"UPDATING EVENT: setting responsible to {user_id}")
@@ -2553,7 +2868,7 @@ async def book_event(request: Request, gid: int, eid: int, tab: str | None = For
     param_string = "&".join(params)
     param_string = f"?ok=event_booked&{param_string}" if param_string else "?ok=event_booked"
     
-    return RedirectResponse(f"/group/{gid}{param_string}", status_code=303)
+    return _booking_result(request, urow, gid, eid, 'event_booked', fragment, f"/group/{gid}{param_string}", tab, page, per_page)
 
 
 @app.get('/group/{gid}/events/{eid}', response_class=HTMLResponse)
@@ -2571,7 +2886,7 @@ async def event_detail(request: Request, gid: int, eid: int):
 
 
 @app.post('/group/{gid}/events/{eid}/unbook')
-async def unbook_event(request: Request, gid: int, eid: int, tab: str | None = Form(None), page: int | None = Form(None), per_page: int | None = Form(None)):
+async def unbook_event(request: Request, gid: int, eid: int, tab: str | None = Form(None), page: int | None = Form(None), per_page: int | None = Form(None), fragment: int | None = Form(None)):
     urow = _require_user(request)
     user_id = urow[0]
     
@@ -2609,11 +2924,11 @@ async def unbook_event(request: Request, gid: int, eid: int, tab: str | None = F
     param_string = "&".join(params)
     param_string = f"?ok=unbooked&{param_string}" if param_string else "?ok=unbooked"
     
-    return RedirectResponse(url=f"/group/{gid}{param_string}", status_code=303)
+    return _booking_result(request, urow, gid, eid, 'unbooked', fragment, f"/group/{gid}{param_string}", tab, page, per_page)
 
 
 @app.post('/group/{gid}/events/{eid}/roles/{role_name}/book')
-async def book_role(request: Request, gid: int, eid: int, role_name: str, tab: str | None = Form(None), page: int | None = Form(None), per_page: int | None = Form(None), selected_user_id: int | None = Form(None)):
+async def book_role(request: Request, gid: int, eid: int, role_name: str, tab: str | None = Form(None), page: int | None = Form(None), per_page: int | None = Form(None), selected_user_id: int | None = Form(None), fragment: int | None = Form(None)):
     urow = _require_user(request)
     user_id = urow[0]
 
@@ -2625,16 +2940,16 @@ async def book_role(request: Request, gid: int, eid: int, role_name: str, tab: s
     # Validate role exists for this event
     reqs = {r: req for r, req in EventRoleRequirementRepo.list_for_event(eid)}
     if role_name not in reqs:
-        return RedirectResponse(f"/group/{gid}?ok=booking_error", status_code=303)
+        return _booking_result(request, urow, gid, eid, 'booking_error', fragment, f"/group/{gid}?ok=booking_error", tab, page, per_page)
 
     # Check if role already assigned
     assigned = {r: uid for r, uid in EventRoleAssignmentRepo.list_for_event(eid)}
     if role_name in assigned and assigned[role_name]:
-        return RedirectResponse(f"/group/{gid}?ok=booking_error", status_code=303)
+        return _booking_result(request, urow, gid, eid, 'booking_error', fragment, f"/group/{gid}?ok=booking_error", tab, page, per_page)
 
     # Check allow_multi_roles_per_user
     allow_multi = 0
-    with get_conn() as conn:
+    with get_conn(event_id=eid) as conn:
         cur = conn.cursor()
         cur.execute("SELECT allow_multi_roles_per_user FROM events WHERE id = ?", (eid,))
         row = cur.fetchone()
@@ -2644,7 +2959,7 @@ async def book_role(request: Request, gid: int, eid: int, role_name: str, tab: s
         # ensure user has no other role in this event
         for r, uid in assigned.items():
             if uid == target_user_id:
-                return RedirectResponse(f"/group/{gid}?ok=booking_error", status_code=303)
+                return _booking_result(request, urow, gid, eid, 'booking_error', fragment, f"/group/{gid}?ok=booking_error", tab, page, per_page)
 
     ok = 'event_booked'
     # Check whether user had any role before assignment
@@ -2678,11 +2993,11 @@ async def book_role(request: Request, gid: int, eid: int, role_name: str, tab: s
         params.append(f"per_page={per_page}")
     param_string = "&".join(params)
     param_string = f"?ok={ok}&{param_string}" if param_string else f"?ok={ok}"
-    return RedirectResponse(f"/group/{gid}{param_string}", status_code=303)
+    return _booking_result(request, urow, gid, eid, ok, fragment, f"/group/{gid}{param_string}", tab, page, per_page)
 
 
 @app.post('/group/{gid}/events/{eid}/roles/{role_name}/unbook')
-async def unbook_role(request: Request, gid: int, eid: int, role_name: str, tab: str | None = Form(None), page: int | None = Form(None), per_page: int | None = Form(None)):
+async def unbook_role(request: Request, gid: int, eid: int, role_name: str, tab: str | None = Form(None), page: int | None = Form(None), per_page: int | None = Form(None), fragment: int | None = Form(None)):
     urow = _require_user(request)
     user_id = urow[0]
 
@@ -2739,7 +3054,7 @@ async def unbook_role(request: Request, gid: int, eid: int, role_name: str, tab:
         params.append(f"per_page={per_page}")
     param_string = "&".join(params)
     param_string = f"?ok={ok}&{param_string}" if param_string else f"?ok={ok}"
-    return RedirectResponse(f"/group/{gid}{param_string}", status_code=303)
+    return _booking_result(request, urow, gid, eid, ok, fragment, f"/group/{gid}{param_string}", tab, page, per_page)
 
 @app.post('/group/{gid}/display-name/set')
 async def set_display_name(request: Request, gid: int, display_name: str = Form(...)):
@@ -2780,6 +3095,7 @@ async def update_member_role(request: Request, gid: int, uid: int, new_role: str
         return RedirectResponse(f"/group/{gid}/settings?ok=member_role_error", status_code=303)
 
     # Apply role change
+    affected = [uid]
     try:
         with get_conn() as conn:
             cur = conn.cursor()
@@ -2796,12 +3112,17 @@ async def update_member_role(request: Request, gid: int, uid: int, new_role: str
                 cur.execute("INSERT OR IGNORE INTO user_group_roles (user_id, group_id, role, confirmed) VALUES (?,?,?,1)", (uid, gid, 'owner'))
                 # Demote previous owner to admin if exists and different
                 if prev_owner and prev_owner != uid:
+                    affected.append(prev_owner)
                     cur.execute("DELETE FROM user_group_roles WHERE group_id = ? AND user_id = ?", (gid, prev_owner))
                     cur.execute("INSERT OR IGNORE INTO user_group_roles (user_id, group_id, role, confirmed) VALUES (?,?,?,1)", (prev_owner, gid, 'admin'))
             else:
                 # Set member or admin
                 cur.execute("INSERT OR IGNORE INTO user_group_roles (user_id, group_id, role, confirmed) VALUES (?,?,?,1)", (uid, gid, new_role))
             conn.commit()
+        # Роли и владелец живут в глобальной базе; в копию шарда группы — только затронутые участники
+        sync_replicas('user_group_roles', f"group_id = ? AND user_id IN ({', '.join('?' * len(affected))})", (gid, *affected), group_id=gid)
+        if new_role == 'owner':
+            sync_replicas('groups', 'id = ?', (gid,), group_id=gid)
         ok = 'member_role_saved'
     except Exception:
         ok = 'member_role_error'
@@ -2831,6 +3152,7 @@ async def remove_member(request: Request, gid: int, uid: int):
             cur = conn.cursor()
             cur.execute("DELETE FROM user_group_roles WHERE group_id = ? AND user_id = ?", (gid, uid))
             conn.commit()
+        sync_replicas('user_group_roles', 'group_id = ? AND user_id = ?', (gid, uid), group_id=gid)
         ok = 'member_removed'
         try:
             AuditLogRepo.add('member_removed', user_id=actor_id, group_id=gid, old_value=str(uid))